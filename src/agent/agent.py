@@ -1,86 +1,279 @@
+import asyncio
 import logging
 import os
+import signal
 import threading
 import importlib
+import inspect
+import json
 import pkgutil
+from concurrent.futures import ThreadPoolExecutor
 from . import agent_tools
 from dotenv import load_dotenv
 from .agent_config import AgentConfig
+from .agent_logging import configure_logging
+from .metrics import MetricsReporter, MetricsServer
+from .scheduler import Scheduler
 
 logger = logging.getLogger(__name__)
-logging.basicConfig(format="%(levelname)s: %(message)s", level=logging.INFO)
 
 class Agent:
     def __init__(self):
+        # Load config
+        self.config = AgentConfig()
+
+        # Write logs from a separate thread
+        configure_logging(self.config)
         logger.info("[AGENT] Initializing agent...")
-        
+
         # Load environment variables
         load_dotenv()
 
-        # Load config
-        self.config = AgentConfig()
-
         # Initialize model (done separately because it's used by other tools)
         from .agent_tools.model.model import Model
         self.model = Model(
             api_key=os.getenv("MODEL_API_KEY")
         )
 
+        # Scheduler that runs the periodic jobs of all tools and accounts
+        self.scheduler = Scheduler()
+
+        # Executor of the blocking requests of all tools. Jobs can wait for
+        # requests that they submit to it, so it needs more threads than jobs
+        # run at the same time
+        if self.config.EXECUTOR_THREADS <= self.config.SCHEDULER_THREADS:
+            raise ValueError("[AGENT] EXECUTOR_THREADS must be greater than SCHEDULER_THREADS")
+        self.executor = ThreadPoolExecutor(max_workers=self.config.EXECUTOR_THREADS, thread_name_prefix="agent-io")
+
         # Load and initialize tools
         self.tools = {}
         self.__load_tools()
 
 
     def __load_tools(self):
-        """Automatically load all tools from the agent_tools directory."""
+        """
+        Automatically load all enabled tools from the agent_tools directory.
+
+        Disabled tools are not imported, enabled tools are imported and
+        initialized concurrently. A tool that has accounts in the accounts file
+        is initialized once per account, otherwise it is initialized once with
+        its environment variables.
+        """
         
         logger.info(f"[AGENT] Loading agent tools...")
-        for _, name, _ in pkgutil.iter_modules(agent_tools.__path__):
+        names = [
+            name for _, name, _ in pkgutil.iter_modules(agent_tools.__path__)
             # Skip model module because it's handled separately
-            if name == 'model':
-                continue
+            if name != 'model'
+            # Check if tool is enabled in agent config
+            and getattr(self.config, f"{name.upper()}_ENABLED", False)
+        ]
+        accounts = self.__load_accounts()
+
+        instances = []
+        for name in names:
+            if name in accounts:
+                instances += [(f"{name}:{account['name']}", name, account) for account in accounts[name]]
+            else:
+                instances.append((name, name, None))
+        if not instances:
+            return
+
+        with ThreadPoolExecutor(max_workers=len(instances), thread_name_prefix="load-tool") as executor:
+            tools = list(executor.map(lambda instance: self.__load_tool(*instance), instances))
+        for (key, _, _), tool in zip(instances, tools):
+            if tool is not None:
+                self.tools[key] = tool
+
+
+    def __load_accounts(self):
+        """
+        Returns the accounts in the accounts file by tool name.
+
+        The file maps tool names to lists of accounts. Each account has a
+        `name`, the `credentials` that are passed to the tool (values can refer
+        to environment variables, e.g. "$ALPHA_TWITTER_BEARER_TOKEN") and
+        optional `config` values that override the tool's configuration.
+        """
+        if not self.config.ACCOUNTS_PATH:
+            return {}
+        with open(self.config.ACCOUNTS_PATH) as file:
+            accounts = json.load(file)
+        for name, tool_accounts in accounts.items():
+            account_names = [account.get("name") for account in tool_accounts]
+            if None in account_names or len(set(account_names)) != len(account_names):
+                raise Exception(f"[AGENT] Every {name} account needs a unique name in {self.config.ACCOUNTS_PATH}")
+        logger.info(f"[AGENT] Loaded {sum(map(len, accounts.values()))} accounts from {self.config.ACCOUNTS_PATH}.")
+        return accounts
 
-            try:
-                logger.info(f"[AGENT] Loading {name} tool...")
-                # Import module
-                module = importlib.import_module(f".agent_tools.{name}.{name}", package=__package__)
-                
-                # Get main class (assumed to be capitalized version of the module name)
-                tool_class = getattr(module, name.capitalize())
-                
-                # Check if tool is enabled in agent config
-                if getattr(self.config, f"{name.upper()}_ENABLED", False):
-                    # Get required environment variables
-                    env_vars = {
-                        key.replace(f"{name.upper()}_", "").lower(): os.getenv(key)
-                        for key in os.environ
-                        if key.startswith(f"{name.upper()}_")
-                    }
-                    
-                    # Initialize tool with environment variables and model
-                    self.tools[name] = tool_class(**env_vars, model=self.model)
-                    logger.info(f"[AGENT] Loaded {name} tool.")
-            except Exception as e:
-                logger.error(f"[AGENT] Failed to load {name} tool. Error: {str(e)}.")
+
+    def __load_config(self, name, account):
+        """
+        Returns the configuration of a tool for an account.
+
+        Paths of files that the tool writes (`*_PATH` values) are made unique
+        per account unless the account overrides them.
+        """
+        module = importlib.import_module(f".agent_tools.{name}.{name}_config", package=__package__)
+        config = getattr(module, f"{name.capitalize()}Config")()
+        config.ACCOUNT = account["name"]
+        overrides = account.get("config", {})
+        for key, value in vars(config).items():
+            if key.endswith("_PATH") and key not in overrides and isinstance(value, str) and value != ":memory:":
+                root, extension = os.path.splitext(value)
+                setattr(config, key, f"{root}_{account['name']}{extension}")
+        for key, value in overrides.items():
+            setattr(config, key, value)
+        return config
+
+
+    def __load_tool(self, key, name, account=None):
+        """Imports and initializes a tool, returns `None` if that fails."""
+        try:
+            logger.info(f"[AGENT] Loading {key} tool...")
+            # Import module
+            module = importlib.import_module(f".agent_tools.{name}.{name}", package=__package__)
+            
+            # Get main class (assumed to be capitalized version of the module name)
+            tool_class = getattr(module, name.capitalize())
+            
+            if account is None:
+                # Get required environment variables
+                kwargs = {
+                    key.replace(f"{name.upper()}_", "").lower(): os.getenv(key)
+                    for key in os.environ
+                    if key.startswith(f"{name.upper()}_")
+                }
+            else:
+                # Get credentials and configuration of the account
+                kwargs = {
+                    credential: os.path.expandvars(value) if isinstance(value, str) else value
+                    for credential, value in account.get("credentials", {}).items()
+                }
+                kwargs["config"] = self.__load_config(name, account)
+
+            # Share the scheduler with tools that run periodic jobs and the
+            # executor with tools that make blocking requests
+            parameters = inspect.signature(tool_class).parameters
+            if "scheduler" in parameters:
+                kwargs["scheduler"] = self.scheduler
+            if "executor" in parameters:
+                kwargs["executor"] = self.executor
+            
+            # Initialize tool with its arguments and the shared model
+            tool = tool_class(**kwargs, model=self.model)
+            logger.info(f"[AGENT] Loaded {key} tool.")
+            return tool
+        except Exception as e:
+            logger.error(f"[AGENT] Failed to load {key} tool. Error: {str(e)}.")
+            return None
 
 
     def run(self):
-        """Run the agent and all enabled tools."""
+        """Run the agent and all enabled tools until it is stopped."""
+        asyncio.run(self.arun())
+
+
+    async def arun(self):
+        """
+        Run the agent and all enabled tools on the running event loop.
+
+        Tools with an `arun` coroutine run as tasks of the loop, other tools
+        run their blocking `run` method in a thread of their own. Blocking
+        requests of all tools share one executor with `EXECUTOR_THREADS`
+        threads. The agent stops on SIGINT or SIGTERM (or when it is
+        cancelled): tools are cancelled and given `SHUTDOWN_TIMEOUT` seconds
+        to finish, then the model's connections are closed.
+        """
 
         logger.info("[AGENT] Running agent...")
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(self.executor)
+
+        stopped = asyncio.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signum, stopped.set)
+            except (NotImplementedError, RuntimeError):
+                # Signals can only be handled on the main thread on Unix
+                pass
+
+        # Set up the model API while the tools start
+        def connected(future):
+            if not future.cancelled() and future.exception() is not None:
+                logger.error(f"[AGENT] Failed to connect to the model API. Error: {str(future.exception())}.")
+        loop.run_in_executor(None, self.model.connect).add_done_callback(connected)
+
+        # Export metrics
+        tasks = []
+        metrics_server = None
+        if self.config.METRICS_PORT is not None:
+            metrics_server = MetricsServer(self.config.METRICS_PORT).start()
+        if self.config.METRICS_LOG_INTERVAL:
+            tasks.append(asyncio.create_task(MetricsReporter(self.config.METRICS_LOG_INTERVAL).arun(), name="metrics-reporter"))
+
+        # Start each tool as a task
+        logger.info("[AGENT] Running agent tools...")
+        tools = [
+            asyncio.create_task(self.__run_tool(name, tool), name=name)
+            for name, tool in self.tools.items()
+        ]
+
+        # Run the jobs that the tools have scheduled
+        uses_scheduler = any(getattr(tool, "scheduler", None) is self.scheduler for tool in self.tools.values())
+        if uses_scheduler:
+            tasks.append(asyncio.create_task(self.scheduler.arun(concurrency=self.config.SCHEDULER_THREADS), name="scheduler"))
 
-        # Start each tool in a separate thread
-        threads = []
-        logger.info(f"[AGENT] Running agent tools...")
-        for name, tool in self.tools.items():
+        # Run until the agent is stopped or all tools have finished
+        waiter = asyncio.create_task(stopped.wait())
+        finished = asyncio.gather(*tools, return_exceptions=True)
+        try:
+            await asyncio.wait([waiter, finished], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            logger.info("[AGENT] Stopping agent...")
+            waiter.cancel()
+            self.scheduler.stop()
+            for task in tools + tasks:
+                task.cancel()
+            if tools + tasks:
+                _, pending = await asyncio.wait(tools + tasks, timeout=self.config.SHUTDOWN_TIMEOUT)
+                for task in pending:
+                    logger.warning(f"[AGENT] {task.get_name()} did not stop within {self.config.SHUTDOWN_TIMEOUT:.0f} seconds.")
+
+            if metrics_server is not None:
+                metrics_server.stop()
             try:
-                thread = threading.Thread(target=tool.run)
-                thread.start()
-                threads.append(thread)
-                logger.info(f"[AGENT] Running {name} tool...")
+                await self.model.aclose()
             except Exception as e:
-                logger.error(f"[AGENT] Failed to run {name} tool. Error: {str(e)}.")
+                logger.error(f"[AGENT] Failed to close the model. Error: {str(e)}.")
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            logger.info("[AGENT] Agent stopped.")
+
+
+    async def __run_tool(self, name, tool):
+        """Runs a tool until it finishes or is cancelled."""
+        try:
+            logger.info(f"[AGENT] Running {name} tool...")
+            if inspect.iscoroutinefunction(getattr(tool, "arun", None)):
+                await tool.arun()
+            else:
+                # Tools without an async interface get a thread of their own,
+                # so that they don't hold a thread of the shared executor
+                future = asyncio.get_running_loop().create_future()
+
+                def run():
+                    try:
+                        tool.run()
+                        result = None
+                    except BaseException as e:
+                        result = e
+                    future.get_loop().call_soon_threadsafe(lambda: future.done() or future.set_result(result))
 
-        # Wait for all threads to finish
-        for thread in threads:
-            thread.join()
\ No newline at end of file
+                threading.Thread(target=run, daemon=True, name=name).start()
+                error = await future
+                if error is not None:
+                    raise error
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"[AGENT] Failed to run {name} tool. Error: {str(e)}.")
@@ -1,4 +1,44 @@
 class AgentConfig:
     def __init__(self):
         self.TWITTER_ENABLED = True
-        self.DISCORD_ENABLED = True
\ No newline at end of file
+        self.DISCORD_ENABLED = True
+
+        # Port of the Prometheus metrics endpoint, disabled if None
+        self.METRICS_PORT = None
+        # Number of seconds between metric summaries in the log, disabled if None
+        self.METRICS_LOG_INTERVAL = 600
+
+        # Path of a JSON file with the accounts of each tool, for running
+        # several accounts in one agent (None to run one account per tool
+        # with the credentials in the environment variables)
+        self.ACCOUNTS_PATH = None
+
+        # Number of periodic jobs of all tools and accounts (e.g. Twitter
+        # searches and posts) that run at the same time
+        self.SCHEDULER_THREADS = 4
+
+        # Number of threads that all tools share for blocking requests (e.g.
+        # to the X API and Twitter searches and responses), the tools
+        # themselves run on a single event loop. Must be greater than
+        # SCHEDULER_THREADS
+        self.EXECUTOR_THREADS = 16
+
+        # Number of seconds that tools are given to finish when the agent is
+        # stopped (e.g. with Ctrl+C or SIGTERM)
+        self.SHUTDOWN_TIMEOUT = 10.0
+
+        # Minimum level of log records (e.g. "DEBUG", "INFO", "WARNING")
+        self.LOG_LEVEL = "INFO"
+        # Format of log records, "text" or "json" (one JSON object per line)
+        self.LOG_FORMAT = "text"
+        # Path of the log file, logs are written to stderr if None
+        self.LOG_PATH = None
+        # Maximum number of records that wait to be written, records are
+        # dropped when it is reached so that tools never wait for the log
+        self.LOG_QUEUE_SIZE = 10000
+        # Maximum number of characters of logged payloads (e.g. messages,
+        # responses and conversations), None to log them in full
+        self.LOG_PAYLOAD_MAX_LENGTH = 1000
+        # Only every LOG_SAMPLE_EVERY-th record of high-volume events (e.g.
+        # received Discord messages) is logged
+        self.LOG_SAMPLE_EVERY = 10
@@ -0,0 +1,172 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+from pprint import pformat
+from .metrics import get_registry
+
+# Pass as `extra` to log a high-volume event only every `LOG_SAMPLE_EVERY`
+# times, e.g. logger.info("[DISCORD] Message received: %s", payload, extra=SAMPLED)
+SAMPLED = {"sampled": True}
+
+# Default maximum length of payloads in the log, set by `configure_logging`
+payload_max_length = 1000
+
+_listener = None
+
+
+class Payload:
+    """
+    A value that is formatted for the log only if the record is emitted.
+
+    Pass it as an argument of a log call instead of formatting the value in
+    an f-string, so that filtered records cost nothing and emitted records
+    are formatted off the calling thread. Values that are not strings are
+    pretty-printed, and the result is cut to `max_length` characters.
+    """
+
+    __slots__ = ("value", "max_length")
+
+
+    def __init__(self, value, max_length=None):
+        self.value = value
+        self.max_length = max_length
+
+
+    def __str__(self):
+        text = self.value if isinstance(self.value, str) else pformat(self.value)
+        max_length = payload_max_length if self.max_length is None else self.max_length
+        if max_length is not None and len(text) > max_length:
+            text = f"{text[:max_length]}... ({len(text) - max_length} more characters)"
+        return text
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps the first and then every `every`-th record of each sampled event.
+
+    Events are records that were logged with `extra=SAMPLED` and share a
+    logger and a message template. Records that are kept are annotated with
+    the sampling rate, other records pass unchanged.
+    """
+
+
+    def __init__(self, every):
+        super().__init__()
+        self.every = max(1, every)
+        self.__counts = {}
+        self.__lock = threading.Lock()
+
+
+    def filter(self, record):
+        if not getattr(record, "sampled", False) or self.every == 1:
+            return True
+        key = (record.name, record.msg)
+        with self.__lock:
+            count = self.__counts.get(key, 0)
+            self.__counts[key] = count + 1
+        if count % self.every:
+            return False
+        record.sampled = self.every
+        return True
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to the logging thread without formatting them.
+
+    If the queue is full the record is dropped instead of blocking the
+    calling thread or event loop.
+    """
+
+
+    def __init__(self, queue):
+        super().__init__(queue)
+        self.dropped_metric = get_registry().counter("log_records_dropped_total", "Number of log records that were dropped because the log queue was full.")
+
+
+    def prepare(self, record):
+        # The listener runs in the same process, so the record is passed as
+        # it is and formatted by the listener's handlers
+        return record
+
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped_metric.inc()
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as JSON objects, one per line."""
+
+
+    def format(self, record):
+        entry = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "sampled", False):
+            entry["sampled"] = record.sampled
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def configure_logging(config):
+    """
+    Sends the records of all loggers through a queue to a logging thread
+    that formats and writes them.
+
+    Args:
+        config (AgentConfig): Provides `LOG_LEVEL`, `LOG_FORMAT`, `LOG_PATH`,
+            `LOG_QUEUE_SIZE`, `LOG_PAYLOAD_MAX_LENGTH` and `LOG_SAMPLE_EVERY`.
+    """
+    global _listener, payload_max_length
+
+    if config.LOG_PATH:
+        handler = logging.FileHandler(config.LOG_PATH, encoding="utf-8")
+    else:
+        handler = logging.StreamHandler(sys.stderr)
+    if config.LOG_FORMAT == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(levelname)s: %(message)s"))
+
+    queue_handler = NonBlockingQueueHandler(queue.Queue(config.LOG_QUEUE_SIZE or 0))
+    queue_handler.addFilter(SamplingFilter(config.LOG_SAMPLE_EVERY))
+    payload_max_length = config.LOG_PAYLOAD_MAX_LENGTH
+
+    # Replace the handlers of a previous configuration
+    stop_logging()
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(queue_handler)
+    root.setLevel(config.LOG_LEVEL)
+
+    _listener = logging.handlers.QueueListener(queue_handler.queue, handler)
+    _listener.start()
+
+
+@atexit.register
+def stop_logging():
+    """Writes the records that are still queued and stops the logging thread."""
+    global _listener
+    if _listener is not None:
+        try:
+            _listener.stop()
+        except queue.Full:
+            # The logging thread is a daemon, it stops with the interpreter
+            pass
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
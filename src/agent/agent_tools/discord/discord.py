@@ -1,50 +1,291 @@
+import asyncio
 import discord
 import logging
+import random
+import time
+from collections import OrderedDict
+from ...agent_logging import SAMPLED, Payload
+from ...metrics import get_registry
+from ..model.model_dedup import NearDuplicateIndex
+from ..model.model_prompt import PromptBuilder
+from ..model.model_scheduler import INTERACTIVE
 from .discord_config import DiscordConfig
+from .discord_queue import MessageQueue
+from .discord_triggers import MessageFilter
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
-logging.basicConfig(format="%(levelname)s: %(message)s")
 
 class Discord(discord.Client):
     def __init__(
             self,
             token,
-            model):
+            model,
+            config=None):
         logger.info("[DISCORD] Initializing Discord client...")
         self.token = token
         self.model = model
-        self.config = DiscordConfig()
+        self.config = config or DiscordConfig()
+        self.prompt_builder = PromptBuilder(
+            turn_format=self.config.MESSAGE_FORMAT,
+            token_budget=self.config.PROMPT_TOKEN_BUDGET
+        )
+
+        # Set up metrics
+        metrics = get_registry().labeled(account=self.config.ACCOUNT)
+        self.messages_metric = metrics.counter("discord_messages_total", "Number of messages received.")
+        self.in_flight_metric = metrics.gauge("discord_messages_in_flight", "Number of messages that are being responded to.")
+        self.first_reply_metric = metrics.histogram("discord_first_reply_seconds", "Time from receiving a message until the first part of the response was sent.")
+        self.reply_metric = metrics.histogram("discord_reply_seconds", "Time from receiving a message until the complete response was sent.")
+        self.errors_metric = metrics.counter("discord_errors_total", "Number of messages that could not be responded to.")
+        self.coalesced_metric = metrics.counter("discord_messages_coalesced_total", "Number of messages that were merged into a waiting message of the same user.")
+        self.dropped_metric = metrics.counter("discord_messages_dropped_total", "Number of messages that were not responded to because of load, by reason.")
+        self.filtered_metric = metrics.counter("discord_messages_filtered_total", "Number of messages that were not responded to because of the trigger rules, by reason.")
+        self.queue_metric = metrics.gauge("discord_queue_depth", "Number of messages that are waiting for a worker.")
+        self.duplicates_metric = metrics.counter("discord_messages_duplicate_total", "Number of messages that were nearly the same as a recently responded message, by action.")
+
+        # Messages are responded to by a fixed number of workers, rapid-fire
+        # messages of a user are coalesced and messages are dropped when the
+        # queue is full
+        self.queue = MessageQueue(
+            max_size=self.config.QUEUE_SIZE,
+            coalesce_window=self.config.COALESCE_WINDOW,
+            coalesce_max_messages=self.config.COALESCE_MAX_MESSAGES
+        )
+        self.workers = []
+
+        # Messages that the agent shouldn't respond to are filtered out
+        # before they are queued
+        self.message_filter = MessageFilter(self.config)
+
+        # Near-duplicates of recently responded messages in the same channel
+        # are answered with the earlier response or skipped, instead of
+        # querying the model. Each channel has its own index, the least
+        # recently used ones are dropped
+        self.duplicates = None
+        if self.config.DUPLICATE_ACTION is not None:
+            if self.config.DUPLICATE_ACTION not in ("reuse", "skip"):
+                raise ValueError(f"[DISCORD] Unknown duplicate action {self.config.DUPLICATE_ACTION}, must be \"reuse\", \"skip\" or None")
+            self.duplicates = OrderedDict()
     
 
-    def run(self):
+    def __duplicate_index(self, message):
+        """Returns the near-duplicate index of the channel of a message."""
+        key = (message.guild.id if message.guild is not None else None, message.channel.id)
+        index = self.duplicates.get(key)
+        if index is None:
+            index = NearDuplicateIndex(
+                threshold=self.config.DUPLICATE_SIMILARITY,
+                window=self.config.DUPLICATE_WINDOW,
+                max_entries=self.config.DUPLICATE_MAX_ENTRIES
+            )
+            self.duplicates[key] = index
+            while len(self.duplicates) > self.config.DUPLICATE_MAX_CHANNELS:
+                self.duplicates.popitem(last=False)
+        else:
+            self.duplicates.move_to_end(key)
+        return index
+
+
+    def __setup_client(self):
         logger.info("[DISCORD] Starting Discord client...")
 
         intents = discord.Intents.default()
         intents.message_content = True
 
         super().__init__(intents=intents)
-        super().run(self.token, log_level=logging.WARNING)
+        # Log through the agent's log handlers instead of discord.py's own
+        logging.getLogger("discord").setLevel(logging.WARNING)
+
+
+    def run(self):
+        self.__setup_client()
+        super().run(self.token, log_handler=None)
+
+
+    async def arun(self):
+        """Runs the client on the running event loop until it is cancelled."""
+        self.__setup_client()
+        try:
+            await self.start(self.token)
+        finally:
+            for worker in self.workers:
+                worker.cancel()
+            await asyncio.gather(*self.workers, return_exceptions=True)
+            self.workers = []
+            await self.close()
 
 
     async def on_ready(self):
-        logging.info(f"[DISCORD] Connected to discord bot {self.user.name} with id {self.user.id}.")
+        logger.info("[DISCORD] Connected to discord bot %s with id %s.", self.user.name, self.user.id)
 
 
     async def on_message(self, message):
-        logging.info(f"[DISCORD] Message received: {message.content}")
         if message.author == self.user:
             return
+        logger.info("[DISCORD] Message received: %s", Payload(message.content), extra=SAMPLED)
+
+        self.messages_metric.inc()
+        reason = self.message_filter.check(message, self.user)
+        if reason is not None:
+            self.filtered_metric.inc(reason=reason)
+            return
+
+        self.__start_workers()
+        result = self.queue.put(message)
+        if result == MessageQueue.COALESCED:
+            self.coalesced_metric.inc()
+        elif result == MessageQueue.DROPPED:
+            self.dropped_metric.inc(reason="queue_full")
+            logger.warning("[DISCORD] Queue is full, dropped message %s.", message.id, extra=SAMPLED)
+        self.queue_metric.set(len(self.queue))
+
+
+    def __start_workers(self):
+        """Starts the workers on the running event loop if they aren't running."""
+        if self.workers:
+            return
+        self.workers = [
+            asyncio.create_task(self.__work()) for _ in range(self.config.WORKERS)
+        ]
+
 
-        prompt = f"{self.config.RESPONSE_PROMPT} {message.content}"
+    async def __work(self):
+        """Responds to batches of messages from the queue."""
+        while True:
+            batch = await self.queue.get()
+            self.queue_metric.set(len(self.queue))
+            try:
+                # Replies that would arrive long after the messages are shed
+                if time.perf_counter() - batch.received > self.config.MAX_QUEUE_AGE:
+                    self.dropped_metric.inc(len(batch.messages), reason="stale")
+                    logger.warning("[DISCORD] Dropped %d stale message(s) in channel %s.", len(batch.messages), batch.key[0], extra=SAMPLED)
+                    continue
+                await self.__respond(batch)
+            finally:
+                self.queue.task_done()
+
+
+    async def __respond(self, batch):
+        """Responds to a batch of messages with a single reply."""
+        message = batch.message
+        received = batch.received
+        self.in_flight_metric.inc()
+
+        text = "\n".join(queued.content for queued in batch.messages)
+        prompt = self.prompt_builder.build(
+            self.config.RESPONSE_PROMPT,
+            [{"author": queued.author.display_name, "text": queued.content} for queued in batch.messages]
+        )
         try:
-            # Generate response using model
-            response = self.model.query(prompt)
-            logging.info(f"[DISCORD] Response: {response}")
-        
-            # Post response
-            logging.info("[DISCORD] Sending response...")
-            await message.channel.send(response)
+            duplicates = self.__duplicate_index(message) if self.duplicates is not None else None
+            if duplicates is not None:
+                earlier_response, similarity = duplicates.find(text)
+                if similarity:
+                    self.duplicates_metric.inc(action=self.config.DUPLICATE_ACTION)
+                    if self.config.DUPLICATE_ACTION == "skip":
+                        logger.info("[DISCORD] Skipping message %s, it is a near-duplicate of a recent message.", message.id, extra=SAMPLED)
+                        return
+                    response = random.choice(self.config.DUPLICATE_TEMPLATES).format(response=earlier_response)
+                    logger.info("[DISCORD] Reusing response to a near-duplicate message: %s", Payload(response))
+                    await self.__send_response(message, response, received)
+                    return
+
+            if self.config.STREAM_MODE:
+                # Generate response using model and post it as it arrives
+                response = await self.__stream_response(message, prompt, received)
+                logger.info("[DISCORD] Response: %s", Payload(response))
+                self.reply_metric.observe(time.perf_counter() - received)
+            else:
+                # Generate response using model
+                response = await self.model.aquery(prompt, priority=INTERACTIVE, tool="discord")
+                logger.info("[DISCORD] Response: %s", Payload(response))
+                await self.__send_response(message, response, received)
+
+            if duplicates is not None and response.strip():
+                duplicates.add(text, response)
 
         except Exception as e:
-            logging.exception(f"[DISCORD] Error responding to message {message.id}. {e}")
\ No newline at end of file
+            self.errors_metric.inc()
+            logger.exception("[DISCORD] Error responding to message %s. %s", message.id, e)
+
+        finally:
+            self.in_flight_metric.dec()
+
+
+    async def __send_response(self, message, response, received):
+        """Posts a complete response, split into messages of up to `MESSAGE_CHARACTER_LIMIT` characters."""
+        logger.debug("[DISCORD] Sending response...")
+        limit = self.config.MESSAGE_CHARACTER_LIMIT
+        for start in range(0, len(response), limit):
+            await message.channel.send(response[start:start + limit])
+            if not start:
+                self.first_reply_metric.observe(time.perf_counter() - received)
+        self.reply_metric.observe(time.perf_counter() - received)
+
+
+    async def __stream_response(self, message, prompt, received):
+        """
+        Streams a response to a message into the message's channel.
+
+        A placeholder message is posted as soon as the first non-empty chunk
+        arrives and is then edited with the accumulated response at most once
+        every `STREAM_EDIT_INTERVAL` seconds. Responses that exceed
+        `MESSAGE_CHARACTER_LIMIT` are continued in a new message.
+
+        Returns the complete response as a string. `received` is the
+        `time.perf_counter()` at which the message was received.
+        """
+        limit = self.config.MESSAGE_CHARACTER_LIMIT
+        chunks = []
+        text = ""           # Text of the message that is currently streamed
+        shown = ""          # Text that discord currently shows for it
+        sent = None         # Message that is currently streamed
+        last_edit = 0.0
+        replied = False
+
+        async def send(content):
+            nonlocal replied
+            new_message = await message.channel.send(content)
+            if not replied:
+                self.first_reply_metric.observe(time.perf_counter() - received)
+                replied = True
+            return new_message
+
+        async for chunk in self.model.astream(prompt, priority=INTERACTIVE, tool="discord"):
+            chunks.append(chunk)
+            text += chunk
+
+            # Continue the response in a new message once the current one
+            # is full
+            while len(text) > limit:
+                if sent is None:
+                    await send(text[:limit])
+                elif shown != text[:limit]:
+                    await sent.edit(content=text[:limit])
+                text = text[limit:]
+                sent = None
+                shown = ""
+
+            # Discord rejects empty messages
+            if not text.strip():
+                continue
+
+            now = time.monotonic()
+            if sent is None:
+                logger.debug("[DISCORD] Sending response...")
+                sent = await send(text)
+                shown = text
+                last_edit = now
+            elif now - last_edit >= self.config.STREAM_EDIT_INTERVAL:
+                await sent.edit(content=text)
+                shown = text
+                last_edit = now
+
+        # Flush the text that arrived since the last edit
+        if text.strip():
+            if sent is None:
+                await send(text)
+            elif shown != text:
+                await sent.edit(content=text)
+
+        return "".join(chunks)
\ No newline at end of file
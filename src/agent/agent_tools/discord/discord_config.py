@@ -3,3 +3,98 @@ class DiscordConfig:
         # Prompt that is provided to model, along with discord message, to
         # generate a response
         self.RESPONSE_PROMPT = "Respond to this discord message."
+
+        # If true agent will post its response as soon as the first part of it
+        # has been generated and will edit the message as the rest of the
+        # response is generated
+        self.STREAM_MODE = True
+
+        # Minimum number of seconds between edits of a streamed response
+        # (discord allows roughly 5 edits per 5 seconds per channel)
+        self.STREAM_EDIT_INTERVAL = 1.2
+
+        # Maximum number of characters in a single discord message, longer
+        # responses are split across multiple messages
+        self.MESSAGE_CHARACTER_LIMIT = 2000
+
+        # Format of a discord message in the prompt that is provided to the
+        # model (can use the fields author and text)
+        self.MESSAGE_FORMAT = "{author}: {text}"
+
+        # Maximum number of tokens of the prompt that is provided to the model
+        # to generate a response, longer messages are truncated (None for no
+        # limit)
+        self.PROMPT_TOKEN_BUDGET = 1024
+
+        # Number of responses that are generated at the same time
+        self.WORKERS = 4
+
+        # Maximum number of messages that wait for a response, counting each
+        # message of a coalesced batch, further messages are dropped until
+        # the queue has room again
+        self.QUEUE_SIZE = 500
+
+        # Number of seconds to wait for further messages of the same user in
+        # the same channel before responding to all of them at once (0 to
+        # respond right away)
+        self.COALESCE_WINDOW = 1.0
+
+        # Maximum number of messages that are responded to at once
+        self.COALESCE_MAX_MESSAGES = 10
+
+        # Number of seconds after which a message that is still waiting for
+        # a response is dropped
+        self.MAX_QUEUE_AGE = 60.0
+
+        # If true messages written by bots (including other agents) are
+        # ignored
+        self.IGNORE_BOTS = True
+
+        # IDs of the guilds (servers) and channels the agent responds in (empty
+        # to respond in all of them)
+        self.GUILD_ALLOWLIST = []
+        self.CHANNEL_ALLOWLIST = []
+
+        # Minimum number of characters of a message that is responded to,
+        # messages without text (e.g. only attachments) are ignored
+        self.MIN_MESSAGE_LENGTH = 1
+
+        # If true the agent only responds to messages that mention it, reply
+        # to it or match one of the trigger keywords or patterns
+        self.REQUIRE_TRIGGER = False
+        self.RESPOND_TO_MENTIONS = True
+        self.RESPOND_TO_REPLIES = True
+
+        # Words and regular expressions that trigger a response (case
+        # insensitive)
+        self.TRIGGER_KEYWORDS = []
+        self.TRIGGER_PATTERNS = []
+
+        # What the agent does with a message that is nearly the same as a
+        # message it responded to recently in the same channel: "reuse" sends
+        # the earlier response again (formatted with one of
+        # DUPLICATE_TEMPLATES), "skip" ignores the message and None responds
+        # to it as usual. Messages that differ in a few characters (e.g.
+        # "stake" and "unstake") can be near-duplicates, and reused responses
+        # may have been written for another user, so only enable this for
+        # channels with many repeated messages
+        self.DUPLICATE_ACTION = None
+
+        # Similarity (from 0 to 1) above which a message is a near-duplicate
+        self.DUPLICATE_SIMILARITY = 0.8
+
+        # Number of seconds for which responded messages are remembered, the
+        # maximum number of remembered messages per channel and the maximum
+        # number of channels whose messages are remembered
+        self.DUPLICATE_WINDOW = 600.0
+        self.DUPLICATE_MAX_ENTRIES = 500
+        self.DUPLICATE_MAX_CHANNELS = 1000
+
+        # Templates of reused responses, formatted with the earlier response
+        # (e.g. "{response}" or "Like I said: {response}"), one is picked at
+        # random
+        self.DUPLICATE_TEMPLATES = ["{response}"]
+
+        # Name of the account in the accounts file, set by the agent. The
+        # metrics of the tool are labeled with it (None for no label)
+        self.ACCOUNT = None
@@ -0,0 +1,127 @@
+import asyncio
+import time
+
+
+class MessageBatch:
+    """
+    Messages of one user in one channel that are responded to together.
+
+    Attributes:
+        key (tuple): (channel id, author id) of the messages.
+        messages (list): Messages in the order they were received.
+        received (float): `time.perf_counter()` at which the first message
+            was received.
+    """
+
+
+    def __init__(self, key, message):
+        self.key = key
+        self.messages = [message]
+        self.received = time.perf_counter()
+        self.released = False
+        self.handle = None
+
+
+    @property
+    def message(self):
+        """The latest message of the batch, which is the one replied to."""
+        return self.messages[-1]
+
+
+class MessageQueue:
+    """
+    A bounded queue of messages that coalesces rapid-fire messages.
+
+    Messages of the same user in the same channel are merged into one batch
+    until no new message has arrived for `coalesce_window` seconds, or the
+    batch holds `coalesce_max_messages` messages. Once a batch is released to
+    the workers, further messages start a new batch. If `max_size` messages
+    are waiting, in any number of batches, further messages are dropped.
+
+    Must be used from a single event loop.
+    """
+    QUEUED = "queued"
+    COALESCED = "coalesced"
+    DROPPED = "dropped"
+
+
+    def __init__(self, max_size, coalesce_window, coalesce_max_messages):
+        self.max_size = max_size
+        self.coalesce_window = coalesce_window
+        self.coalesce_max_messages = coalesce_max_messages
+        self.__waiting = {}
+        self.__ready = asyncio.Queue()
+        self.__messages = 0
+        self.__unfinished = 0
+        self.__finished = asyncio.Event()
+        self.__finished.set()
+
+
+    def __len__(self):
+        """Returns the number of messages that are waiting for a worker."""
+        return self.__messages
+
+
+    def put(self, message):
+        """
+        Adds a message to the queue.
+
+        Returns `QUEUED` if the message starts a new batch, `COALESCED` if it
+        was merged into a waiting batch and `DROPPED` if the queue is full.
+        """
+        if self.__messages >= self.max_size:
+            return self.DROPPED
+        self.__messages += 1
+
+        key = (message.channel.id, message.author.id)
+        batch = self.__waiting.get(key)
+        if batch is not None and not batch.released and len(batch.messages) < self.coalesce_max_messages:
+            batch.messages.append(message)
+            self.__schedule(batch)
+            return self.COALESCED
+
+        batch = MessageBatch(key, message)
+        self.__waiting[key] = batch
+        self.__unfinished += 1
+        self.__finished.clear()
+        self.__schedule(batch)
+        return self.QUEUED
+
+
+    def __schedule(self, batch):
+        """(Re)starts the coalesce window of a batch."""
+        if batch.released:
+            return
+        if batch.handle is not None:
+            batch.handle.cancel()
+        if len(batch.messages) >= self.coalesce_max_messages or not self.coalesce_window:
+            self.__release(batch)
+        else:
+            batch.handle = asyncio.get_running_loop().call_later(self.coalesce_window, self.__release, batch)
+
+
+    def __release(self, batch):
+        batch.released = True
+        batch.handle = None
+        if self.__waiting.get(batch.key) is batch:
+            del self.__waiting[batch.key]
+        self.__ready.put_nowait(batch)
+
+
+    async def get(self):
+        """Waits for the next batch whose coalesce window has ended."""
+        batch = await self.__ready.get()
+        self.__messages -= len(batch.messages)
+        return batch
+
+
+    def task_done(self):
+        """Marks a batch that was returned by `get` as finished."""
+        self.__unfinished -= 1
+        if not self.__unfinished:
+            self.__finished.set()
+
+
+    async def join(self):
+        """Waits until all batches in the queue have been finished."""
+        await self.__finished.wait()
@@ -0,0 +1,59 @@
+import re
+
+
+class MessageFilter:
+    """
+    Rule-based filter that decides whether a message should be responded to
+    before any model work is done.
+
+    Messages are rejected if they were written by a bot, were posted outside
+    of the allowed guilds or channels or are too short. If `REQUIRE_TRIGGER`
+    is enabled, the remaining messages must also mention the bot, reply to
+    one of its messages or match a trigger keyword or pattern.
+
+    Keywords and patterns are compiled into a single regular expression when
+    the filter is created.
+    """
+
+
+    def __init__(self, config):
+        self.ignore_bots = config.IGNORE_BOTS
+        self.guilds = set(config.GUILD_ALLOWLIST)
+        self.channels = set(config.CHANNEL_ALLOWLIST)
+        self.min_length = config.MIN_MESSAGE_LENGTH
+        self.require_trigger = config.REQUIRE_TRIGGER
+        self.respond_to_mentions = config.RESPOND_TO_MENTIONS
+        self.respond_to_replies = config.RESPOND_TO_REPLIES
+
+        alternatives = [rf"(?<!\w){re.escape(keyword)}(?!\w)" for keyword in config.TRIGGER_KEYWORDS]
+        alternatives += [f"(?:{pattern})" for pattern in config.TRIGGER_PATTERNS]
+        self.trigger = re.compile("|".join(alternatives), re.IGNORECASE) if alternatives else None
+
+
+    def check(self, message, bot_user):
+        """
+        Returns `None` if the message should be responded to, or the reason
+        why it should not be.
+        """
+        if self.ignore_bots and message.author.bot:
+            return "bot"
+        if self.guilds and (message.guild is None or message.guild.id not in self.guilds):
+            return "guild"
+        if self.channels and message.channel.id not in self.channels:
+            return "channel"
+        if len(message.content.strip()) < self.min_length:
+            return "length"
+        if self.require_trigger and not self.__is_triggered(message, bot_user):
+            return "trigger"
+        return None
+
+
+    def __is_triggered(self, message, bot_user):
+        """Returns whether a message is addressed to the bot."""
+        if self.respond_to_mentions and bot_user in message.mentions:
+            return True
+        if self.respond_to_replies and message.reference is not None:
+            replied_to = message.reference.resolved
+            if replied_to is not None and getattr(replied_to, "author", None) == bot_user:
+                return True
+        return self.trigger is not None and self.trigger.search(message.content) is not None
@@ -1,7 +1,19 @@
-import openai
+import asyncio
+import logging
+import threading
+import time
 from datetime import datetime
-from langchain_core.prompts import PromptTemplate
+from ...metrics import get_registry
+from .model_batch import build_batch_prompt, pack_batches, parse_batch_response
+from .model_cache import build_cache
 from .model_config import ModelConfig
+from .model_scheduler import BATCH, INTERACTIVE, ModelScheduler
+
+# System prompt that is used if `SYSTEM_PROMPT` is "default", formatted with
+# `date_today`
+DEFAULT_SYSTEM_PROMPT = "You are a helpful assistant that can answer questions and provide information."
+
+logger = logging.getLogger(__name__)
 
 
 class Model:
@@ -12,28 +24,57 @@ class Model:
         api_key (str): API key used for authentication.
         date_context (str): A string representing the current date, used in the
             system prompt.
+        router (Router): Routes queries to the configured endpoints, with
+            failover and optional hedging.
         client (openai.OpenAI): An instance of the OpenAI client configured
-            with the provided API key and base URL.
+            with the provided API key and the first endpoint's base URL.
+        async_client (openai.AsyncOpenAI): An instance of the asynchronous
+            OpenAI client of the first endpoint for the running event loop.
+        cache (ResponseCache): Cache for responses to repeated queries, or
+            `None` if caching is disabled.
+        transport (Transport): Pooled HTTP transport with timeouts and retries
+            that is used by both OpenAI clients.
+
+        The OpenAI clients and the transport are created on first use, so that
+        the agent does not import the OpenAI library before it needs it.
 
     Methods:
+        connect(): Creates the router and the OpenAI clients ahead of the
+            first query.
         query(query, contexts): Queries the model and returns the full response
             as a string.
+        query_batch(instruction, inputs): Queries the model for a response
+            to each of several inputs with few requests.
+        astream(query): Asynchronously queries the model and yields the
+            response in chunks.
+        aquery(query): Asynchronously queries the model and returns the full
+            response as a string.
     """
 
 
-    def __init__(self, api_key):
+    def __init__(self, api_key, cache="default", transport=None, config=None, scheduler=None):
         """
         Initializes the Model class with the necessary parameters.
 
         Args:
             api_key (str): API key for authenticating with the OpenAI service.
+            cache (ResponseCache, optional): Cache for responses to repeated
+                queries. By default the cache that is configured in
+                `ModelConfig` is used. Pass `None` to disable caching.
+            transport (Transport, optional): HTTP transport to share with other
+                models. By default a transport is created from `ModelConfig`.
+            config (ModelConfig, optional): Configuration of the model. By
+                default `ModelConfig` is used.
+            scheduler (ModelScheduler, optional): Scheduler that admits the
+                requests of all tools by priority. By default a scheduler is
+                created from `ModelConfig`.
 
-        Initializes the model, sets up the OpenAI client, and configures the 
-        system prompt.
+        Initializes the model and configures the system prompt. The OpenAI
+        clients are set up by `connect` on first use.
         """
 
         # Load configuration
-        self.config = ModelConfig()
+        self.config = config or ModelConfig()
 
         # Assign values to object properties
         self.api_key = api_key
@@ -42,26 +83,91 @@ class Model:
         self.max_tokens = self.config.MAX_TOKENS
         self.date_context = datetime.now().strftime("%Y-%m-%d")
 
-        # Set up model API
-        self.client = openai.OpenAI(
-            base_url=self.config.BASE_URL,
-            api_key=self.api_key,
+        # Model API is set up on first use, retries are handled by the
+        # transport
+        self.__transport = transport
+        self.__router = None
+        self.__connect_lock = threading.Lock()
+
+        # Set up metrics
+        metrics = get_registry()
+        self.requests_metric = metrics.counter("model_requests_total", "Number of queries sent to the model.")
+        self.errors_metric = metrics.counter("model_errors_total", "Number of queries that failed.")
+        self.cache_hits_metric = metrics.counter("model_cache_hits_total", "Number of queries served from the response cache.")
+        self.ttft_metric = metrics.histogram("model_time_to_first_token_seconds", "Time until the model sent the first token of a response.")
+        self.generation_metric = metrics.histogram("model_generation_seconds", "Time until the model sent the complete response.")
+        self.tokens_per_second_metric = metrics.histogram(
+            "model_output_tokens_per_second",
+            "Output tokens per second after the first token (one token per streamed chunk).",
+            buckets=(1, 5, 10, 20, 50, 100, 200, 500, 1000)
+        )
+        self.batch_requests_metric = metrics.counter("model_batch_requests_total", "Number of queries that asked for responses to several inputs.")
+        self.batch_items_metric = metrics.counter("model_batch_items_total", "Number of inputs of batch queries, by how their response was generated.")
+
+        # Requests of all tools are admitted by priority
+        self.scheduler = scheduler or ModelScheduler(
+            max_in_flight=self.config.MAX_IN_FLIGHT,
+            reserved=self.config.INTERACTIVE_RESERVED,
+            tool_limits=self.config.TOOL_MAX_IN_FLIGHT
         )
 
+        # Set up response cache
+        # A cache that the model builds is closed with the model
+        self.__owns_cache = cache == "default"
+        self.cache = build_cache(self.config) if cache == "default" else cache
+
         # Set up system prompt
         if self.config.SYSTEM_PROMPT == "default":
-            system_prompt_search = PromptTemplate(
-                input_variables=["date_today"],
-                template="You are a helpful assistant that can answer questions and provide information."
-                )
-            self.system_prompt = system_prompt_search.format(date_today=self.date_context)
+            self.system_prompt = DEFAULT_SYSTEM_PROMPT.format(date_today=self.date_context)
         else:
             self.system_prompt = self.config.SYSTEM_PROMPT
 
 
-    def __query_async(self, query):
-        """Sends query to model and yields the response in chunks."""
-        if self.model in ["o1-preview", "o1-mini"]:
+    def connect(self):
+        """
+        Creates the transport, the router and the OpenAI clients if they don't
+        exist yet.
+
+        This is called on first use, but can be called ahead of time (e.g. on
+        a background thread) so that the first query doesn't wait for it.
+        """
+        with self.__connect_lock:
+            if self.__router is not None:
+                return
+            from .model_router import Router
+            from .model_transport import Transport
+
+            self.__transport = self.__transport or Transport(self.config)
+            self.__router = Router.from_config(self.config, self.api_key, self.__transport)
+
+
+    @property
+    def transport(self):
+        self.connect()
+        return self.__transport
+
+
+    @property
+    def router(self):
+        self.connect()
+        return self.__router
+
+
+    @property
+    def client(self):
+        """The OpenAI client of the first endpoint."""
+        return self.router.endpoints[0].client
+
+
+    @property
+    def async_client(self):
+        """The asynchronous OpenAI client of the first endpoint for the running event loop."""
+        return self.router.endpoints[0].async_client
+
+
+    def __build_messages(self, query, model):
+        """Returns the chat messages that are sent to a model for a query."""
+        if model in ["o1-preview", "o1-mini"]:
             messages = [
                 {"role": "user",
                  "content": f"System Instruction: {self.system_prompt} \n Instruction:{query}"}
@@ -71,29 +177,300 @@ class Model:
                 {"role": "system", "content": self.system_prompt},
                 {"role": "user", "content": query}
             ]
+        return messages
 
-        stream = self.client.chat.completions.create(
-            model=self.model,
-            messages=messages,
-            stream=True,
-            temperature=self.temperature,
-            max_tokens=self.max_tokens
+
+    def __cache_key(self, query, temperature=None):
+        """Returns the response cache key for a query."""
+        return self.cache.make_key(
+            self.model,
+            self.system_prompt,
+            query,
+            self.temperature if temperature is None else temperature,
+            self.max_tokens
         )
 
-        for chunk in stream:
-            if chunk.choices[0].delta.content is not None:
-                yield chunk.choices[0].delta.content
+
+    def __record_generation(self, start, first_token, tokens):
+        """Records the latency and speed of a generated response."""
+        end = time.perf_counter()
+        self.generation_metric.observe(end - start)
+        if first_token is not None and tokens > 1 and end > first_token:
+            self.tokens_per_second_metric.observe((tokens - 1) / (end - first_token))
+
+
+    def __query_async(self, query, deadline=None, priority=BATCH, tool=None, **options):
+        """
+        Sends query to model and yields the response in chunks. Options (e.g.
+        `max_tokens`) override the arguments of the request.
+        """
+        def request(endpoint, timeout):
+            arguments = {
+                "temperature": self.temperature,
+                "max_tokens": self.max_tokens,
+                **options
+            }
+            return endpoint.client.chat.completions.create(
+                model=endpoint.model,
+                messages=self.__build_messages(query, endpoint.model),
+                stream=True,
+                timeout=timeout,
+                **arguments
+            )
+
+        def create(timeout):
+            return self.router.open(request, timeout)
+
+        with self.scheduler.slot(priority, tool):
+            self.requests_metric.inc()
+            start = time.perf_counter()
+            first_token = None
+            tokens = 0
+            try:
+                for chunk in self.transport.stream(create, deadline=deadline):
+                    if chunk.choices and chunk.choices[0].delta.content is not None:
+                        if first_token is None:
+                            first_token = time.perf_counter()
+                            self.ttft_metric.observe(first_token - start)
+                        tokens += 1
+                        yield chunk.choices[0].delta.content
+            except Exception:
+                self.errors_metric.inc()
+                raise
+            self.__record_generation(start, first_token, tokens)
 
 
-    def query(self, query):
+    def query(self, query, deadline=None, priority=BATCH, tool=None, temperature=None, use_cache=True):
         """
         Sends query to model and returns the complete response as a string.
 
         This method calls the `__query_async` method, concatenates all of the 
         chunks that it yields, and returns the full response as a string.
+        Responses are served from and stored in the response cache if it is
+        enabled.
+
+        Args:
+            query (str): Query that is sent to the model.
+            deadline (float, optional): Number of seconds after which the query
+                is abandoned. Defaults to `REQUEST_DEADLINE`.
+            priority (str, optional): Priority class of the query, one of
+                "interactive", "batch" and "background". Defaults to "batch".
+            tool (str, optional): Name of the tool that sends the query, used
+                for per-tool limits and fair queuing.
+            temperature (float, optional): Temperature of the response.
+                Defaults to `TEMPERATURE`.
+            use_cache (bool, optional): If false the response cache is not
+                used, e.g. to generate a different response to the same
+                query every time.
+        """
+        use_cache = use_cache and self.cache is not None
+        if use_cache:
+            key = self.__cache_key(query, temperature)
+            response = self.cache.get(key)
+            if response is not None:
+                self.cache_hits_metric.inc()
+                return response
+
+        options = {} if temperature is None else {"temperature": temperature}
+        chunks = []
+        for chunk in self.__query_async(query=query, deadline=deadline, priority=priority, tool=tool, **options):
+            chunks.append(chunk)
+        response = "".join(chunks)
+
+        if use_cache and response:
+            self.cache.set(key, response)
+        return response
+
+
+    def query_batch(self, instruction, inputs, deadline=None, priority=BATCH, tool=None):
+        """
+        Generates a response to each of several inputs that share an
+        instruction, with as few requests as possible.
+
+        Inputs are packed into requests of up to `BATCH_TOKEN_BUDGET` input
+        tokens and `BATCH_MAX_ITEMS` inputs, so that the system prompt and
+        the instruction are sent once per request instead of once per input.
+        The model is asked for a JSON object with one response per input.
+        Inputs whose response is missing or not valid, and inputs that don't
+        fit into a request with others, are queried on their own with the
+        prompt that `query` would be sent for them. Batch requests are sent
+        one after another, callers that need concurrency can split inputs.
+
+        Responses are served from and stored in the response cache under the
+        key of the single query, so that cached inputs are not sent again.
+
+        Args:
+            instruction (str): Instruction that applies to every input.
+            inputs (list[str]): Inputs to respond to, e.g. conversations.
+            deadline, priority, tool: See `query`.
+
+        Returns a list with the response to each input, or `None` for inputs
+        that no response could be generated for.
+        """
+        prompts = [instruction + "\n\n" + text for text in inputs]
+        responses = [None] * len(inputs)
+
+        pending = []
+        for index, prompt in enumerate(prompts):
+            response = self.cache.get(self.__cache_key(prompt)) if self.cache is not None else None
+            if response is not None:
+                self.cache_hits_metric.inc()
+                responses[index] = response
+            else:
+                pending.append(index)
+
+        batches = pack_batches(
+            [inputs[index] for index in pending],
+            instruction,
+            self.config.BATCH_TOKEN_BUDGET,
+            self.config.BATCH_MAX_ITEMS
+        )
+        for batch in batches:
+            indices = [pending[position] for position in batch]
+            if len(indices) > 1:
+                batch_responses = self.__query_batch(instruction, [inputs[index] for index in indices], deadline, priority, tool)
+                for index, response in zip(indices, batch_responses):
+                    if response is not None:
+                        self.batch_items_metric.inc(outcome="batched")
+                        responses[index] = response
+                        if self.cache is not None:
+                            self.cache.set(self.__cache_key(prompts[index]), response)
+
+            for index in indices:
+                if responses[index] is not None:
+                    continue
+                try:
+                    responses[index] = self.query(prompts[index], deadline=deadline, priority=priority, tool=tool)
+                    self.batch_items_metric.inc(outcome="single")
+                except Exception as e:
+                    self.batch_items_metric.inc(outcome="failed")
+                    logger.exception("[MODEL] Error querying input %d of batch. %s", index, e)
+        return responses
+
+
+    def __query_batch(self, instruction, inputs, deadline, priority, tool):
+        """
+        Sends a single request for several inputs and returns the valid
+        response to each input, or `None` where it is missing or not valid.
+        """
+        ids = [str(number) for number in range(1, len(inputs) + 1)]
+        prompt = build_batch_prompt(instruction, list(zip(ids, inputs)))
+        options = {}
+        if self.max_tokens is not None:
+            # The JSON of the responses needs room on top of the responses
+            options["max_tokens"] = (self.max_tokens + self.config.BATCH_ITEM_OVERHEAD_TOKENS) * len(inputs)
+        if self.config.BATCH_RESPONSE_FORMAT is not None:
+            options["response_format"] = self.config.BATCH_RESPONSE_FORMAT
+
+        self.batch_requests_metric.inc()
+        try:
+            text = "".join(self.__query_async(prompt, deadline=deadline, priority=priority, tool=tool, **options))
+        except Exception as e:
+            logger.warning("[MODEL] Batch query of %d inputs failed, querying them one by one. %s", len(inputs), e)
+            return [None] * len(inputs)
+
+        parsed = parse_batch_response(text, ids)
+        if len(parsed) < len(ids):
+            logger.warning("[MODEL] Batch response is missing %d of %d valid responses, querying them one by one.", len(ids) - len(parsed), len(ids))
+        return [parsed.get(item_id) for item_id in ids]
+
+
+    async def astream(self, query, deadline=None, priority=INTERACTIVE, tool=None):
+        """
+        Sends query to model without blocking the event loop and yields the
+        response in chunks.
+
+        If the response is cached it is yielded as a single chunk. Queries
+        have "interactive" priority by default, see `query` for the arguments.
+        """
+        if self.cache is not None:
+            key = self.__cache_key(query)
+            response = await self.__acache(self.cache.get, key)
+            if response is not None:
+                self.cache_hits_metric.inc()
+                yield response
+                return
+
+        def request(endpoint, timeout):
+            return endpoint.async_client.chat.completions.create(
+                model=endpoint.model,
+                messages=self.__build_messages(query, endpoint.model),
+                stream=True,
+                temperature=self.temperature,
+                max_tokens=self.max_tokens,
+                timeout=timeout
+            )
+
+        def create(timeout):
+            return self.router.aopen(request, timeout)
+
+        async with self.scheduler.aslot(priority, tool):
+            self.requests_metric.inc()
+            start = time.perf_counter()
+            first_token = None
+            chunks = []
+            try:
+                async for chunk in self.transport.astream(create, deadline=deadline):
+                    if chunk.choices and chunk.choices[0].delta.content is not None:
+                        if first_token is None:
+                            first_token = time.perf_counter()
+                            self.ttft_metric.observe(first_token - start)
+                        chunks.append(chunk.choices[0].delta.content)
+                        yield chunk.choices[0].delta.content
+            except Exception:
+                self.errors_metric.inc()
+                raise
+            self.__record_generation(start, first_token, len(chunks))
+
+        response = "".join(chunks)
+        if self.cache is not None and response:
+            await self.__acache(self.cache.set, key, response)
+
+
+    async def __acache(self, method, *args):
+        """Calls a method of the cache, in an executor if it blocks."""
+        if not self.cache.blocking:
+            return method(*args)
+        return await asyncio.get_running_loop().run_in_executor(None, method, *args)
+
+
+    async def aquery(self, query, deadline=None, priority=INTERACTIVE, tool=None):
+        """
+        Sends query to model and returns the complete response as a string.
+
+        This is the asynchronous counterpart of `query`. It should be used by
+        tools that run inside an event loop (e.g. Discord) so that other
+        coroutines can make progress while the response is being generated.
         """
         chunks = []
-        for chunk in self.__query_async(query=query):
+        async for chunk in self.astream(query=query, deadline=deadline, priority=priority, tool=tool):
             chunks.append(chunk)
         response = "".join(chunks)
         return response
+
+
+    def close(self):
+        """Closes the connection pools and the response cache of the model."""
+        if self.__router is not None:
+            self.__router.close()
+        if self.__transport is not None:
+            self.__transport.close()
+        self.__close_cache()
+
+
+    def __close_cache(self):
+        if self.__owns_cache and self.cache is not None:
+            self.cache.close()
+
+
+    async def aclose(self):
+        """
+        Closes the connection pools, the router and the response cache of the
+        model from an event loop. Everything but the asynchronous connection
+        pool is closed even if closing that fails.
+        """
+        try:
+            if self.__transport is not None:
+                await self.__transport.aclose()
+        finally:
+            self.close()
@@ -0,0 +1,115 @@
+import json
+import re
+from .model_prompt import count_tokens
+
+# Instruction that follows the shared instruction of a batch and asks for
+# one response per item as a JSON object, formatted with `count`
+BATCH_INSTRUCTION = (
+    "Follow the instruction above for each of the {count} items below "
+    "separately. Reply only with a JSON object of the form "
+    '{{"responses": [{{"id": "<item id>", "response": "<your response>"}}]}} '
+    "that contains exactly one response for every item id."
+)
+
+# Header of each item of a batch, formatted with `id`
+ITEM_HEADER = "[item {id}]"
+
+# Markdown code fence that some models put around JSON despite being asked
+# not to
+CODE_FENCE = re.compile(r"^\s*```(?:json)?\s*|\s*```\s*$")
+
+
+def pack_batches(inputs, instruction, token_budget=None, max_items=None):
+    """
+    Packs inputs into batches whose prompts fit into the token budget.
+
+    Inputs are kept in order and each batch holds as many consecutive inputs
+    as fit. An input that doesn't fit into a batch with others is put into a
+    batch of its own, which is sent as a single query.
+
+    Args:
+        inputs (list[str]): Inputs that share the instruction.
+        instruction (str): Instruction that is sent once per batch.
+        token_budget (int, optional): Maximum number of input tokens of a
+            batch prompt, or `None` for no limit.
+        max_items (int, optional): Maximum number of inputs per batch, or
+            `None` for no limit.
+
+    Returns a list of batches, each a list of indices of inputs.
+    """
+    overhead = count_tokens(instruction) + count_tokens(BATCH_INSTRUCTION)
+    batches = []
+    batch = []
+    used = overhead
+    for index, text in enumerate(inputs):
+        tokens = count_tokens(ITEM_HEADER.format(id=len(batch) + 1)) + count_tokens(text)
+        full = max_items is not None and len(batch) >= max_items
+        over = token_budget is not None and used + tokens > token_budget
+        if batch and (full or over):
+            batches.append(batch)
+            batch = []
+            used = overhead
+        batch.append(index)
+        used += tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def build_batch_prompt(instruction, items):
+    """
+    Returns a prompt that asks for a response to each item.
+
+    Args:
+        instruction (str): Instruction that applies to every item.
+        items (list[tuple[str, str]]): Id and text of each item.
+    """
+    sections = [instruction, BATCH_INSTRUCTION.format(count=len(items))]
+    for item_id, text in items:
+        sections.append(ITEM_HEADER.format(id=item_id) + "\n" + text)
+    return "\n\n".join(sections)
+
+
+def parse_batch_response(text, ids):
+    """
+    Parses the response to a batch prompt.
+
+    Only responses that are non-empty strings with one of the expected ids
+    are returned. Ids that appear more than once are ambiguous and left out,
+    so that their items are queried on their own.
+
+    Args:
+        text (str): Response of the model.
+        ids (list[str]): Ids of the items of the batch.
+
+    Returns a dictionary of responses by item id, which is empty if the
+    response is not valid JSON of the expected form.
+    """
+    text = CODE_FENCE.sub("", text)
+    start = text.find("{")
+    end = text.rfind("}")
+    if start < 0 or end < start:
+        return {}
+    try:
+        data = json.loads(text[start:end + 1])
+    except ValueError:
+        return {}
+    if not isinstance(data, dict) or not isinstance(data.get("responses"), list):
+        return {}
+
+    expected = set(ids)
+    responses = {}
+    duplicates = set()
+    for entry in data["responses"]:
+        if not isinstance(entry, dict):
+            continue
+        item_id = str(entry.get("id"))
+        response = entry.get("response")
+        if item_id not in expected or not isinstance(response, str) or not response.strip():
+            continue
+        if item_id in responses:
+            duplicates.add(item_id)
+        responses[item_id] = response.strip()
+    for item_id in duplicates:
+        del responses[item_id]
+    return responses
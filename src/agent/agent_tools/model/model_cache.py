@@ -0,0 +1,258 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Number of cache hits after which the SQLite cache writes their access times
+# to the database, instead of writing on every hit
+TOUCH_BATCH_SIZE = 64
+
+
+class ResponseCache:
+    """
+    Base class for caches that store model responses.
+
+    Subclasses implement `_get`, `_set` and `_clear`. This class takes care of
+    building cache keys and counting hits and misses.
+
+    Attributes:
+        max_size (int): Maximum number of responses that are kept in the cache.
+        ttl (float): Number of seconds after which a cached response expires.
+            If `None` responses never expire.
+        hits (int): Number of lookups that returned a cached response.
+        misses (int): Number of lookups that did not return a cached response.
+        blocking (bool): Whether lookups and stores wait for disk I/O, so that
+            they should not be made from an event loop.
+    """
+    blocking = False
+
+
+    def __init__(self, max_size=1024, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+
+    @staticmethod
+    def make_key(model, system_prompt, prompt, temperature, max_tokens):
+        """Returns the cache key for a query with the given parameters."""
+        payload = json.dumps(
+            [model, system_prompt, prompt, temperature, max_tokens],
+            ensure_ascii=False
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+    def get(self, key):
+        """Returns the cached response for key or `None` if there is none."""
+        with self._lock:
+            response = self._get(key, time.time())
+            if response is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return response
+
+
+    def set(self, key, response):
+        """Stores a response in the cache, evicting old entries if necessary."""
+        with self._lock:
+            self._set(key, response, time.time())
+
+
+    def clear(self):
+        """Removes all responses from the cache."""
+        with self._lock:
+            self._clear()
+
+
+    def stats(self):
+        """Returns a dictionary with the hit and miss counters of the cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "size": len(self),
+            }
+
+
+    def close(self):
+        """Releases the resources of the cache."""
+
+
+    def _expired(self, created_at, now):
+        return self.ttl is not None and now - created_at > self.ttl
+
+
+    def _get(self, key, now):
+        raise NotImplementedError
+
+
+    def _set(self, key, response, now):
+        raise NotImplementedError
+
+
+    def _clear(self):
+        raise NotImplementedError
+
+
+    def __len__(self):
+        raise NotImplementedError
+
+
+class MemoryCache(ResponseCache):
+    """An in-memory response cache with LRU eviction and TTL expiry."""
+
+
+    def __init__(self, max_size=1024, ttl=None):
+        super().__init__(max_size=max_size, ttl=ttl)
+        self.__entries = OrderedDict()
+
+
+    def _get(self, key, now):
+        entry = self.__entries.get(key)
+        if entry is None:
+            return None
+        response, created_at = entry
+        if self._expired(created_at, now):
+            del self.__entries[key]
+            return None
+        self.__entries.move_to_end(key)
+        return response
+
+
+    def _set(self, key, response, now):
+        self.__entries[key] = (response, now)
+        self.__entries.move_to_end(key)
+        while len(self.__entries) > self.max_size:
+            self.__entries.popitem(last=False)
+
+
+    def _clear(self):
+        self.__entries.clear()
+
+
+    def __len__(self):
+        return len(self.__entries)
+
+
+class SqliteCache(ResponseCache):
+    """
+    A response cache that is stored in a SQLite database, so that cached
+    responses survive restarts. Uses LRU eviction and TTL expiry.
+
+    The access times of hits are kept in memory and written in batches of
+    `TOUCH_BATCH_SIZE`, before entries are evicted and when the cache is
+    closed, so that a hit doesn't write to the database.
+    """
+    blocking = True
+
+
+    def __init__(self, path, max_size=1024, ttl=None):
+        super().__init__(max_size=max_size, ttl=ttl)
+        self.path = path
+        self.__connection = sqlite3.connect(path, check_same_thread=False)
+        self.__connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, "
+            "response TEXT NOT NULL, "
+            "created_at REAL NOT NULL, "
+            "accessed_at REAL NOT NULL)"
+        )
+        self.__connection.execute(
+            "CREATE INDEX IF NOT EXISTS responses_accessed_at "
+            "ON responses (accessed_at)"
+        )
+        self.__connection.commit()
+        self.__touched = {}
+        self.__closed = False
+
+
+    def __write_touches(self):
+        """Writes the access times of recent hits, without committing."""
+        if self.__touched:
+            self.__connection.executemany(
+                "UPDATE responses SET accessed_at = ? WHERE key = ?",
+                [(accessed_at, key) for key, accessed_at in self.__touched.items()]
+            )
+            self.__touched.clear()
+
+
+    def _get(self, key, now):
+        row = self.__connection.execute(
+            "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        response, created_at = row
+        if self._expired(created_at, now):
+            self.__connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self.__connection.commit()
+            return None
+        self.__touched[key] = now
+        if len(self.__touched) >= TOUCH_BATCH_SIZE:
+            self.__write_touches()
+            self.__connection.commit()
+        return response
+
+
+    def _set(self, key, response, now):
+        # Evict by the access times of recent hits too
+        self.__write_touches()
+        self.__connection.execute(
+            "INSERT OR REPLACE INTO responses (key, response, created_at, accessed_at) "
+            "VALUES (?, ?, ?, ?)",
+            (key, response, now, now)
+        )
+        if self.ttl is not None:
+            self.__connection.execute(
+                "DELETE FROM responses WHERE created_at < ?", (now - self.ttl,)
+            )
+        self.__connection.execute(
+            "DELETE FROM responses WHERE key IN ("
+            "SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_size,)
+        )
+        self.__connection.commit()
+
+
+    def _clear(self):
+        self.__touched.clear()
+        self.__connection.execute("DELETE FROM responses")
+        self.__connection.commit()
+
+
+    def __len__(self):
+        return self.__connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+
+    def close(self):
+        """Writes the access times of recent hits and closes the connection to the database."""
+        with self._lock:
+            if self.__closed:
+                return
+            self.__closed = True
+            self.__write_touches()
+            self.__connection.commit()
+            self.__connection.close()
+
+
+def build_cache(config):
+    """Returns the response cache that is configured in a `ModelConfig`."""
+    if config.CACHE_BACKEND == "memory":
+        return MemoryCache(max_size=config.CACHE_MAX_SIZE, ttl=config.CACHE_TTL)
+    if config.CACHE_BACKEND == "sqlite":
+        return SqliteCache(
+            config.CACHE_PATH,
+            max_size=config.CACHE_MAX_SIZE,
+            ttl=config.CACHE_TTL
+        )
+    if config.CACHE_BACKEND is None:
+        return None
+    raise ValueError(f"Unknown cache backend: {config.CACHE_BACKEND}")
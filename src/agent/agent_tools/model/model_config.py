@@ -13,4 +13,107 @@ class ModelConfig:
         self.MAX_TOKENS = None
        
         # A system message or prompt to guide model behavior
-        self.SYSTEM_PROMPT = "default"
\ No newline at end of file
+        self.SYSTEM_PROMPT = "default"
+
+        # Backend used to cache responses to repeated queries ("memory",
+        # "sqlite" or None to disable caching)
+        self.CACHE_BACKEND = "memory"
+
+        # Maximum number of responses that are cached, least recently used
+        # responses are evicted first
+        self.CACHE_MAX_SIZE = 1024
+
+        # Number of seconds after which a cached response expires (None to
+        # never expire)
+        self.CACHE_TTL = 3600
+
+        # Path of the database file that is used by the "sqlite" cache backend
+        self.CACHE_PATH = "model_cache.sqlite3"
+
+        # Maximum number of connections to the model provider, shared by all
+        # tools
+        self.MAX_CONNECTIONS = 32
+
+        # Maximum number of idle connections that are kept alive for reuse
+        self.MAX_KEEPALIVE_CONNECTIONS = 16
+
+        # Number of seconds after which an idle connection is closed
+        self.KEEPALIVE_EXPIRY = 60.0
+
+        # Number of seconds to wait for a connection to the model provider
+        self.CONNECT_TIMEOUT = 5.0
+
+        # Number of seconds to wait for the model to start responding.
+        # Asynchronous queries are cancelled exactly when it passes.
+        # Synchronous queries (e.g. of the Twitter tool) can't interrupt a
+        # blocking read, they check it when the response starts and when its
+        # first chunk arrives, so each read can overrun it by up to
+        # max(READ_TIMEOUT, FIRST_TOKEN_TIMEOUT)
+        self.FIRST_TOKEN_TIMEOUT = 30.0
+
+        # Number of seconds to wait between chunks of a response
+        self.READ_TIMEOUT = 30.0
+
+        # Number of seconds after which a query is abandoned, including retries
+        # (None for no deadline)
+        self.REQUEST_DEADLINE = 120.0
+
+        # Number of times a failed query is retried (on connection errors,
+        # timeouts, 429 and 5xx responses)
+        self.MAX_RETRIES = 3
+
+        # Base and maximum number of seconds of the jittered exponential
+        # backoff between retries, a Retry-After header takes precedence
+        self.RETRY_BACKOFF_BASE = 0.5
+        self.RETRY_BACKOFF_MAX = 8.0
+
+        # Maximum number of requests that are sent to the model provider at
+        # the same time by all tools (should match the provider's limit). A
+        # hedged request (see HEDGE_REQUESTS) is sent under the slot of the
+        # request that it hedges, so with hedging up to twice as many
+        # requests can be in flight
+        self.MAX_IN_FLIGHT = 16
+
+        # Number of those requests that are reserved for interactive requests
+        # (e.g. Discord responses), so that they don't wait for batch jobs
+        self.INTERACTIVE_RESERVED = 4
+
+        # Maximum number of requests that a tool can send at the same time, by
+        # tool name (e.g. {"twitter": 4})
+        self.TOOL_MAX_IN_FLIGHT = {}
+
+        # OpenAI API compatible endpoints that queries are routed to, each a
+        # dictionary with a "base_url", a "model" and optionally an "api_key"
+        # (None to only use BASE_URL with MODEL). Queries go to the healthy
+        # endpoint with the lowest time to first token and fail over to the
+        # next one on errors
+        self.ENDPOINTS = None
+
+        # Number of failed requests in a row after which an endpoint is
+        # avoided, and for how many seconds it is avoided
+        self.ENDPOINT_FAILURE_THRESHOLD = 3
+        self.ENDPOINT_COOLDOWN = 30.0
+
+        # If true a second request is sent to the next endpoint when the first
+        # token of a response takes longer than the HEDGE_PERCENTILE of recent
+        # times to first token (but at least HEDGE_MIN_DELAY seconds), and the
+        # response that starts first is used. Synchronous requests then run
+        # in a pool of up to MAX_CONNECTIONS threads of the model
+        self.HEDGE_REQUESTS = False
+        self.HEDGE_PERCENTILE = 0.95
+        self.HEDGE_MIN_DELAY = 0.5
+
+        # Maximum number of input tokens of a query that asks for responses
+        # to several inputs at once (e.g. Twitter conversations), and the
+        # maximum number of inputs per query
+        self.BATCH_TOKEN_BUDGET = 4096
+        self.BATCH_MAX_ITEMS = 8
+
+        # Output format that is requested for batch queries (None for
+        # providers that don't support JSON mode, the JSON is then only
+        # asked for in the prompt)
+        self.BATCH_RESPONSE_FORMAT = {"type": "json_object"}
+
+        # Number of tokens per input that a batch query may generate on top
+        # of MAX_TOKENS for the JSON around the responses
+        self.BATCH_ITEM_OVERHEAD_TOKENS = 32
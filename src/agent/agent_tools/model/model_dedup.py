@@ -0,0 +1,183 @@
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+# Links and mentions are left out, so that copies of a message that link or
+# mention someone else are still found
+IGNORED_PATTERN = re.compile(r"https?://\S+|@\w+")
+NON_WORD_PATTERN = re.compile(r"[\W_]+")
+
+# Odd multiplier that spreads the bits of a shingle's 32-bit CRC across 64
+# bits (the golden ratio in fixed point)
+MULTIPLIER = 0x9E3779B97F4A7C15
+MASK = (1 << 64) - 1
+
+
+def normalize(text):
+    """Returns text in lower case without links, mentions and punctuation."""
+    normalized = NON_WORD_PATTERN.sub(" ", IGNORED_PATTERN.sub(" ", text.lower())).strip()
+    return normalized or text.lower().strip()
+
+
+def shingles(text, size=4):
+    """Returns the set of character n-grams of the normalized text."""
+    text = normalize(text)
+    if len(text) <= size:
+        return {text}
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+def choose_bands(signature_size, threshold):
+    """
+    Returns the number of LSH bands whose candidate threshold
+    `(1 / bands) ** (1 / rows)` is closest to, but not above, threshold, so
+    that few near-duplicates are missed. Candidates are then checked against
+    the threshold.
+    """
+    best = signature_size
+    best_distance = None
+    for bands in range(1, signature_size + 1):
+        if signature_size % bands:
+            continue
+        rows = signature_size // bands
+        candidate_threshold = (1 / bands) ** (1 / rows)
+        if candidate_threshold > threshold:
+            continue
+        distance = threshold - candidate_threshold
+        if best_distance is None or distance < best_distance:
+            best, best_distance = bands, distance
+    return best
+
+
+class NearDuplicateIndex:
+    """
+    Finds recently added texts that are nearly the same as a text, without
+    comparing it to every one of them.
+
+    Texts are normalized and split into character shingles, and the Jaccard
+    similarity of two texts' shingles is estimated from their MinHash
+    signatures. Signatures are computed in a single pass over the shingles
+    with one-permutation hashing: each shingle's hash falls into one of
+    `signature_size` bins and the signature holds the minimum of each bin,
+    empty bins borrow the minimum of the next bin. Signatures are split into
+    bands that are indexed by locality-sensitive hashing, so that a lookup
+    only compares a text to texts that share a band with it.
+
+    The index holds at most `max_entries` texts, each for at most `window`
+    seconds, the oldest texts are evicted first. Each text is stored as its
+    signature and a value (e.g. the response to it), not the text itself.
+
+    Args:
+        threshold (float): Estimated Jaccard similarity (from 0 to 1) at
+            which two texts are near-duplicates.
+        window (float, optional): Number of seconds for which a text is
+            kept, or `None` to keep texts until they are evicted.
+        max_entries (int): Maximum number of texts in the index.
+        signature_size (int): Number of values of the signatures, more give
+            better estimates of longer texts but take more memory.
+        shingle_size (int): Number of characters of each shingle.
+    """
+
+
+    def __init__(self, threshold=0.8, window=None, max_entries=10000, signature_size=64, shingle_size=4):
+        self.threshold = threshold
+        self.window = window
+        self.max_entries = max_entries
+        self.signature_size = signature_size
+        self.shingle_size = shingle_size
+        self.bands = choose_bands(signature_size, threshold)
+        self.rows = signature_size // self.bands
+
+        self.__lock = threading.Lock()
+        self.__entries = OrderedDict()
+        self.__buckets = [{} for _ in range(self.bands)]
+        self.__ids = 0
+
+
+    def __len__(self):
+        with self.__lock:
+            self.__evict()
+            return len(self.__entries)
+
+
+    def signature(self, text):
+        """Returns the MinHash signature of text."""
+        size = self.signature_size
+        bins = [None] * size
+        for shingle in shingles(text, self.shingle_size):
+            value = (zlib.crc32(shingle.encode()) * MULTIPLIER) & MASK
+            index = value % size
+            value //= size
+            if bins[index] is None or value < bins[index]:
+                bins[index] = value
+
+        # Empty bins borrow the minimum of the next non-empty bin, together
+        # with their distance to it, so that equal texts get equal values
+        # in all bins
+        signature = list(bins)
+        for index in range(size):
+            if bins[index] is None:
+                for distance in range(1, size):
+                    value = bins[(index + distance) % size]
+                    if value is not None:
+                        signature[index] = (value, distance)
+                        break
+        return tuple(signature)
+
+
+    def __band_keys(self, signature):
+        return [
+            signature[band * self.rows:(band + 1) * self.rows]
+            for band in range(self.bands)
+        ]
+
+
+    def __evict(self):
+        """Removes expired and surplus entries, must be called with the lock held."""
+        now = time.monotonic()
+        while self.__entries:
+            entry_id, (signature, _, added) = next(iter(self.__entries.items()))
+            expired = self.window is not None and now - added > self.window
+            if not expired and len(self.__entries) <= self.max_entries:
+                break
+            del self.__entries[entry_id]
+            for buckets, key in zip(self.__buckets, self.__band_keys(signature)):
+                bucket = buckets.get(key)
+                if bucket is not None:
+                    bucket.discard(entry_id)
+                    if not bucket:
+                        del buckets[key]
+
+
+    def find(self, text):
+        """
+        Returns the value of the most similar recent near-duplicate of text
+        and its estimated similarity, or `(None, 0.0)` if there is none.
+        """
+        signature = self.signature(text)
+        with self.__lock:
+            self.__evict()
+            candidates = set()
+            for buckets, key in zip(self.__buckets, self.__band_keys(signature)):
+                candidates.update(buckets.get(key, ()))
+
+            best_value, best_similarity = None, 0.0
+            for entry_id in candidates:
+                other, value, _ = self.__entries[entry_id]
+                similarity = sum(x == y for x, y in zip(signature, other)) / self.signature_size
+                if similarity >= self.threshold and similarity > best_similarity:
+                    best_value, best_similarity = value, similarity
+            return best_value, best_similarity
+
+
+    def add(self, text, value=None):
+        """Adds text with a value that is returned by `find` for near-duplicates."""
+        signature = self.signature(text)
+        with self.__lock:
+            self.__ids += 1
+            self.__entries[self.__ids] = (signature, value, time.monotonic())
+            for buckets, key in zip(self.__buckets, self.__band_keys(signature)):
+                buckets.setdefault(key, set()).add(self.__ids)
+            self.__evict()
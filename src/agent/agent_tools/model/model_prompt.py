@@ -0,0 +1,126 @@
+import math
+import re
+
+# Words, numbers and individual punctuation characters
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+# Appended to a truncated message
+ELLIPSIS = "..."
+
+
+def count_tokens(text):
+    """
+    Returns an estimate of the number of tokens in text.
+
+    Counts words and punctuation locally, without a tokenizer. Long words are
+    counted as one token per four characters, which is close to what the BPE
+    tokenizers of most models produce for English text.
+    """
+    return sum(
+        math.ceil(len(token) / 4) for token in TOKEN_PATTERN.findall(text)
+    )
+
+
+class Turn(dict):
+    """A message in a conversation, missing format fields render as ''."""
+
+
+    def __missing__(self, key):
+        return ""
+
+
+class PromptBuilder:
+    """
+    Builds compact prompts from conversations.
+
+    Each message of a conversation is rendered on its own line using a format
+    string (e.g. "@{author}: {text}"), so that only the fields the model needs
+    are sent. If the prompt would exceed the token budget, the oldest messages
+    are replaced by a short note and, if necessary, the newest message is
+    truncated. The note and the truncation mark count against the budget, so
+    the prompt only exceeds it if the instruction and the note alone do.
+
+    Attributes:
+        turn_format (str): Format string that is used to render a message. It
+            can use any key of the message dictionaries.
+        token_budget (int): Maximum number of input tokens of a prompt, or
+            `None` for no limit.
+    """
+
+
+    def __init__(self, turn_format="{author}: {text}", token_budget=None):
+        self.turn_format = turn_format
+        self.token_budget = token_budget
+
+
+    def render_turn(self, turn):
+        """Renders a single message."""
+        return self.turn_format.format_map(Turn(turn))
+
+
+    def build(self, instruction, turns):
+        """
+        Returns a prompt that consists of instruction followed by turns.
+
+        Args:
+            instruction (str): Instruction for the model.
+            turns (list[dict]): Messages of the conversation from oldest to
+                newest.
+        """
+        return instruction + "\n\n" + self.render(instruction, turns)
+
+
+    def render(self, instruction, turns):
+        """
+        Returns the turns of the prompt for instruction without the
+        instruction, e.g. to send several conversations with one instruction.
+        """
+        lines = [self.render_turn(turn) for turn in turns]
+        if self.token_budget is None:
+            return "\n".join(lines)
+
+        budget = self.token_budget - count_tokens(instruction)
+        kept = []
+        for line in reversed(lines):
+            tokens = count_tokens(line)
+            if tokens > budget:
+                break
+            kept.append(line)
+            budget -= tokens
+        kept.reverse()
+
+        # The note on omitted messages counts against the budget too, the
+        # oldest kept messages make room for it
+        while kept and len(kept) < len(lines) and count_tokens(self.__omitted_note(len(lines) - len(kept))) > budget:
+            budget += count_tokens(kept.pop(0))
+
+        # Always keep the newest message, truncated to fit the budget
+        if not kept and lines:
+            if len(lines) > 1:
+                budget -= count_tokens(self.__omitted_note(len(lines) - 1))
+            kept = [self.__truncate(lines[-1], max(budget, 0))]
+
+        omitted = len(lines) - len(kept)
+        if omitted:
+            kept.insert(0, self.__omitted_note(omitted))
+        return "\n".join(kept)
+
+
+    def __omitted_note(self, omitted):
+        return f"[{omitted} earlier message{'s' if omitted > 1 else ''} omitted]"
+
+
+    def __truncate(self, line, tokens):
+        """Returns the start of line that contains at most `tokens` tokens."""
+        if count_tokens(line) <= tokens:
+            return line
+        tokens -= count_tokens(ELLIPSIS)
+        matches = list(TOKEN_PATTERN.finditer(line))
+        used = 0
+        end = 0
+        for match in matches:
+            used += math.ceil(len(match.group()) / 4)
+            if used > tokens:
+                break
+            end = match.end()
+        return line[:end] + ELLIPSIS
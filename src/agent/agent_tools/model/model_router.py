@@ -0,0 +1,432 @@
+import asyncio
+import logging
+import threading
+import time
+import weakref
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import openai
+from ...metrics import get_registry
+from .model_transport import Transport
+
+logger = logging.getLogger(__name__)
+
+# Number of observed times to first token that are kept to estimate the
+# hedge delay
+LATENCY_WINDOW = 200
+
+# Minimum number of samples before the hedge delay is derived from them
+MIN_LATENCY_SAMPLES = 20
+
+
+class Endpoint:
+    """
+    An OpenAI compatible endpoint and the model that is used on it.
+
+    Keeps track of the endpoint's health and average time to first token. An endpoint
+    is unhealthy for `cooldown` seconds after `failure_threshold` requests in a
+    row have failed.
+    """
+
+
+    def __init__(self, base_url, model, api_key, transport, failure_threshold, cooldown):
+        self.base_url = base_url
+        self.model = model
+        self.api_key = api_key
+        self.transport = transport
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.client = openai.OpenAI(
+            base_url=base_url,
+            api_key=api_key,
+            http_client=transport.http_client,
+            max_retries=0,
+        )
+        self.latency = None             # Moving average of the time to first token
+        self.failures = 0               # Number of failed requests in a row
+        self.unhealthy_until = 0.0
+        self.__async_clients = weakref.WeakKeyDictionary()
+        self.__lock = threading.Lock()
+
+
+    def __repr__(self):
+        return f"{self.model} at {self.base_url}"
+
+
+    @property
+    def async_client(self):
+        """The asynchronous OpenAI client of the running event loop."""
+        loop = asyncio.get_running_loop()
+        with self.__lock:
+            async_client = self.__async_clients.get(loop)
+            if async_client is None:
+                async_client = openai.AsyncOpenAI(
+                    base_url=self.base_url,
+                    api_key=self.api_key,
+                    http_client=self.transport.async_http_client,
+                    max_retries=0,
+                )
+                self.__async_clients[loop] = async_client
+            return async_client
+
+
+    def healthy(self, now):
+        return now >= self.unhealthy_until
+
+
+    def record_success(self, latency):
+        with self.__lock:
+            self.failures = 0
+            self.unhealthy_until = 0.0
+            self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+
+
+    def record_failure(self):
+        with self.__lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                if self.healthy(time.monotonic()):
+                    logger.warning("[MODEL] Endpoint %s failed %d times in a row, avoiding it for %.0f seconds.", self, self.failures, self.cooldown)
+                self.unhealthy_until = time.monotonic() + self.cooldown
+
+
+class OpenedStream:
+    """A stream whose first chunk has already been received."""
+
+
+    def __init__(self, stream, iterator, first):
+        self.stream = stream
+        self.iterator = iterator
+        self.first = first
+
+
+    def __iter__(self):
+        if self.first is not None:
+            yield self.first
+            yield from self.iterator
+
+
+    async def __aiter__(self):
+        if self.first is not None:
+            yield self.first
+            async for chunk in self.iterator:
+                yield chunk
+
+
+    def close(self):
+        return self.stream.close()
+
+
+class Router:
+    """
+    Routes model requests to a list of OpenAI compatible endpoints.
+
+    Healthy endpoints are tried in the order of their average time to first
+    token (endpoints without measurements first, in the configured order).
+    If a request fails with a retryable error, the next endpoint is tried right
+    away. If hedging is enabled and the first chunk of a response has not
+    arrived after the `hedge_percentile` of the recently observed times to
+    first token, a second request is sent to the next endpoint and the
+    response that starts first is used.
+
+    Methods:
+        open(request, timeout): Opens a stream on the best endpoint.
+        aopen(request, timeout): Asynchronous counterpart of `open`.
+    """
+
+
+    def __init__(self, endpoints, config):
+        self.endpoints = endpoints
+        self.hedge = config.HEDGE_REQUESTS
+        self.hedge_percentile = config.HEDGE_PERCENTILE
+        self.hedge_min_delay = config.HEDGE_MIN_DELAY
+        self.__executor = None
+        self.__executor_lock = threading.Lock()
+        self.__max_workers = config.MAX_CONNECTIONS
+        self.__latencies = deque(maxlen=LATENCY_WINDOW)
+        self.__latencies_lock = threading.Lock()
+
+        metrics = get_registry()
+        self.endpoint_metric = metrics.counter("model_endpoint_requests_total", "Number of requests sent to each model endpoint, by outcome.")
+        self.failover_metric = metrics.counter("model_failovers_total", "Number of requests that were sent to another endpoint after an error.")
+        self.hedge_metric = metrics.counter("model_hedged_requests_total", "Number of hedged requests, by whether they responded first.")
+
+
+    @classmethod
+    def from_config(cls, config, api_key, transport):
+        """
+        Returns a router for the endpoints of a configuration.
+
+        Each endpoint in `ENDPOINTS` is a dictionary with a `base_url`, a
+        `model` and optionally an `api_key`. Without `ENDPOINTS` the single
+        endpoint `BASE_URL` with `MODEL` is used.
+        """
+        endpoints = config.ENDPOINTS or [{"base_url": config.BASE_URL, "model": config.MODEL}]
+        return cls([
+            Endpoint(
+                base_url=endpoint["base_url"],
+                model=endpoint["model"],
+                api_key=endpoint.get("api_key") or api_key,
+                transport=transport,
+                failure_threshold=config.ENDPOINT_FAILURE_THRESHOLD,
+                cooldown=config.ENDPOINT_COOLDOWN
+            )
+            for endpoint in endpoints
+        ], config)
+
+
+    def ordered(self):
+        """Returns the endpoints in the order that they should be tried in."""
+        now = time.monotonic()
+        healthy = [endpoint for endpoint in self.endpoints if endpoint.healthy(now)]
+        unhealthy = [endpoint for endpoint in self.endpoints if not endpoint.healthy(now)]
+        healthy.sort(key=lambda endpoint: endpoint.latency or 0.0)
+        # Unhealthy endpoints are only used if all others fail
+        unhealthy.sort(key=lambda endpoint: endpoint.unhealthy_until)
+        return healthy + unhealthy
+
+
+    def __hedge_delay(self):
+        """
+        Returns the number of seconds after which a request is hedged, or
+        `None` if it should not be hedged.
+
+        The delay is derived from the times to first token that callers
+        observed, not from those of single endpoints, so that slow responses
+        that lost a race don't push it up.
+        """
+        if not self.hedge:
+            return None
+        with self.__latencies_lock:
+            if len(self.__latencies) < MIN_LATENCY_SAMPLES:
+                return None
+            ordered = sorted(self.__latencies)
+        latency = ordered[min(len(ordered) - 1, int(self.hedge_percentile * len(ordered)))]
+        return max(latency, self.hedge_min_delay)
+
+
+    def __observe(self, started):
+        with self.__latencies_lock:
+            self.__latencies.append(time.monotonic() - started)
+
+
+    def __record(self, endpoint, start, error=None):
+        if error is None:
+            endpoint.record_success(time.perf_counter() - start)
+            self.endpoint_metric.inc(endpoint=repr(endpoint), outcome="success")
+        elif Transport.is_retryable(error):
+            # Only errors of the endpoint count against its health
+            endpoint.record_failure()
+            self.endpoint_metric.inc(endpoint=repr(endpoint), outcome="failure")
+
+
+    def __next_endpoint(self, candidates, launched, hedge):
+        """
+        Returns the next endpoint to send a request to, or `None`. A hedged
+        request can be sent to the same endpoint if there is no other one.
+        """
+        if launched < len(candidates):
+            return candidates[launched]
+        return candidates[0] if hedge else None
+
+
+    @property
+    def executor(self):
+        with self.__executor_lock:
+            if self.__executor is None:
+                self.__executor = ThreadPoolExecutor(max_workers=self.__max_workers, thread_name_prefix="model-request")
+            return self.__executor
+
+
+    def open(self, request, timeout):
+        """
+        Opens a stream on the best endpoint and receives its first chunk.
+
+        Args:
+            request (callable): Opens a stream, called with the endpoint and
+                the `httpx.Timeout` that should be used for the request.
+            timeout (httpx.Timeout): Timeout of the request.
+
+        Returns an `OpenedStream`. Raises the last error if the requests to
+        all endpoints failed.
+        """
+        def attempt(endpoint):
+            start = time.perf_counter()
+            stream = None
+            try:
+                stream = request(endpoint, timeout)
+                iterator = iter(stream)
+                first = next(iterator, None)
+            except Exception as e:
+                if stream is not None:
+                    stream.close()
+                self.__record(endpoint, start, e)
+                raise
+            self.__record(endpoint, start)
+            return OpenedStream(stream, iterator, first)
+
+        def close_unused(future):
+            if not future.cancelled() and future.exception() is None:
+                future.result().close()
+
+        candidates = self.ordered()
+        started = time.monotonic()
+        error = None
+
+        if not self.hedge:
+            # Without hedging the endpoints are tried one after the other in
+            # the calling thread
+            for endpoint in candidates:
+                if error is not None:
+                    logger.warning("[MODEL] Request failed, failing over to %s. %s", endpoint, error)
+                    self.failover_metric.inc()
+                try:
+                    opened = attempt(endpoint)
+                except Exception as e:
+                    if not Transport.is_retryable(e):
+                        raise
+                    error = e
+                    continue
+                self.__observe(started)
+                return opened
+            raise error
+
+        # With hedging requests run in the router's executor, so that a
+        # hedged request can be sent while the first one waits
+        pending = {}
+        launched = 1
+        hedge = None
+        pending[self.executor.submit(attempt, candidates[0])] = candidates[0]
+        hedge_delay = self.__hedge_delay()
+        while pending:
+            timeout_left = None
+            if hedge_delay is not None and hedge is None:
+                timeout_left = max(hedge_delay - (time.monotonic() - started), 0)
+            done, _ = wait(pending, timeout=timeout_left, return_when=FIRST_COMPLETED)
+
+            if not done:
+                # First chunk is late, send a hedged request
+                endpoint = self.__next_endpoint(candidates, launched, hedge=True)
+                hedge = self.executor.submit(attempt, endpoint)
+                pending[hedge] = endpoint
+                launched += 1
+                self.hedge_metric.inc(outcome="sent")
+                continue
+
+            opened = None
+            for future in done:
+                endpoint = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    error = e
+                    continue
+                if opened is None:
+                    opened = result
+                    if hedge is not None:
+                        self.hedge_metric.inc(outcome="won" if future is hedge else "lost")
+                else:
+                    result.close()
+
+            if opened is not None or not Transport.is_retryable(error):
+                # Close the streams of requests that lost the race once they
+                # open
+                for future in pending:
+                    future.add_done_callback(close_unused)
+                if opened is None:
+                    raise error
+                self.__observe(started)
+                return opened
+
+            endpoint = self.__next_endpoint(candidates, launched, hedge=False)
+            if endpoint is not None:
+                logger.warning("[MODEL] Request failed, failing over to %s. %s", endpoint, error)
+                self.failover_metric.inc()
+                pending[self.executor.submit(attempt, endpoint)] = endpoint
+                launched += 1
+        raise error
+
+
+    async def aopen(self, request, timeout):
+        """Asynchronous counterpart of `open`, `request` returns a coroutine."""
+        async def attempt(endpoint):
+            start = time.perf_counter()
+            stream = None
+            try:
+                stream = await request(endpoint, timeout)
+                iterator = stream.__aiter__()
+                first = await anext(iterator, None)
+            except BaseException as e:
+                if stream is not None:
+                    await stream.close()
+                self.__record(endpoint, start, e)
+                raise
+            self.__record(endpoint, start)
+            return OpenedStream(stream, iterator, first)
+
+        candidates = self.ordered()
+        pending = {}
+        launched = 1
+        hedge = None
+        started = time.monotonic()
+        error = None
+
+        pending[asyncio.create_task(attempt(candidates[0]))] = candidates[0]
+        hedge_delay = self.__hedge_delay()
+        try:
+            while pending:
+                timeout_left = None
+                if hedge_delay is not None and hedge is None:
+                    timeout_left = max(hedge_delay - (time.monotonic() - started), 0)
+                done, _ = await asyncio.wait(pending, timeout=timeout_left, return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    # First chunk is late, send a hedged request
+                    endpoint = self.__next_endpoint(candidates, launched, hedge=True)
+                    hedge = asyncio.create_task(attempt(endpoint))
+                    pending[hedge] = endpoint
+                    launched += 1
+                    self.hedge_metric.inc(outcome="sent")
+                    continue
+
+                opened = None
+                for task in done:
+                    endpoint = pending.pop(task)
+                    try:
+                        result = task.result()
+                    except Exception as e:
+                        error = e
+                        continue
+                    if opened is None:
+                        opened = result
+                        if hedge is not None:
+                            self.hedge_metric.inc(outcome="won" if task is hedge else "lost")
+                    else:
+                        await result.close()
+
+                if opened is not None:
+                    self.__observe(started)
+                    return opened
+                if not Transport.is_retryable(error):
+                    raise error
+
+                endpoint = self.__next_endpoint(candidates, launched, hedge=False)
+                if endpoint is not None:
+                    logger.warning("[MODEL] Request failed, failing over to %s. %s", endpoint, error)
+                    self.failover_metric.inc()
+                    pending[asyncio.create_task(attempt(endpoint))] = endpoint
+                    launched += 1
+            raise error
+        finally:
+            # Cancel requests that lost the race and close their streams if
+            # they opened in the meantime
+            for task in pending:
+                task.cancel()
+            for result in await asyncio.gather(*pending, return_exceptions=True):
+                if isinstance(result, OpenedStream):
+                    await result.close()
+
+
+    def close(self):
+        if self.__executor is not None:
+            self.__executor.shutdown(wait=False)
@@ -0,0 +1,205 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from ...metrics import get_registry
+
+# Priority classes of model requests, from highest to lowest priority
+INTERACTIVE = "interactive"     # A user is waiting for the response (e.g. Discord)
+BATCH = "batch"                 # Periodic jobs (e.g. Twitter responses)
+BACKGROUND = "background"       # Work that can wait (e.g. pre-generated posts)
+PRIORITIES = (INTERACTIVE, BATCH, BACKGROUND)
+
+
+class Ticket:
+    """A request that waits for, or holds, a slot of the scheduler."""
+
+
+    def __init__(self, priority, tool):
+        self.priority = priority
+        self.tool = tool
+        self.enqueued = time.perf_counter()
+        self.granted = False
+        self.event = None
+        self.future = None
+
+
+class ModelScheduler:
+    """
+    Admits model requests by priority class, so that batch work can't starve
+    requests that a user is waiting for.
+
+    At most `max_in_flight` requests run at the same time. `reserved` of these
+    slots can only be used by interactive requests, so that interactive
+    requests don't have to wait for long batch generations to finish. Waiting
+    requests are admitted by priority class, and within a class round-robin
+    across tools. `tool_limits` caps the number of requests that a tool can
+    run at the same time.
+
+    Requests are admitted with `slot` from threads and with `aslot` from any
+    event loop.
+    """
+
+
+    def __init__(self, max_in_flight, reserved=0, tool_limits=None):
+        self.max_in_flight = max_in_flight
+        self.reserved = min(reserved, max_in_flight - 1)
+        self.tool_limits = dict(tool_limits or {})
+        self.__lock = threading.Lock()
+        self.__queues = {priority: {} for priority in PRIORITIES}
+        self.__in_flight = 0
+        self.__tool_in_flight = {}
+
+        metrics = get_registry()
+        self.wait_metric = metrics.histogram("model_queue_wait_seconds", "Time that model requests waited for a slot, by priority.")
+        self.queue_metric = metrics.gauge("model_queue_depth", "Number of model requests that wait for a slot, by priority.")
+        self.in_flight_metric = metrics.gauge("model_requests_in_flight", "Number of model requests that hold a slot.")
+
+
+    def __enqueue(self, ticket):
+        if ticket.priority not in self.__queues:
+            raise ValueError(f"Unknown priority {ticket.priority}, must be one of {', '.join(PRIORITIES)}")
+        # Tools are taken round-robin in the order that their queues were
+        # created in, a queue is removed once it is empty
+        self.__queues[ticket.priority].setdefault(ticket.tool, deque()).append(ticket)
+        self.queue_metric.inc(priority=ticket.priority)
+
+
+    def __can_run(self, priority, tool):
+        limit = self.max_in_flight if priority == INTERACTIVE else self.max_in_flight - self.reserved
+        if self.__in_flight >= limit:
+            return False
+        tool_limit = self.tool_limits.get(tool)
+        return tool_limit is None or self.__tool_in_flight.get(tool, 0) < tool_limit
+
+
+    def __dispatch(self):
+        """Grants slots to waiting requests, must be called with the lock held."""
+        for priority in PRIORITIES:
+            queues = self.__queues[priority]
+            progress = True
+            while queues and progress:
+                progress = False
+                for tool in list(queues):
+                    if not self.__can_run(priority, tool):
+                        continue
+                    queue = queues.pop(tool)
+                    self.__grant(queue.popleft())
+                    # Move the tool to the end of the round-robin order
+                    if queue:
+                        queues[tool] = queue
+                    progress = True
+
+
+    def __grant(self, ticket):
+        ticket.granted = True
+        self.__in_flight += 1
+        self.__tool_in_flight[ticket.tool] = self.__tool_in_flight.get(ticket.tool, 0) + 1
+        self.queue_metric.dec(priority=ticket.priority)
+        self.in_flight_metric.inc()
+        self.wait_metric.observe(time.perf_counter() - ticket.enqueued, priority=ticket.priority)
+        if ticket.event is not None:
+            ticket.event.set()
+        else:
+            loop, future = ticket.future
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+
+    def __remove(self, ticket):
+        """Removes a waiting request, must be called with the lock held."""
+        queues = self.__queues[ticket.priority]
+        queue = queues.get(ticket.tool)
+        if queue is not None and ticket in queue:
+            queue.remove(ticket)
+            self.queue_metric.dec(priority=ticket.priority)
+            if not queue:
+                del queues[ticket.tool]
+
+
+    def release(self, ticket):
+        """Releases the slot of a request and admits waiting requests."""
+        with self.__lock:
+            self.__in_flight -= 1
+            self.__tool_in_flight[ticket.tool] -= 1
+            self.in_flight_metric.dec()
+            self.__dispatch()
+
+
+    def acquire(self, priority, tool):
+        """Blocks until the request may run and returns its ticket."""
+        ticket = Ticket(priority, tool)
+        ticket.event = threading.Event()
+        with self.__lock:
+            self.__enqueue(ticket)
+            self.__dispatch()
+        ticket.event.wait()
+        return ticket
+
+
+    async def aacquire(self, priority, tool):
+        """Waits without blocking the event loop until the request may run."""
+        ticket = Ticket(priority, tool)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        ticket.future = (loop, future)
+        with self.__lock:
+            self.__enqueue(ticket)
+            self.__dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self.__lock:
+                granted = ticket.granted
+                if not granted:
+                    self.__remove(ticket)
+            if granted:
+                self.release(ticket)
+            raise
+        return ticket
+
+
+    def is_idle(self, max_in_flight=0):
+        """
+        Returns whether no requests wait for a slot and at most
+        `max_in_flight` requests hold one, e.g. to decide whether to start
+        background work.
+        """
+        with self.__lock:
+            waiting = any(self.__queues[priority] for priority in PRIORITIES)
+            return not waiting and self.__in_flight <= max_in_flight
+
+
+    def slot(self, priority, tool):
+        """Returns a context manager that holds a slot while it is entered."""
+        return Slot(self, priority, tool)
+
+
+    def aslot(self, priority, tool):
+        """Returns an async context manager that holds a slot while it is entered."""
+        return Slot(self, priority, tool)
+
+
+class Slot:
+    """Holds a slot of a scheduler while it is entered."""
+
+
+    def __init__(self, scheduler, priority, tool):
+        self.scheduler = scheduler
+        self.priority = priority
+        self.tool = tool
+
+
+    def __enter__(self):
+        self.ticket = self.scheduler.acquire(self.priority, self.tool)
+
+
+    def __exit__(self, *args):
+        self.scheduler.release(self.ticket)
+
+
+    async def __aenter__(self):
+        self.ticket = await self.scheduler.aacquire(self.priority, self.tool)
+
+
+    async def __aexit__(self, *args):
+        self.scheduler.release(self.ticket)
@@ -0,0 +1,268 @@
+import asyncio
+import email.utils
+import logging
+import random
+import threading
+import time
+import weakref
+import httpx
+import openai
+
+logger = logging.getLogger(__name__)
+
+# HTTP status codes of responses that are worth retrying
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class FirstTokenTimeoutError(TimeoutError):
+    """Raised when the model does not start responding in time."""
+
+
+class DeadlineExceededError(TimeoutError):
+    """Raised when a query takes longer than its deadline."""
+
+
+class Transport:
+    """
+    The HTTP transport that is used to connect to the model provider.
+
+    A single transport holds one pool of keep-alive connections for
+    synchronous requests and one for asynchronous requests per event loop, so
+    that it can be shared by all tools (asynchronous connections can't be
+    shared across event loops). Streaming requests are retried with jittered exponential
+    backoff if they fail before the first chunk of the response is received.
+
+    Attributes:
+        http_client (httpx.Client): Pooled client for synchronous requests.
+        async_http_client (httpx.AsyncClient): Pooled client for asynchronous
+            requests of the running event loop.
+
+    Methods:
+        stream(create, deadline): Opens a stream with retries and yields its
+            chunks.
+        astream(create, deadline): Asynchronous counterpart of `stream`.
+    """
+
+
+    def __init__(self, config):
+        self.config = config
+        limits = httpx.Limits(
+            max_connections=config.MAX_CONNECTIONS,
+            max_keepalive_connections=config.MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=config.KEEPALIVE_EXPIRY
+        )
+        self.__limits = limits
+        self.http_client = httpx.Client(limits=limits, timeout=self.__timeout(None))
+        self.__async_http_clients = weakref.WeakKeyDictionary()
+        self.__async_http_client = None
+        self.__lock = threading.Lock()
+
+
+    @property
+    def async_http_client(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        with self.__lock:
+            client = self.__async_http_clients.get(loop) if loop else self.__async_http_client
+            if client is None:
+                client = httpx.AsyncClient(limits=self.__limits, timeout=self.__timeout(None))
+                if loop:
+                    self.__async_http_clients[loop] = client
+                else:
+                    self.__async_http_client = client
+            return client
+
+
+    def __timeout(self, deadline):
+        """
+        Returns the timeouts of a request that has to finish before deadline.
+
+        The time to the first token is bounded exactly by `astream` and
+        checked by `stream`. The read timeout of the socket must allow for it
+        as well, because the first chunk is usually the slowest one to arrive.
+        """
+        read = max(self.config.READ_TIMEOUT, self.config.FIRST_TOKEN_TIMEOUT or 0)
+        connect = self.config.CONNECT_TIMEOUT
+        if deadline is not None:
+            remaining = max(deadline - time.monotonic(), 0.001)
+            read = min(read, remaining)
+            connect = min(connect, remaining)
+        return httpx.Timeout(connect=connect, read=read, write=connect, pool=connect)
+
+
+    def __deadline(self, deadline):
+        """Returns the absolute deadline of a request that takes `deadline` s"""
+        deadline = self.config.REQUEST_DEADLINE if deadline is None else deadline
+        return None if deadline is None else time.monotonic() + deadline
+
+
+    def __retry_delay(self, attempt, error, deadline):
+        """
+        Returns the number of seconds to wait before retrying after error, or
+        `None` if the request should not be retried.
+        """
+        if attempt >= self.config.MAX_RETRIES or not self.is_retryable(error):
+            return None
+
+        delay = self.__retry_after(error)
+        if delay is None:
+            # Full jitter exponential backoff
+            delay = random.uniform(0, min(
+                self.config.RETRY_BACKOFF_MAX,
+                self.config.RETRY_BACKOFF_BASE * 2 ** attempt
+            ))
+
+        if deadline is not None and time.monotonic() + delay >= deadline:
+            return None
+        return delay
+
+
+    @staticmethod
+    def is_retryable(error):
+        """Returns whether a request that failed with error can be retried."""
+        if isinstance(error, DeadlineExceededError):
+            return False
+        if isinstance(error, (openai.APIConnectionError, FirstTokenTimeoutError, httpx.TransportError)):
+            return True
+        if isinstance(error, openai.APIStatusError):
+            return error.status_code in RETRYABLE_STATUS_CODES
+        return False
+
+
+    @staticmethod
+    def __retry_after(error):
+        """Returns the delay requested by the Retry-After header of an error."""
+        response = getattr(error, "response", None)
+        if response is None:
+            return None
+        retry_after_ms = response.headers.get("retry-after-ms")
+        if retry_after_ms is not None:
+            try:
+                return float(retry_after_ms) / 1000
+            except ValueError:
+                pass
+        retry_after = response.headers.get("retry-after")
+        if retry_after is None:
+            return None
+        try:
+            return max(float(retry_after), 0.0)
+        except ValueError:
+            date = email.utils.parsedate_to_datetime(retry_after)
+            return max(date.timestamp() - time.time(), 0.0) if date else None
+
+
+    def stream(self, create, deadline=None):
+        """
+        Opens a stream and yields its chunks.
+
+        Args:
+            create (callable): Opens the stream. It is called with the
+                `httpx.Timeout` that should be used for the request.
+            deadline (float): Number of seconds after which the request is
+                abandoned. Defaults to `REQUEST_DEADLINE`.
+        """
+        deadline = self.__deadline(deadline)
+        attempt = 0
+        while True:
+            stream = None
+            try:
+                # A blocking read can't be interrupted, so the time to the
+                # first token is checked when the response starts and when
+                # its first chunk arrives
+                first_token_deadline = None
+                if self.config.FIRST_TOKEN_TIMEOUT:
+                    first_token_deadline = time.monotonic() + self.config.FIRST_TOKEN_TIMEOUT
+                stream = create(self.__timeout(deadline))
+                self.__check_first_token(first_token_deadline)
+                iterator = iter(stream)
+                first = next(iterator, None)
+                self.__check_first_token(first_token_deadline)
+                break
+            except Exception as e:
+                if stream is not None:
+                    stream.close()
+                delay = self.__retry_delay(attempt, e, deadline)
+                if delay is None:
+                    raise
+                logger.warning("[MODEL] Request failed, retrying in %.1f seconds. %s", delay, e)
+                time.sleep(delay)
+                attempt += 1
+
+        try:
+            if first is None:
+                return
+            yield first
+            for chunk in iterator:
+                if deadline is not None and time.monotonic() > deadline:
+                    raise DeadlineExceededError("Model response exceeded the request deadline.")
+                yield chunk
+        finally:
+            stream.close()
+
+
+    @staticmethod
+    def __check_first_token(first_token_deadline):
+        if first_token_deadline is not None and time.monotonic() > first_token_deadline:
+            raise FirstTokenTimeoutError("Model did not start responding in time.")
+
+
+    async def astream(self, create, deadline=None):
+        """
+        Opens a stream without blocking the event loop and yields its chunks.
+
+        Args:
+            create (callable): Returns a coroutine that opens the stream. It is
+                called with the `httpx.Timeout` that should be used for the
+                request.
+            deadline (float): Number of seconds after which the request is
+                abandoned. Defaults to `REQUEST_DEADLINE`.
+        """
+        deadline = self.__deadline(deadline)
+        attempt = 0
+        while True:
+            stream = None
+            try:
+                first_token_timeout = self.config.FIRST_TOKEN_TIMEOUT
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    first_token_timeout = min(first_token_timeout or remaining, remaining)
+                try:
+                    async with asyncio.timeout(first_token_timeout):
+                        stream = await create(self.__timeout(deadline))
+                        iterator = stream.__aiter__()
+                        first = await anext(iterator, None)
+                except TimeoutError as e:
+                    raise FirstTokenTimeoutError("Model did not start responding in time.") from e
+                break
+            except Exception as e:
+                if stream is not None:
+                    await stream.close()
+                delay = self.__retry_delay(attempt, e, deadline)
+                if delay is None:
+                    raise
+                logger.warning("[MODEL] Request failed, retrying in %.1f seconds. %s", delay, e)
+                await asyncio.sleep(delay)
+                attempt += 1
+
+        try:
+            if first is None:
+                return
+            yield first
+            async for chunk in iterator:
+                if deadline is not None and time.monotonic() > deadline:
+                    raise DeadlineExceededError("Model response exceeded the request deadline.")
+                yield chunk
+        finally:
+            await stream.close()
+
+
+    def close(self):
+        """Closes the synchronous connection pool."""
+        self.http_client.close()
+
+
+    async def aclose(self):
+        """Closes the asynchronous connection pool of the running event loop."""
+        await self.async_http_client.aclose()
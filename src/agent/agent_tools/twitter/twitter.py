@@ -1,13 +1,29 @@
+import asyncio
 import datetime
 import logging
-import schedule
+import queue
+import random
+import threading
 import time
 import tweepy
-from pprint import pformat
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
+from ...agent_logging import Payload
+from ...metrics import get_registry
+from ...scheduler import Scheduler
+from ..model.model_dedup import NearDuplicateIndex
+from ..model.model_prompt import PromptBuilder
+from ..model.model_scheduler import BATCH
 from .twitter_config import TwitterConfig
+from .twitter_conversations import ConversationIndex
+from .twitter_post_pool import IDLE_POLL_INTERVAL, PostPool
+from .twitter_rate_limits import RateLimitedClient, RateLimits
+from .twitter_state import TwitterState
+from .twitter_query import plan_queries
+from .twitter_stream import RULE_MAX_LENGTH, StreamingClient, TwitterStream
 
 logger = logging.getLogger(__name__)
-logging.basicConfig(format="%(levelname)s: %(message)s", level=logging.INFO)
 
 class Twitter:
     """A class for interfacing with the Twitter API using Tweepy.
@@ -35,7 +51,12 @@ class Twitter:
             access_token,
             access_token_secret,
             bearer_token,
-            model):
+            model,
+            config=None,
+            client=None,
+            scheduler=None,
+            stream_client=None,
+            executor=None):
         """
         Initializes the Twitter class with with the necessary parameters.
 
@@ -47,236 +68,787 @@ class Twitter:
                 authentication.
             bearer_token (str, optional): The Bearer token for OAuth 2.0
                 authentication.
+            model (Model): The model that is used to generate responses.
+            config (TwitterConfig, optional): Configuration of the tool. By
+                default `TwitterConfig` is used.
+            client (tweepy.Client, optional): A client that is used instead of
+                creating one from the credentials (e.g. a stand-in client for
+                benchmarks).
+            scheduler (Scheduler, optional): A scheduler that is shared with
+                other tools. Its owner is responsible for running it. By
+                default the tool creates and runs its own scheduler.
+            stream_client (StreamingClient, optional): A filtered stream
+                client that is used instead of creating one from the bearer
+                token if `FILTERED_STREAM` is enabled.
+            executor (concurrent.futures.Executor, optional): An executor
+                that is shared with other tools, in which searches and
+                responses run. By default the tool creates its own.
 
         Sets up the Tweepy client for both OAuth 1.0a and OAuth 2.0 
-        authentication and retrieves the authenticated user's ID.
+        authentication. The authenticated user's ID is retrieved on first use.
         """
         logger.info("[TWITTER] Initializing Twitter client...")
-        self.v2api = tweepy.Client(
+        self.model = model
+        self.config = config or TwitterConfig()
+
+        # Rate limits of the X API endpoints are tracked from response headers
+        self.rate_limits = RateLimits(safety_margin=self.config.RATE_LIMIT_SAFETY_MARGIN)
+        self.v2api = client or RateLimitedClient(
             bearer_token=bearer_token,
             consumer_key=consumer_key,
             consumer_secret=consumer_secret,
             access_token=access_token,
             access_token_secret=access_token_secret,
-            return_type=dict
+            return_type=dict,
+            rate_limits=self.rate_limits
         )
         
-        logger.info("[TWITTER] Starting Twitter client...")
-        self.user = self.v2api.get_me()
-        self.username = self.user["data"]["username"]
-        self.user_id = self.user["data"]["id"]
-
-        self.model = model
-        self.config = TwitterConfig()
+        # The authenticated user is fetched on first use, so that creating
+        # the tool doesn't wait for the X API
+        self.__user = None
+        self.__user_lock = threading.Lock()
 
         # Calculate interval in minutes between runs
         self.interval = 1440.0 / self.config.RUNS_PER_DAY
 
-        logging.info(f"[TWITTER] Connected to twitter user @{self.username} with id {self.user_id}.")
-        
+        # Posts are made one at a time and are spaced by `POST_INTERVAL`
+        self.post_lock = threading.Lock()
+        self.last_post_time = 0.0
+
+        # Conversations are grouped and responded to by one run, stream batch
+        # or fallback poll at a time, and all of them count towards the limit
+        # of `RESPONSES_PER_RUN * RUNS_PER_DAY` responses in the past day
+        self.respond_lock = threading.Lock()
+        self.recent_responses = deque()
+
+        # State that is kept between runs (e.g. search cursors)
+        self.state = TwitterState(self.config.STATE_PATH)
+
+        # Conversations are rendered compactly and fit to the token budget
+        self.prompt_builder = PromptBuilder(
+            turn_format=self.config.CONVERSATION_FORMAT,
+            token_budget=self.config.PROMPT_TOKEN_BUDGET
+        )
+
+        # Set up metrics
+        metrics = get_registry().labeled(account=self.config.ACCOUNT)
+        self.search_metric = metrics.histogram("twitter_search_seconds", "Time taken to fetch new tweets for a search query, including all pages.")
+        self.tweets_fetched_metric = metrics.counter("twitter_tweets_fetched_total", "Number of tweets fetched by searches.")
+        self.conversations_metric = metrics.counter("twitter_conversations_grouped_total", "Number of conversations with new tweets found by searches.")
+        self.posts_metric = metrics.counter("twitter_posts_total", "Number of tweets posted, by status.")
+        self.post_source_metric = metrics.counter("twitter_post_source_total", "Number of posts by where their text came from (pool or model).")
+        self.duplicates_metric = metrics.counter("twitter_conversations_duplicate_total", "Number of conversations whose newest tweet was nearly the same as a recently responded tweet, by action.")
+
+        # Conversations of key users, kept across runs
+        self.conversations = ConversationIndex()
+
+        # Key users are split across as many search queries as needed to
+        # keep each query within the X API's query length limit
+        self.search_queries = plan_queries(
+            self.config.KEY_USERS,
+            self.config.KEY_PHRASE,
+            self.config.QUOTE_MODE,
+            self.config.SEARCH_QUERY_MAX_LENGTH
+        )
+
+        # Jobs are scheduled around the rate limits of the endpoints they use
+        self.owns_scheduler = scheduler is None
+        self.scheduler = scheduler or Scheduler()
+        self.jobs = []
+
+        # Searches and responses run in an executor that is kept across runs,
+        # at most `MAX_CONCURRENT_SEARCHES` and `MAX_CONCURRENT_RESPONSES` of
+        # them at a time
+        self.owns_executor = executor is None
+        self.executor = executor or ThreadPoolExecutor(
+            max_workers=max(self.config.MAX_CONCURRENT_SEARCHES, self.config.MAX_CONCURRENT_RESPONSES),
+            thread_name_prefix="twitter"
+        )
+
+        # Tweets of key users are pushed by the filtered stream instead of
+        # being searched for every run
+        self.stream = None
+        if self.config.FILTERED_STREAM:
+            self.stream = TwitterStream(
+                stream_client or StreamingClient(bearer_token),
+                backoff_base=self.config.STREAM_BACKOFF_BASE,
+                backoff_max=self.config.STREAM_BACKOFF_MAX,
+                fallback_attempts=self.config.STREAM_FALLBACK_ATTEMPTS,
+                poll_interval=self.interval * 60,
+                metrics=metrics
+            )
+            self.stream_queue = queue.Queue()
+            # Tweets that were posted while the agent was stopped are
+            # responded to by the first run of the stream job
+            self.caught_up = False
+            self.stream_reply_metric = metrics.histogram("twitter_stream_reply_seconds", "Time from receiving a streamed tweet to posting the response.")
+
+        # Near-duplicates of recently responded tweets are answered with the
+        # earlier response or skipped, instead of querying the model
+        self.duplicates = None
+        if self.config.DUPLICATE_ACTION is not None:
+            if self.config.DUPLICATE_ACTION not in ("reuse", "skip"):
+                raise ValueError(f"[TWITTER] Unknown duplicate action {self.config.DUPLICATE_ACTION}, must be \"reuse\", \"skip\" or None")
+            self.duplicates = NearDuplicateIndex(
+                threshold=self.config.DUPLICATE_SIMILARITY,
+                window=self.config.DUPLICATE_WINDOW,
+                max_entries=self.config.DUPLICATE_MAX_ENTRIES
+            )
+
+        # Posts are generated ahead of time while the model is idle
+        self.post_pool = None
+        if self.config.POST_MODE and self.config.POST_POOL_SIZE:
+            self.post_pool = PostPool(
+                self.model,
+                self.state,
+                self.config.POST_PROMPT,
+                size=self.config.POST_POOL_SIZE,
+                max_age=self.config.POST_POOL_MAX_AGE_HOURS * 3600,
+                similarity_threshold=self.config.POST_POOL_SIMILARITY,
+                temperature=self.config.POST_POOL_TEMPERATURE,
+                idle_in_flight=self.config.POST_POOL_IDLE_IN_FLIGHT,
+                metrics=metrics
+            )
+
         if not self.config.KEY_USERS:
             raise Exception("[TWITTER] You need to configure your twitter agent's key users")
         if not self.config.RUNS_PER_DAY:
             raise Exception("[TWITTER] You need to configure your twitter agent's runs per day")
 
 
+    @property
+    def user(self):
+        """The authenticated user, as returned by `get_me`."""
+        with self.__user_lock:
+            if self.__user is None:
+                logger.info("[TWITTER] Starting Twitter client...")
+                self.__user = self.v2api.get_me()
+                logger.info("[TWITTER] Connected to twitter user @%s with id %s.", self.__user["data"]["username"], self.__user["data"]["id"])
+            return self.__user
+
+
+    @property
+    def username(self):
+        return self.user["data"]["username"]
+
+
+    @property
+    def user_id(self):
+        return self.user["data"]["id"]
+
+
+    def connect(self):
+        """Fetches the authenticated user, so that the first job doesn't wait for it."""
+        return self.user
+
+
     def run(self):
-        def job():
+        self.connect()
+        self.__schedule_jobs()
+
+        # A shared scheduler is run by its owner
+        if self.owns_scheduler:
+            self.scheduler.run()
+
+
+    async def arun(self):
+        """
+        Runs the tool on the running event loop until it is cancelled.
+
+        Requests to the X API are blocking, so they are made in the loop's
+        default executor.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, self.connect)
+            self.__schedule_jobs()
+            if self.owns_scheduler:
+                await self.scheduler.arun()
+            else:
+                # A shared scheduler is run by its owner
+                await asyncio.Event().wait()
+        finally:
+            self.stop()
+
+
+    def stop(self):
+        """
+        Cancels the jobs of the tool, stops the stream and the post pool and
+        the scheduler and executor of the tool if it owns them.
+        """
+        for job in self.jobs:
+            self.scheduler.cancel(job)
+        if self.stream is not None:
+            self.stream.stop()
+        if self.post_pool is not None:
+            self.post_pool.stop()
+        if self.owns_scheduler:
+            self.scheduler.stop()
+        if self.owns_executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+    def __schedule_jobs(self):
+        """
+        Schedules the jobs of the tool. They run in the scheduler's threads,
+        or in the executor of its event loop, so that the tool doesn't need
+        threads of its own apart from the one that reads the stream.
+        """
+        def respond_job():
+            self.state.compact(self.config.STATE_RETENTION_DAYS)
             self.respond_to_key_users()
-            if self.config.POST_MODE:
-                self.post_tweet()
 
-        job()
+        def schedule(interval, function, name, endpoints=()):
+            self.jobs.append(self.scheduler.every(
+                interval,
+                function,
+                endpoints=endpoints,
+                rate_limits=self.rate_limits if endpoints else None,
+                name=f"@{self.username} {name}"
+            ))
+
+        # Schedule jobs to run at calculated interval, the scheduler defers a
+        # job while the rate limit of an endpoint that it uses is exhausted
+        if self.stream is not None:
+            self.__start_stream()
+            schedule(self.config.STREAM_BATCH_WINDOW, self.__respond_to_stream, "stream", endpoints=["create_tweet"])
+            schedule(self.interval * 60, lambda: self.state.compact(self.config.STATE_RETENTION_DAYS), "compact")
+        else:
+            schedule(self.interval * 60, respond_job, "respond", endpoints=["search", "create_tweet"])
+        if self.post_pool is not None:
+            schedule(IDLE_POLL_INTERVAL, self.post_pool.fill, "post-pool")
+        if self.config.POST_MODE:
+            schedule(self.interval * 60, self.make_post, "post", endpoints=["create_tweet"])
+
+
+    def __start_stream(self):
+        """
+        Starts receiving tweets from the stream in a thread of its own, as
+        the stream client blocks while it is connected. Received tweets are
+        queued until the stream job responds to them.
+        """
+        rules = plan_queries(self.config.KEY_USERS, self.config.KEY_PHRASE, self.config.QUOTE_MODE, RULE_MAX_LENGTH)
+
+        def on_tweets(tweets, users, referenced_tweets):
+            self.stream_queue.put((time.perf_counter(), tweets, users, referenced_tweets))
+
+        threading.Thread(
+            target=self.stream.run,
+            args=(rules, f"agent @{self.username}", on_tweets),
+            kwargs={"user_id": self.user_id, "poll": self.respond_to_key_users},
+            daemon=True,
+            name=f"@{self.username} stream"
+        ).start()
+
 
-        # Schedule job to run at calculated interval
-        schedule.every(self.interval).minutes.do(job)
+    def __respond_to_stream(self):
+        """
+        Responds to conversations with the tweets that were received from the
+        stream since the last run. The first run responds to the tweets that
+        were posted while the agent was stopped first.
+
+        The job runs every `STREAM_BATCH_WINDOW` seconds and tweets received
+        in between are grouped before responding, so that a thread that is
+        posted in parts is responded to once. At most `RESPONSES_PER_RUN`
+        responses are posted per run and `RESPONSES_PER_RUN * RUNS_PER_DAY`
+        per day, together with the responses of fallback polls, the same
+        number as when searching.
+        """
+        if not self.caught_up:
+            self.respond_to_key_users()
+            self.caught_up = True
 
+        batch = []
         while True:
-            schedule.run_pending()
-            time.sleep(60)
+            try:
+                batch.append(self.stream_queue.get_nowait())
+            except queue.Empty:
+                break
+        if not batch:
+            return
 
+        # Tweets are grouped like search results, from newest to oldest
+        tweets, users, referenced_tweets = [], [], []
+        for _, batch_tweets, batch_users, batch_referenced_tweets in reversed(batch):
+            tweets.extend(batch_tweets)
+            users.extend(batch_users)
+            referenced_tweets.extend(batch_referenced_tweets)
+        self.tweets_fetched_metric.inc(len(tweets))
+
+        # Searches after a restart resume after the newest streamed tweet
+        newest_id = max(tweets, key=lambda tweet: int(tweet["id"]))["id"]
+        for query in self.search_queries:
+            self.state.set_since_id(query, newest_id)
+
+        with self.respond_lock:
+            relevant_conversations = self.__group_new_conversations(tweets, users, referenced_tweets)
+            max_responses = self.__remaining_responses()
+            if max_responses <= 0:
+                logger.warning("[TWITTER] Responded to max responses of the day, skipping %d conversations.", sum(map(len, relevant_conversations.values())))
+                return
+            response_count = self.__respond_to_conversations(relevant_conversations, max_responses)
+            self.__record_responses(response_count)
+
+        if response_count:
+            self.stream_reply_metric.observe(time.perf_counter() - batch[0][0])
+
+
+    def __search_recent_tweets(self, query, since_id=None, start_time=None, next_token=None):
+        """
+        Pages through recent tweets matching query, starting at `next_token`
+        if it is given, up to `MAX_SEARCH_PAGES` pages.
 
-    def __build_search_query_users(self, key_users):
-        """Returns a twitter search query for tweets from a list of users"""
-        return "(from:" + " OR from:".join(key_users) + ")"
+        Returns the tweets, the users and the referenced tweets of all pages,
+        the id of the newest tweet and the token of the next page, which is
+        `None` if all pages have been fetched.
+        """
+        tweets, users, referenced_tweets = [], [], []
+        newest_id = None
+        pages = 0
 
+        while True:
+            response = self.v2api.search_recent_tweets(
+                query=query,
+                since_id=since_id,
+                start_time=start_time,
+                next_token=next_token,
+                max_results=100,
+                tweet_fields=["created_at","author_id","conversation_id", "public_metrics"],
+                expansions=["author_id","referenced_tweets.id"]
+            )
+            logger.debug("[TWITTER] Twitter search results: %s", Payload(response))
+            pages += 1
 
-    def __build_search_query_key_phrase(self):
-        """Returns a twitter search query for tweets containing key phrase"""
-        return f' "{self.config.KEY_PHRASE}"'
-    
+            meta = response.get("meta", {})
+            # Results are returned from newest to oldest so the newest tweet is
+            # on the first page
+            if newest_id is None:
+                newest_id = meta.get("newest_id")
 
-    def __build_search_query_ignore_retweets(self):
-        """Returns a twitter search query that ignores retweets"""
-        return " -is:retweet"
-    
+            tweets.extend(response.get("data", []))
+            includes = response.get("includes", {})
+            users.extend(includes.get("users", []))
+            referenced_tweets.extend(includes.get("tweets", []))
 
-    def __build_search_query_ignore_quotes(self):
-        """Returns a twitter search query that ignores quotes"""
-        return " -is:quote"
+            next_token = meta.get("next_token")
+            if not next_token:
+                return tweets, users, referenced_tweets, newest_id, None
+            if self.config.MAX_SEARCH_PAGES and pages >= self.config.MAX_SEARCH_PAGES:
+                logger.warning("[TWITTER] Stopped search after %d pages, older results are fetched by the next run.", pages)
+                return tweets, users, referenced_tweets, newest_id, next_token
 
 
-    def __search_for_relevant_conversations(self, start_time=None):
+    def __fetch_new_tweets(self, query):
         """
-        Gets tweets from key users or from specific conversations.
-        
-        Returns tweets grouped by conversation_id.
+        Fetches tweets matching query that have been posted since the last run.
+
+        The id of the newest tweet that has been fetched for a query is
+        persisted, so that the next run resumes where this run stopped. On
+        the first run tweets from the past `interval` minutes are fetched. If
+        a search stops at `MAX_SEARCH_PAGES`, the next run continues it with
+        the older results before the cursor moves on, so that no tweets are
+        skipped.
         """
+        search_start = time.perf_counter()
+        continuation = self.state.get_search_continuation(query)
+        if continuation is not None:
+            since_id, start_time, next_token, newest_id = continuation
+            if start_time is not None:
+                start_time = datetime.datetime.fromtimestamp(start_time, datetime.timezone.utc)
+        else:
+            since_id = self.state.get_since_id(query)
+            start_time, next_token, newest_id = None, None, None
+            if since_id is None:
+                start_time = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(minutes=self.interval)
 
-        # Build search query
-        query = self.__build_search_query_users(self.config.KEY_USERS)
-        query += self.__build_search_query_ignore_retweets()
-        if self.config.KEY_PHRASE:
-            query += self.__build_search_query_key_phrase()
-        if self.config.QUOTE_MODE:
-            query += self.__build_search_query_ignore_quotes()
-        logging.debug(f"[TWITTER] Twitter search query: {query}")
+        try:
+            tweets, users, referenced_tweets, first_id, next_token = self.__search_recent_tweets(query, since_id, start_time, next_token)
+        except tweepy.BadRequest:
+            if since_id is None and continuation is None:
+                raise
+            # Search only covers the past seven days so since_id or the
+            # continued search may be too old
+            logger.warning("[TWITTER] Search cursor %s is no longer valid, resetting it...", since_id)
+            since_id, newest_id = None, None
+            start_time = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(minutes=self.interval)
+            tweets, users, referenced_tweets, first_id, next_token = self.__search_recent_tweets(query, None, start_time)
+
+        # A continued search keeps the newest id of its first page
+        newest_id = newest_id or first_id
+        if next_token is not None:
+            self.state.set_search_continuation(
+                query,
+                since_id,
+                start_time.timestamp() if start_time is not None else None,
+                next_token,
+                newest_id
+            )
+        else:
+            if continuation is not None:
+                self.state.clear_search_continuation(query)
+            if newest_id is not None:
+                self.state.set_since_id(query, newest_id)
+        self.search_metric.observe(time.perf_counter() - search_start)
+        self.tweets_fetched_metric.inc(len(tweets))
+        return tweets, users, referenced_tweets
 
-        # Search for tweets
-        response = self.v2api.search_recent_tweets(
-            query=query,
-            start_time=start_time,
-            tweet_fields=["created_at","author_id","conversation_id", "public_metrics"],
-            expansions=["author_id","referenced_tweets.id"]
-        )
-        logging.debug(f"[TWITTER] Twitter search results: {response}")
 
-        if not response.get("data", False):
-            return {}
+    def __search_for_relevant_conversations(self):
+        """
+        Gets new tweets from key users.
 
-        # Create authors lookup dict
-        authors = {user["id"]: user["username"] for user in response["includes"]["users"]}
-        logging.debug(f"[TWITTER] Authors look up dictionary: {authors}")
-
-        # Create tweets lookup dict
-        tweets = {tweet["id"]: tweet for tweet in response["data"]}
-        logging.debug(f"[TWITTER] Tweets look up dictionary: {tweets}")
-
-        conversations = {}
-        for tweet in tweets.values():
-            author_id = tweet["author_id"]
-            conversation_id = tweet["conversation_id"]
-
-            # We only want to consider replies that are part of a thread started
-            # by the author
-            referenced_tweets = tweet.get("referenced_tweets", [])
-            if referenced_tweets:
-                # Check that tweet is a reply
-                reply = referenced_tweets[0]["type"] == "replied_to"
-                # Check that tweet is a reply to another tweet in tweets
-                replied_to = tweets.get(referenced_tweets[0]["id"], False)
-                # Check that the tweet is a reply to a tweet by the same author
-                if reply and ((not replied_to) or (not replied_to["author_id"] == author_id)):
-                    continue
+        The search queries of all key users are run concurrently, up to
+        `MAX_CONCURRENT_SEARCHES` at a time. A query that fails is skipped
+        and catches up in the next run, unless all of them fail.
 
-            # If there is no entry corresponding to author then intialize
-            # object
-            authors_conversations = conversations.get(author_id, {})
-
-            # If there is no entry corresponding to conversation then intialize
-            # array
-            conversation = authors_conversations.get(conversation_id, [])
-            
-            # Add tweet to conversation
-            conversation.append(
-                {
-                    "id": tweet["id"],
-                    "text": tweet["text"],
-                    "author_id": tweet["author_id"],
-                    "author": authors[tweet["author_id"]],
-                    "created_at": tweet["created_at"],
-                    "conversation_id": tweet["conversation_id"],
-                    "referenced_tweets": referenced_tweets,
-                    "public_metrics": tweet["public_metrics"]
-                }
-            )
+        Returns the conversations with new tweets grouped by author_id and
+        conversation_id.
+        """
+        queries = self.search_queries
+        for query in queries:
+            logger.debug("[TWITTER] Twitter search query: %s", query)
+
+        # Search for tweets
+        results = []
+        error = None
+        waiting = iter(queries)
+        pending = {}
+        for query in islice(waiting, self.config.MAX_CONCURRENT_SEARCHES):
+            pending[self.executor.submit(self.__fetch_new_tweets, query)] = query
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                query = pending.pop(future)
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    error = e
+                    logger.exception("[TWITTER] Error searching for tweets with query %s. %s", query, e)
+                for query in islice(waiting, 1):
+                    pending[self.executor.submit(self.__fetch_new_tweets, query)] = query
+        if error is not None and not results:
+            raise error
+
+        # Users and referenced tweets can be included in several results
+        tweets, users, referenced_tweets = {}, {}, {}
+        for result_tweets, result_users, result_referenced_tweets in results:
+            tweets.update((tweet["id"], tweet) for tweet in result_tweets)
+            users.update((user["id"], user) for user in result_users)
+            referenced_tweets.update((tweet["id"], tweet) for tweet in result_referenced_tweets)
+
+        # Conversations are grouped from the newest to the oldest tweet, like
+        # the results of a single search
+        tweets = sorted(tweets.values(), key=lambda tweet: int(tweet["id"]), reverse=True)
+        return self.__group_new_conversations(tweets, list(users.values()), list(referenced_tweets.values()))
+
+
+    def __group_new_conversations(self, tweets, users, referenced_tweets):
+        """
+        Merges new tweets into the conversations of key users.
 
-            # Sort tweets in conversation from oldest to newest
-            sorted_conversation = sorted(conversation, key=lambda k: k["created_at"])
+        Returns the conversations with new tweets that the agent has not
+        responded to yet, grouped by author_id and conversation_id.
+        """
+        if not tweets:
+            return {}
 
-            # Update conversations dictionary
-            authors_conversations[conversation_id] = sorted_conversation
-            conversations[author_id] = authors_conversations
+        # Merge tweets into the conversations of previous runs
+        keys = self.conversations.merge(tweets, users, referenced_tweets)
+        self.conversations.prune(self.config.CONVERSATION_MAX_AGE_HOURS)
+        conversations = self.conversations.get(keys)
+
+        # Skip conversations that have no new tweets or that the agent has
+        # already responded to
+        for author_id, authors_conversations in list(conversations.items()):
+            for conversation_id, conversation in list(authors_conversations.items()):
+                new = any(not self.state.is_seen(tweet["id"]) for tweet in conversation)
+                if not new or self.state.has_responded(conversation_id):
+                    del authors_conversations[conversation_id]
+            if not authors_conversations:
+                del conversations[author_id]
+        self.state.mark_seen(tweet["id"] for tweet in tweets)
+        self.conversations_metric.inc(sum(len(authors_conversations) for authors_conversations in conversations.values()))
 
         return conversations
 
 
     def __get_relevant_conversations(self):
-        """Fetches all conversations involving key_users in past `hours`"""
+        """Fetches all conversations involving key_users since the last run"""
 
-        logging.debug(f"[TWITTER] Key users: {self.config.KEY_USERS}")
-        logging.info(f"[TWITTER] Fetching relevant conversations from past {self.interval} minutes...")
+        logger.debug("[TWITTER] Key users: %s", self.config.KEY_USERS)
+        logger.info("[TWITTER] Fetching relevant conversations since last run...")
 
-        start_time = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(minutes=self.interval)
-        relevant_conversations = self.__search_for_relevant_conversations(start_time=start_time)
+        relevant_conversations = self.__search_for_relevant_conversations()
 
-        logging.info(f"[TWITTER] Relevant conversations:")
+        logger.info("[TWITTER] Found %d relevant conversations.", sum(map(len, relevant_conversations.values())))
         if relevant_conversations:
-            logging.info(pformat(relevant_conversations))
+            logger.debug("[TWITTER] Relevant conversations:\n%s", Payload(relevant_conversations))
         return relevant_conversations
 
 
     def __respond_to_conversation(self, conversation, response):
         """Uses model to respond to conversation"""
 
-        logging.debug(pformat(conversation))
+        logger.debug("[TWITTER] Conversation:\n%s", Payload(conversation))
 
         first_tweet_id = conversation[0]["id"]
         last_tweet_id = conversation[-1]["id"]
         reply_tweet_id = last_tweet_id if not self.config.QUOTE_MODE else None
         quote_tweet_id = first_tweet_id if self.config.QUOTE_MODE else None
 
-        self.post_tweet(response, reply_tweet_id, quote_tweet_id)
+        success, tweet_id = self.post_tweet(response, reply_tweet_id, quote_tweet_id)
+        if success:
+            self.state.record_response(conversation[0]["conversation_id"], tweet_id, response)
+        return success
+
+
+    def __generate_responses(self, conversations):
+        """
+        Uses model to generate a response to each conversation, with a single
+        query for several conversations. Returns a list with the response to
+        each conversation, or `None` if generating it failed.
+
+        If `DUPLICATE_ACTION` is "reuse", conversations whose newest tweet is
+        a near-duplicate of a recently responded tweet get the earlier
+        response instead.
+        """
+        reuse = self.duplicates is not None and self.config.DUPLICATE_ACTION == "reuse"
+        responses = [None] * len(conversations)
+        if reuse:
+            for index, conversation in enumerate(conversations):
+                earlier_response, similarity = self.duplicates.find(conversation[-1]["text"])
+                if similarity:
+                    self.duplicates_metric.inc(action="reuse")
+                    logger.info("[TWITTER] Reusing response to a near-duplicate tweet in conversation %s.", conversation[0]["conversation_id"])
+                    responses[index] = random.choice(self.config.DUPLICATE_TEMPLATES).format(response=earlier_response)
+
+        indices = [index for index, response in enumerate(responses) if response is None]
+        if not indices:
+            return responses
+        if len(conversations) == 1:
+            prompt = self.prompt_builder.build(self.config.RESPONSE_PROMPT, conversations[0])
+            generated = [self.model.query(prompt, priority=BATCH, tool="twitter")]
+        else:
+            inputs = [
+                self.prompt_builder.render(self.config.RESPONSE_PROMPT, conversations[index])
+                for index in indices
+            ]
+            generated = self.model.query_batch(self.config.RESPONSE_PROMPT, inputs, priority=BATCH, tool="twitter")
+
+        for index, response in zip(indices, generated):
+            responses[index] = response
+            if reuse and response:
+                self.duplicates.add(conversations[index][-1]["text"], response)
+        return responses
+
+
+    def __skip_duplicate(self, conversation):
+        """
+        Returns whether a conversation is skipped because `DUPLICATE_ACTION`
+        is "skip" and its newest tweet is a near-duplicate of a recently
+        responded tweet. Tweets that are not skipped are remembered right
+        away, so that copies of a tweet in the same run are skipped too.
+        """
+        if self.duplicates is None or self.config.DUPLICATE_ACTION != "skip":
+            return False
+        text = conversation[-1]["text"]
+        _, similarity = self.duplicates.find(text)
+        if similarity:
+            self.duplicates_metric.inc(action="skip")
+            logger.info("[TWITTER] Skipping conversation %s, its newest tweet is a near-duplicate of a recent tweet.", conversation[0]["conversation_id"])
+            return True
+        self.duplicates.add(text)
+        return False
 
 
     def respond_to_key_users(self):
-        """Responds to tweets by key users"""
+        """Responds to tweets by key users that were posted since the last run."""
+
+        logger.info("[TWITTER] Responding to key users...")
+        with self.respond_lock:
+            relevant_conversations = self.__get_relevant_conversations()
+
+            # Terminate if there are no relevant conversations
+            if not relevant_conversations:
+                logger.info("[TWITTER] No conversations to respond to.")
+                return
+
+            max_responses = self.__remaining_responses()
+            if max_responses <= 0:
+                logger.warning("[TWITTER] Responded to max responses of the day, skipping %d conversations.", sum(map(len, relevant_conversations.values())))
+                return
+            response_count = self.__respond_to_conversations(relevant_conversations, max_responses)
+            self.__record_responses(response_count)
+        if response_count >= max_responses:
+            logger.info("[TWITTER] Responded to max responses.")
+        logger.info("[TWITTER] Successfully responded to relevant conversations.")
+
+
+    def __remaining_responses(self):
+        """
+        Returns how many responses may be posted now, at most
+        `RESPONSES_PER_RUN` and no more than are left of the
+        `RESPONSES_PER_RUN * RUNS_PER_DAY` responses of the past day.
+        """
+        while self.recent_responses and time.monotonic() - self.recent_responses[0] > 86400:
+            self.recent_responses.popleft()
+        daily_limit = self.config.RESPONSES_PER_RUN * self.config.RUNS_PER_DAY
+        return min(self.config.RESPONSES_PER_RUN, daily_limit - len(self.recent_responses))
+
 
-        logging.info(f"[TWITTER] Responding to key users...")
-        relevant_conversations = self.__get_relevant_conversations()
+    def __record_responses(self, response_count):
+        """Counts responses towards the daily limit."""
+        now = time.monotonic()
+        self.recent_responses.extend([now] * response_count)
+
+
+    def __respond_to_conversations(self, relevant_conversations, max_responses):
+        """
+        Responds to conversations and returns the number of posted responses.
+
+        Responses are generated concurrently by up to `MAX_CONCURRENT_RESPONSES`
+        model queries, each for up to `RESPONSE_BATCH_SIZE` conversations,
+        and posted one by one as they complete. No more than `max_responses`
+        responses are being generated or posted at any time, and a failed
+        generation or post is replaced by the next conversation so that the
+        agent still posts `max_responses` responses if it can.
+        """
         response_count = 0
+        conversations = iter([
+            conversation
+            for user_conversations in relevant_conversations.values()
+            for conversation in user_conversations.values()
+        ])
+        concurrency = max(1, min(self.config.MAX_CONCURRENT_RESPONSES, max_responses))
+
+        pending = {}
+        claimed = set()
+
+        def in_flight():
+            return sum(map(len, pending.values()))
+
+        def submit_next():
+            # Never generate more responses than can still be posted
+            size = min(self.config.RESPONSE_BATCH_SIZE, max_responses - response_count - in_flight())
+            batch = []
+            for conversation in conversations:
+                # Skip conversations that the agent has already responded to
+                conversation_id = conversation[0]["conversation_id"]
+                if conversation_id in claimed or self.state.has_responded(conversation_id):
+                    continue
+                if self.__skip_duplicate(conversation):
+                    claimed.add(conversation_id)
+                    continue
+                claimed.add(conversation_id)
+                logger.info("[TWITTER] Responding to conversation %s...", conversation_id)
+                batch.append(conversation)
+                if len(batch) >= size:
+                    break
+            if not batch:
+                return False
+            future = self.executor.submit(self.__generate_responses, batch)
+            pending[future] = batch
+            return True
+
+        while len(pending) < concurrency and response_count + in_flight() < max_responses:
+            if not submit_next():
+                break
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                batch = pending.pop(future)
+                try:
+                    # Generate responses using model
+                    responses = future.result()
+                except Exception as e:
+                    conversation_ids = ", ".join(conversation[0]["conversation_id"] for conversation in batch)
+                    logger.exception("[TWITTER] Error responding to conversation(s) %s. %s", conversation_ids, e)
+                    continue
 
-        # Terminate if there are no relevant conversations
-        if not relevant_conversations:
-            logging.info(f"[TWITTER] No conversations to respond to.")
-            return
-        
-        for user_conversations in relevant_conversations.values():
-            for conversation in user_conversations.values():
-                # Terminate if bot has already responded to max no of tweets
-                if response_count >= self.config.RESPONSES_PER_RUN:
-                    logging.info(f"[TWITTER] Responded to max responses.")
+                for conversation, response in zip(batch, responses):
+                    conversation_id = conversation[0]["conversation_id"]
+                    if response is None:
+                        logger.error("[TWITTER] No response was generated for conversation %s.", conversation_id)
+                        continue
+                    try:
+                        logger.info("[TWITTER] Response: %s", Payload(response))
+
+                        # Post response
+                        logger.debug("[TWITTER] Posting response...")
+                        if self.__respond_to_conversation(conversation, response):
+                            response_count += 1
+
+                    except Exception as e:
+                        logger.exception("[TWITTER] Error responding to conversation %s. %s", conversation_id, e)
+
+            while len(pending) < concurrency and response_count + in_flight() < max_responses:
+                if not submit_next():
                     break
 
-                conversation_id = conversation[0]["conversation_id"]
-                logging.info(f"[TWITTER] Responding to conversation {conversation_id}...")
+        return response_count
 
-                prompt = f"{self.config.RESPONSE_PROMPT} {conversation}"
-                try:
-                    # Generate response using model and remove quotation marks
-                    response = self.model.query(prompt)
-                    logging.info(f"[TWITTER] Response: {response}")
-                
-                    # Post response
-                    logging.info(f"[TWITTER] Posting response...")
-                    self.__respond_to_conversation(conversation, response)
-                    response_count += 1
 
-                except Exception as e:
-                    logging.exception(f"[TWITTER] Error responding to conversation {conversation_id}. {e}")
-                
-        logging.info(f"[TWITTER] Successfully responded to relevant conversations.")
+    def make_post(self):
+        """
+        Posts a tweet generated from `POST_PROMPT`. A pre-generated post is
+        taken from the post pool if there is one, otherwise the model is
+        queried.
+        """
+        post = self.post_pool.pop() if self.post_pool is not None else None
+        if post is not None:
+            self.post_source_metric.inc(source="pool")
+        else:
+            post = self.model.query(
+                self.config.POST_PROMPT,
+                priority=BATCH,
+                tool="twitter",
+                temperature=self.config.POST_POOL_TEMPERATURE,
+                use_cache=False
+            )
+            self.post_source_metric.inc(source="model")
+            if self.post_pool is not None:
+                self.post_pool.remember(post)
+        success, tweet_id = self.post_tweet(post)
+        if success:
+            self.state.record_post(tweet_id, post)
+        return success
 
 
     def post_tweet(self, post_text, in_reply_to_tweet_id=None, quote_tweet_id=None):
-        """Posts a new tweet or a reply to the specified tweet."""
-        try:
-            response = self.v2api.create_tweet(
-                in_reply_to_tweet_id=in_reply_to_tweet_id,
-                quote_tweet_id=quote_tweet_id,
-                text=post_text
-            )
-            return (True, response["data"]["id"])
-        except Exception as e:
-            logging.exception(f"[TWITTER] Error posting tweet: {e}")
-            return (False, None)
\ No newline at end of file
+        """
+        Posts a new tweet or a reply to the specified tweet.
+
+        Posts are spaced at least `POST_INTERVAL` seconds apart. If the X API
+        rate limit is exceeded the post is retried once the rate limit window
+        resets, up to `POST_RETRIES` times (the client waits for the reset).
+        """
+        for attempt in range(self.config.POST_RETRIES + 1):
+            try:
+                self.__wait_for_post_slot()
+                response = self.v2api.create_tweet(
+                    in_reply_to_tweet_id=in_reply_to_tweet_id,
+                    quote_tweet_id=quote_tweet_id,
+                    text=post_text
+                )
+                self.posts_metric.inc(status="success")
+                return (True, response["data"]["id"])
+            except tweepy.TooManyRequests as e:
+                if attempt == self.config.POST_RETRIES:
+                    logger.exception("[TWITTER] Error posting tweet: %s", e)
+                    break
+                logger.warning("[TWITTER] Post rate limit exceeded, retrying after rate limit resets...")
+            except Exception as e:
+                logger.exception("[TWITTER] Error posting tweet: %s", e)
+                break
+        self.posts_metric.inc(status="failure")
+        return (False, None)
+
+
+    def __wait_for_post_slot(self):
+        """Blocks until at least `POST_INTERVAL` seconds passed since last post"""
+        with self.post_lock:
+            delay = self.last_post_time + self.config.POST_INTERVAL - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self.last_post_time = time.monotonic()
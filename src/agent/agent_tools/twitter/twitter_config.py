@@ -17,6 +17,26 @@ class TwitterConfig:
         # Prompt that is provided to model to generate a post
         self.POST_PROMPT = "Generate a post for my twitter using less than 280 characters. Do not use hashtags."
 
+        # Number of posts that are generated ahead of time while the model is
+        # idle, so that posts are made without waiting for the model (0 to
+        # generate each post when it is due)
+        self.POST_POOL_SIZE = 3
+
+        # Number of hours after which a pre-generated post is discarded
+        self.POST_POOL_MAX_AGE_HOURS = 12
+
+        # Similarity (from 0 to 1) of a pre-generated post to a pooled or
+        # recent post above which it is rejected as a duplicate
+        self.POST_POOL_SIMILARITY = 0.5
+
+        # Temperature of posts, whether pre-generated or not (None for the
+        # model's temperature, which must be above 0 for posts to differ)
+        self.POST_POOL_TEMPERATURE = 0.9
+
+        # Number of model requests that may be running while posts are
+        # generated ahead of time, no posts are generated while requests wait
+        self.POST_POOL_IDLE_IN_FLIGHT = 0
+
         # Prompt that is provided to model, along with twitter conversation, to
         # generate a response
         self.RESPONSE_PROMPT = "Respond to this twitter conversation using less than 280 characters. Do not use hashtags."
@@ -25,4 +45,103 @@ class TwitterConfig:
         self.RESPONSES_PER_RUN = 1
        
         # Agent will run this number of times per day
-        self.RUNS_PER_DAY = 12
\ No newline at end of file
+        self.RUNS_PER_DAY = 12
+
+        # Maximum number of responses that are generated by the model at the
+        # same time
+        self.MAX_CONCURRENT_RESPONSES = 4
+
+        # Maximum number of conversations that are responded to with a single
+        # model query, so that the prompt is sent once for all of them (1 to
+        # query the model once per conversation, see BATCH_TOKEN_BUDGET in
+        # ModelConfig)
+        self.RESPONSE_BATCH_SIZE = 1
+
+        # What the agent does with a conversation whose newest tweet is
+        # nearly the same as a tweet it responded to recently: "reuse" posts
+        # the earlier response again (formatted with one of
+        # DUPLICATE_TEMPLATES), "skip" ignores the conversation and None
+        # responds to it as usual
+        self.DUPLICATE_ACTION = None
+
+        # Similarity (from 0 to 1) above which a tweet is a near-duplicate
+        self.DUPLICATE_SIMILARITY = 0.8
+
+        # Number of seconds for which responded tweets are remembered, and
+        # the maximum number of remembered tweets
+        self.DUPLICATE_WINDOW = 86400.0
+        self.DUPLICATE_MAX_ENTRIES = 5000
+
+        # Templates of reused responses, formatted with the earlier response,
+        # one is picked at random (X rejects posts that repeat a recent post
+        # of the account word for word)
+        self.DUPLICATE_TEMPLATES = ["{response}"]
+
+        # Minimum number of seconds between posts
+        self.POST_INTERVAL = 1.0
+
+        # Number of times a post is retried after the rate limit is exceeded
+        self.POST_RETRIES = 1
+
+        # Path of the database file in which the agent keeps its state between
+        # runs (e.g. the newest tweet that it has already seen)
+        self.STATE_PATH = "twitter_state.sqlite3"
+
+        # Maximum number of pages of 100 tweets that are fetched per search
+        # (None for no limit), the next run continues a search that has more
+        self.MAX_SEARCH_PAGES = 10
+
+        # Maximum number of characters of a search query, key users are split
+        # across as many queries as needed (512 at the Basic access level of
+        # the X API, 4096 at the Pro access level)
+        self.SEARCH_QUERY_MAX_LENGTH = 512
+
+        # Maximum number of search queries that are run at the same time
+        self.MAX_CONCURRENT_SEARCHES = 4
+
+        # Number of days for which the agent remembers the conversations it
+        # responded to and the tweets it has seen
+        self.STATE_RETENTION_DAYS = 30
+
+        # Number of requests per X API rate limit window that the agent keeps
+        # in reserve for each endpoint
+        self.RATE_LIMIT_SAFETY_MARGIN = 1
+
+        # Number of hours for which the agent keeps track of a conversation
+        # after its last tweet
+        self.CONVERSATION_MAX_AGE_HOURS = 48
+
+        # Format of each tweet of a conversation in the prompt that is provided
+        # to the model (can use the fields id, text, author, author_id,
+        # created_at and conversation_id)
+        self.CONVERSATION_FORMAT = "@{author}: {text}"
+
+        # Maximum number of tokens of the prompt that is provided to the model
+        # to generate a response, older tweets are left out to fit (None for
+        # no limit)
+        self.PROMPT_TOKEN_BUDGET = 1024
+
+        # If true the agent receives the tweets of key users from the X API
+        # filtered stream as they are posted and responds within seconds,
+        # instead of searching for them RUNS_PER_DAY times (requires access
+        # to the filtered stream)
+        self.FILTERED_STREAM = False
+
+        # Number of seconds between responses to the tweets that were
+        # streamed in between, so that a thread that is posted in parts is
+        # responded to once
+        self.STREAM_BATCH_WINDOW = 5.0
+
+        # Number of seconds before the stream is reconnected after it was
+        # closed, doubled with every failed attempt up to STREAM_BACKOFF_MAX
+        self.STREAM_BACKOFF_BASE = 1.0
+        self.STREAM_BACKOFF_MAX = 300.0
+
+        # Number of failed reconnections in a row after which key users are
+        # searched for (at most once per run interval) until the stream is
+        # connected again
+        self.STREAM_FALLBACK_ATTEMPTS = 3
+
+        # Name of the account in the accounts file, set by the agent. The
+        # metrics of the tool are labeled with it (None for no label)
+        self.ACCOUNT = None
@@ -0,0 +1,115 @@
+import bisect
+import datetime
+
+
+class ConversationIndex:
+    """
+    An index of key users' conversations, keyed by (author_id, conversation_id).
+
+    Only the tweets of a thread that the author started are kept: a reply is
+    indexed only if it replies to a tweet by the same author. Tweets are kept
+    sorted from oldest to newest, and new pages of search results are merged
+    into the index incrementally, so conversations span multiple runs.
+
+    Methods:
+        merge(tweets, users, referenced_tweets): Adds tweets to the index and
+            returns the keys of the conversations that have new tweets.
+        get(keys): Returns conversations grouped by author and conversation id.
+        prune(max_age_hours): Removes conversations that have had no new tweets
+            in the past `max_age_hours` hours.
+    """
+
+
+    def __init__(self):
+        self.__conversations = {}
+        self.__tweets = {}
+
+
+    def __len__(self):
+        return len(self.__conversations)
+
+
+    def merge(self, tweets, users, referenced_tweets=()):
+        """
+        Adds tweets to the index.
+
+        Args:
+            tweets (list[dict]): Tweets returned by the X API.
+            users (list[dict]): Users included in the X API response.
+            referenced_tweets (list[dict]): Referenced tweets included in the X
+                API response. They are used to find the author of a tweet that
+                is replied to if it is not part of the index.
+
+        Returns the set of (author_id, conversation_id) keys of conversations
+        that have new tweets.
+        """
+        authors = {user["id"]: user["username"] for user in users}
+        page = {tweet["id"]: tweet for tweet in tweets}
+        referenced = {tweet["id"]: tweet for tweet in referenced_tweets}
+        touched = set()
+
+        # Search results are returned from newest to oldest, so tweets are
+        # visited from oldest to newest and are usually appended in order
+        for tweet in reversed(tweets):
+            if tweet["id"] in self.__tweets:
+                continue
+
+            author_id = tweet["author_id"]
+            referenced_tweets = tweet.get("referenced_tweets", [])
+
+            # We only want to consider replies that are part of a thread
+            # started by the author
+            if referenced_tweets and referenced_tweets[0]["type"] == "replied_to":
+                replied_to_id = referenced_tweets[0]["id"]
+                replied_to = (
+                    self.__tweets.get(replied_to_id)
+                    or page.get(replied_to_id)
+                    or referenced.get(replied_to_id)
+                )
+                if not replied_to or replied_to["author_id"] != author_id:
+                    continue
+
+            entry = {
+                "id": tweet["id"],
+                "text": tweet["text"],
+                "author_id": author_id,
+                "author": authors.get(author_id),
+                "created_at": tweet["created_at"],
+                "conversation_id": tweet["conversation_id"],
+                "referenced_tweets": referenced_tweets,
+                "public_metrics": tweet.get("public_metrics", {}),
+            }
+            key = (author_id, tweet["conversation_id"])
+            conversation = self.__conversations.setdefault(key, [])
+            if not conversation or conversation[-1]["created_at"] <= entry["created_at"]:
+                conversation.append(entry)
+            else:
+                bisect.insort(conversation, entry, key=lambda k: k["created_at"])
+            self.__tweets[entry["id"]] = entry
+            touched.add(key)
+
+        return touched
+
+
+    def get(self, keys):
+        """Returns conversations grouped by author id and conversation id."""
+        conversations = {}
+        for author_id, conversation_id in keys:
+            conversation = self.__conversations.get((author_id, conversation_id))
+            if conversation:
+                conversations.setdefault(author_id, {})[conversation_id] = list(conversation)
+        return conversations
+
+
+    def prune(self, max_age_hours):
+        """
+        Removes conversations that have had no new tweets in the past
+        `max_age_hours` hours.
+        """
+        cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(hours=max_age_hours)
+        cutoff = cutoff.strftime("%Y-%m-%dT%H:%M:%S.000Z")
+        for key, conversation in list(self.__conversations.items()):
+            if conversation[-1]["created_at"] < cutoff:
+                for tweet in conversation:
+                    del self.__tweets[tweet["id"]]
+                del self.__conversations[key]
@@ -0,0 +1,154 @@
+import logging
+import threading
+import time
+from ...metrics import get_registry
+from ..model.model_dedup import NearDuplicateIndex
+from ..model.model_scheduler import BACKGROUND
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of characters of a post
+POST_MAX_LENGTH = 280
+
+# Number of seconds between runs of `fill`, which check whether the model is
+# idle
+IDLE_POLL_INTERVAL = 5.0
+
+# Maximum number of seconds to wait after generations in a row failed
+FAILURE_BACKOFF_MAX = 600.0
+
+# Number of recent posts that new posts are compared to
+RECENT_POSTS = 100
+
+
+class PostPool:
+    """
+    A pool of posts that are generated ahead of time, so that a post can be
+    made as soon as it is due without waiting for the model.
+
+    `fill` generates posts with background priority while the model scheduler
+    is idle, until the pool holds `size` posts. The pool is kept in the
+    tool's state, so that posts survive restarts. Posts that are older than
+    `max_age` seconds are discarded, and posts that are too similar to a post
+    in the pool or to a recent post of the agent are rejected.
+
+    Args:
+        model (Model): The model that generates posts.
+        state (TwitterState): The state in which the pool is kept.
+        prompt (str): Prompt that is provided to the model to generate a post.
+        size (int): Maximum number of posts in the pool.
+        max_age (float): Number of seconds after which a post is discarded.
+        similarity_threshold (float): Estimated similarity of two posts
+            above which they are duplicates, see `NearDuplicateIndex`.
+        temperature (float): Temperature of generated posts, or `None` for
+            the model's temperature.
+        idle_in_flight (int): Number of model requests that may be running
+            for the model to count as idle.
+        metrics (MetricsRegistry, optional): Registry of the pool's metrics,
+            by default the agent's registry.
+    """
+
+
+    def __init__(self, model, state, prompt, size, max_age, similarity_threshold=0.5, temperature=None, idle_in_flight=0, metrics=None):
+        self.model = model
+        self.state = state
+        self.prompt = prompt
+        self.size = size
+        self.max_age = max_age
+        self.similarity_threshold = similarity_threshold
+        self.temperature = temperature
+        self.idle_in_flight = idle_in_flight
+        self.__stopped = threading.Event()
+        self.__failures = 0
+        self.__next_attempt = 0.0
+
+        # Pooled and recent posts, oldest first so that the newest are kept
+        self.index = NearDuplicateIndex(threshold=similarity_threshold, max_entries=RECENT_POSTS + size)
+        for post in reversed(self.state.get_recent_posts(RECENT_POSTS)):
+            self.index.add(post)
+        for post in self.state.get_pooled_posts():
+            self.index.add(post)
+
+        metrics = metrics or get_registry()
+        self.size_metric = metrics.gauge("twitter_post_pool_size", "Number of pre-generated posts in the pool.")
+        self.generated_metric = metrics.counter("twitter_post_pool_generated_total", "Number of posts generated for the pool, by outcome.")
+        self.expired_metric = metrics.counter("twitter_post_pool_expired_total", "Number of pre-generated posts that were discarded because they were too old.")
+        self.size_metric.set(len(self.state.get_pooled_posts()))
+
+
+    def pop(self):
+        """Removes and returns the oldest post of the pool, or `None` if it is empty."""
+        post = self.state.pop_pooled_post(time.time() - self.max_age)
+        self.size_metric.set(len(self.state.get_pooled_posts()))
+        return post
+
+
+    def expire(self):
+        """Discards posts that are older than `max_age`."""
+        removed = self.state.expire_pooled_posts(time.time() - self.max_age)
+        if removed:
+            self.expired_metric.inc(removed)
+            logger.info("[TWITTER] Discarded %d expired post(s) from the post pool.", removed)
+
+
+    def is_duplicate(self, post):
+        """Returns whether post is too similar to a pooled or recent post."""
+        _, similarity = self.index.find(post)
+        return bool(similarity)
+
+
+    def remember(self, post):
+        """Remembers a post that was made without the pool, so that it isn't repeated."""
+        self.index.add(post)
+
+
+    def generate(self):
+        """Generates a post and adds it to the pool, returns whether it was added."""
+        try:
+            post = self.model.query(
+                self.prompt,
+                priority=BACKGROUND,
+                tool="twitter",
+                temperature=self.temperature,
+                use_cache=False
+            ).strip()
+        except Exception as e:
+            self.generated_metric.inc(outcome="failed")
+            logger.exception("[TWITTER] Error generating post for the post pool. %s", e)
+            return False
+
+        if not post or len(post) > POST_MAX_LENGTH:
+            outcome = "invalid"
+        elif self.is_duplicate(post):
+            outcome = "duplicate"
+        else:
+            outcome = "added"
+            self.state.add_pooled_post(post)
+            self.index.add(post)
+        self.generated_metric.inc(outcome=outcome)
+        self.size_metric.set(len(self.state.get_pooled_posts()))
+        logger.debug("[TWITTER] Generated post for the post pool (%s).", outcome)
+        return outcome == "added"
+
+
+    def fill(self):
+        """
+        Generates posts until the pool is full, the model is busy or `stop`
+        is called. It is meant to be run every `IDLE_POLL_INTERVAL` seconds
+        (e.g. as a scheduled job), and skips runs to back off after posts
+        were rejected or failed in a row.
+        """
+        while not self.__stopped.is_set() and time.monotonic() >= self.__next_attempt:
+            self.expire()
+            if len(self.state.get_pooled_posts()) >= self.size or not self.model.scheduler.is_idle(self.idle_in_flight):
+                return
+            if self.generate():
+                self.__failures = 0
+            else:
+                self.__failures += 1
+                self.__next_attempt = time.monotonic() + min(FAILURE_BACKOFF_MAX, IDLE_POLL_INTERVAL * 2 ** self.__failures)
+
+
+    def stop(self):
+        """Stops generating posts."""
+        self.__stopped.set()
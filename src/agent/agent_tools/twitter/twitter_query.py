@@ -0,0 +1,47 @@
+class QueryTooLongError(ValueError):
+    """Raised when a single key user doesn't fit into a query."""
+
+
+def plan_queries(key_users, key_phrase=None, quote_mode=False, max_length=512):
+    """
+    Packs key users into the fewest search queries (or filtered stream
+    rules) that fit into `max_length` characters.
+
+    Each query matches the tweets of some of the key users with the same
+    filters: retweets are ignored, the key phrase must be contained and in
+    quote mode quote tweets are ignored. Together the queries match the same
+    tweets as a single query for all key users would.
+
+    Users are placed into the first query that still has room for them, in
+    the order in which they are configured. Adding a user therefore leaves
+    the other queries unchanged, so that they keep their search cursors, and
+    with few users the single query is the same as before queries were
+    split.
+
+    Returns a list of query strings.
+    """
+    filters = " -is:retweet"
+    if key_phrase:
+        filters += f' "{key_phrase}"'
+    if quote_mode:
+        filters += " -is:quote"
+
+    # Length of a query with no users, "(from:)" and the filters
+    empty_length = len("(from:)") + len(filters)
+    separator_length = len(" OR from:")
+
+    shards = []
+    lengths = []
+    for user in dict.fromkeys(key_users):
+        if empty_length + len(user) > max_length:
+            raise QueryTooLongError(f"[TWITTER] Key user {user} does not fit into a query of {max_length} characters.")
+        for i, length in enumerate(lengths):
+            if length + separator_length + len(user) <= max_length:
+                shards[i].append(user)
+                lengths[i] = length + separator_length + len(user)
+                break
+        else:
+            shards.append([user])
+            lengths.append(empty_length + len(user))
+
+    return ["(from:" + " OR from:".join(users) + ")" + filters for users in shards]
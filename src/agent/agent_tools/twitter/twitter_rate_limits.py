@@ -0,0 +1,153 @@
+import logging
+import threading
+import time
+import tweepy
+
+logger = logging.getLogger(__name__)
+
+
+# X API endpoints whose rate limits are tracked, by request method and route
+ENDPOINTS = {
+    ("GET", "/2/tweets/search/recent"): "search",
+    ("POST", "/2/tweets"): "create_tweet",
+    ("GET", "/2/users/me"): "get_me",
+}
+
+
+class RateLimitBucket:
+    """
+    The rate limit of a single X API endpoint.
+
+    The X API allows a fixed number of requests per endpoint in each rate
+    limit window and reports the number of remaining requests and the time at
+    which the window resets in the `x-rate-limit-*` response headers.
+    """
+
+
+    def __init__(self):
+        self.limit = None
+        self.remaining = None
+        self.reset = 0.0
+
+
+    def update(self, headers):
+        """Updates the bucket from the rate limit headers of a response."""
+        limit = headers.get("x-rate-limit-limit")
+        remaining = headers.get("x-rate-limit-remaining")
+        reset = headers.get("x-rate-limit-reset")
+        if limit is not None:
+            self.limit = int(limit)
+        if remaining is not None:
+            self.remaining = int(remaining)
+        if reset is not None:
+            self.reset = float(reset)
+
+
+    def ready_at(self, safety_margin, now):
+        """Returns the time at which the next request can be made."""
+        if self.remaining is None or now >= self.reset:
+            return now
+        if self.remaining > safety_margin:
+            return now
+        return self.reset
+
+
+    def consume(self, now):
+        """Accounts for a request that is about to be made."""
+        if self.remaining is None:
+            return
+        if now >= self.reset:
+            # The window has reset, the response headers will tell us the
+            # new number of remaining requests
+            self.remaining = None
+        else:
+            self.remaining -= 1
+
+
+class RateLimits:
+    """
+    Tracks the rate limits of the X API endpoints that the agent uses.
+
+    Attributes:
+        safety_margin (int): Number of requests per rate limit window that are
+            kept in reserve.
+
+    Methods:
+        acquire(endpoint): Blocks until a request to endpoint can be made.
+        update(endpoint, headers): Updates the rate limit of endpoint from the
+            headers of a response.
+        ready_at(endpoints): Returns the time at which requests can be made to
+            all of the endpoints.
+    """
+
+
+    def __init__(self, safety_margin=1):
+        self.safety_margin = safety_margin
+        self.__buckets = {name: RateLimitBucket() for name in ENDPOINTS.values()}
+        self.__lock = threading.Lock()
+
+
+    def acquire(self, endpoint):
+        """Blocks until a request to endpoint can be made."""
+        bucket = self.__buckets.get(endpoint)
+        if bucket is None:
+            return
+        while True:
+            with self.__lock:
+                now = time.time()
+                ready_at = bucket.ready_at(self.safety_margin, now)
+                if ready_at <= now:
+                    bucket.consume(now)
+                    return
+            logger.warning("[TWITTER] Rate limit of %s endpoint reached, waiting %.0f seconds...", endpoint, ready_at - now)
+            time.sleep(ready_at - now)
+
+
+    def update(self, endpoint, headers):
+        """Updates the rate limit of endpoint from the headers of a response."""
+        bucket = self.__buckets.get(endpoint)
+        if bucket is None:
+            return
+        with self.__lock:
+            bucket.update(headers)
+
+
+    def ready_at(self, endpoints, now=None):
+        """Returns the time at which requests can be made to all endpoints."""
+        now = time.time() if now is None else now
+        with self.__lock:
+            return max(
+                [self.__buckets[endpoint].ready_at(self.safety_margin, now) for endpoint in endpoints],
+                default=now
+            )
+
+
+    def remaining(self, endpoint):
+        """Returns the number of remaining requests to endpoint, if known."""
+        with self.__lock:
+            return self.__buckets[endpoint].remaining
+
+
+class RateLimitedClient(tweepy.Client):
+    """
+    A Tweepy client that waits for the rate limit of an endpoint before making
+    a request and keeps track of rate limits using the response headers.
+    """
+
+
+    def __init__(self, *args, rate_limits, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.rate_limits = rate_limits
+
+
+    def request(self, method, route, params=None, json=None, user_auth=False):
+        endpoint = ENDPOINTS.get((method, route))
+        self.rate_limits.acquire(endpoint)
+        try:
+            response = super().request(method, route, params=params, json=json, user_auth=user_auth)
+        except tweepy.HTTPException as e:
+            if e.response is not None:
+                self.rate_limits.update(endpoint, e.response.headers)
+            raise
+        self.rate_limits.update(endpoint, response.headers)
+        return response
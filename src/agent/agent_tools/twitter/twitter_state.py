@@ -0,0 +1,321 @@
+import sqlite3
+import threading
+import time
+
+# The database file is rewritten to reclaim the space of removed entries once
+# this many entries were removed, or once a week if any were removed
+VACUUM_MIN_REMOVED = 10000
+VACUUM_INTERVAL = 7 * 86400
+
+
+class TwitterState:
+    """
+    A small SQLite store for state that the Twitter tool keeps between runs.
+
+    The ids of answered conversations and seen tweets are also kept in memory,
+    so that looking them up is O(1) no matter how long the agent has been
+    running. Old entries are removed by `compact`.
+
+    Attributes:
+        path (str): Path of the database file.
+
+    Methods:
+        get_since_id(query): Returns the newest tweet id that has been fetched
+            for a search query.
+        set_since_id(query, since_id): Stores the newest tweet id that has been
+            fetched for a search query.
+        get_search_continuation(query): Returns where a search that stopped
+            at the page limit continues.
+        set_search_continuation(query, ...): Stores where a search that
+            stopped at the page limit continues.
+        add_pooled_post(text): Adds a pre-generated post to the post pool.
+        pop_pooled_post(created_after): Removes and returns the oldest post
+            of the pool that was generated after `created_after`.
+    """
+
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS search_cursors ("
+            "query TEXT PRIMARY KEY, "
+            "since_id TEXT NOT NULL, "
+            "updated_at REAL NOT NULL)"
+        )
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS search_continuations ("
+            "query TEXT PRIMARY KEY, "
+            "since_id TEXT, "
+            "start_time REAL, "
+            "next_token TEXT NOT NULL, "
+            "newest_id TEXT, "
+            "updated_at REAL NOT NULL)"
+        )
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS responded_conversations ("
+            "conversation_id TEXT PRIMARY KEY, "
+            "tweet_id TEXT, "
+            "response TEXT NOT NULL, "
+            "responded_at REAL NOT NULL)"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS responded_conversations_responded_at "
+            "ON responded_conversations (responded_at)"
+        )
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS seen_tweets ("
+            "tweet_id TEXT PRIMARY KEY, "
+            "seen_at REAL NOT NULL)"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS seen_tweets_seen_at ON seen_tweets (seen_at)"
+        )
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS pooled_posts ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "text TEXT NOT NULL, "
+            "created_at REAL NOT NULL)"
+        )
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS posts ("
+            "tweet_id TEXT PRIMARY KEY, "
+            "text TEXT NOT NULL, "
+            "posted_at REAL NOT NULL)"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS posts_posted_at ON posts (posted_at)"
+        )
+        self._connection.commit()
+        self.__load()
+
+        # Entries removed since the file was last rewritten
+        self.__removed_since_vacuum = 0
+        self.__last_vacuum = time.time()
+
+
+    def __load(self):
+        """Loads the ids of answered conversations and seen tweets into memory"""
+        self.__responded = {
+            row[0] for row in
+            self._connection.execute("SELECT conversation_id FROM responded_conversations")
+        }
+        self.__seen = {
+            row[0] for row in
+            self._connection.execute("SELECT tweet_id FROM seen_tweets")
+        }
+
+
+    def get_since_id(self, query):
+        """Returns the newest tweet id fetched for query or `None`."""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT since_id FROM search_cursors WHERE query = ?", (query,)
+            ).fetchone()
+        return row[0] if row else None
+
+
+    def set_since_id(self, query, since_id):
+        """Stores the newest tweet id fetched for query."""
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO search_cursors (query, since_id, updated_at) "
+                "VALUES (?, ?, ?)",
+                (query, since_id, time.time())
+            )
+            self._connection.commit()
+
+
+    def get_search_continuation(self, query):
+        """
+        Returns the `since_id`, `start_time` (a Unix timestamp), `next_token`
+        and `newest_id` of a search for query that stopped at the page limit,
+        or `None`.
+        """
+        with self._lock:
+            return self._connection.execute(
+                "SELECT since_id, start_time, next_token, newest_id FROM search_continuations WHERE query = ?", (query,)
+            ).fetchone()
+
+
+    def set_search_continuation(self, query, since_id, start_time, next_token, newest_id):
+        """
+        Stores where a search for query that stopped at the page limit
+        continues. Its cursor is only moved to `newest_id` once all pages
+        have been fetched.
+        """
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO search_continuations "
+                "(query, since_id, start_time, next_token, newest_id, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (query, since_id, start_time, next_token, newest_id, time.time())
+            )
+            self._connection.commit()
+
+
+    def clear_search_continuation(self, query):
+        """Removes the continuation of a search for query, if there is one."""
+        with self._lock:
+            self._connection.execute("DELETE FROM search_continuations WHERE query = ?", (query,))
+            self._connection.commit()
+
+
+    def has_responded(self, conversation_id):
+        """Returns whether the agent has already responded to a conversation."""
+        return conversation_id in self.__responded
+
+
+    def get_response(self, conversation_id):
+        """Returns the response posted to a conversation or `None`."""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT response FROM responded_conversations WHERE conversation_id = ?",
+                (conversation_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+
+    def record_response(self, conversation_id, tweet_id, response):
+        """Stores the response that the agent posted to a conversation."""
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responded_conversations "
+                "(conversation_id, tweet_id, response, responded_at) VALUES (?, ?, ?, ?)",
+                (conversation_id, tweet_id, response, time.time())
+            )
+            self._connection.commit()
+            self.__responded.add(conversation_id)
+
+
+    def is_seen(self, tweet_id):
+        """Returns whether a tweet has already been seen."""
+        return tweet_id in self.__seen
+
+
+    def mark_seen(self, tweet_ids):
+        """Stores the ids of tweets that have been seen."""
+        now = time.time()
+        with self._lock:
+            new_ids = [tweet_id for tweet_id in tweet_ids if tweet_id not in self.__seen]
+            if not new_ids:
+                return
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO seen_tweets (tweet_id, seen_at) VALUES (?, ?)",
+                [(tweet_id, now) for tweet_id in new_ids]
+            )
+            self._connection.commit()
+            self.__seen.update(new_ids)
+
+
+    def add_pooled_post(self, text):
+        """Adds a pre-generated post to the post pool."""
+        with self._lock:
+            self._connection.execute(
+                "INSERT INTO pooled_posts (text, created_at) VALUES (?, ?)",
+                (text, time.time())
+            )
+            self._connection.commit()
+
+
+    def get_pooled_posts(self):
+        """Returns the texts of the posts in the post pool, oldest first."""
+        with self._lock:
+            return [
+                row[0] for row in
+                self._connection.execute("SELECT text FROM pooled_posts ORDER BY id")
+            ]
+
+
+    def expire_pooled_posts(self, created_before):
+        """
+        Removes the posts of the post pool that were generated before
+        `created_before` and returns the number of removed posts.
+        """
+        with self._lock:
+            removed = self._connection.execute(
+                "DELETE FROM pooled_posts WHERE created_at < ?", (created_before,)
+            ).rowcount
+            self._connection.commit()
+        return removed
+
+
+    def pop_pooled_post(self, created_after):
+        """
+        Removes and returns the oldest post of the post pool that was
+        generated after `created_after`, or `None` if there is none.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT id, text FROM pooled_posts WHERE created_at >= ? ORDER BY id LIMIT 1",
+                (created_after,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._connection.execute("DELETE FROM pooled_posts WHERE id = ?", (row[0],))
+            self._connection.commit()
+        return row[1]
+
+
+    def record_post(self, tweet_id, text):
+        """Stores a post that the agent made."""
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO posts (tweet_id, text, posted_at) VALUES (?, ?, ?)",
+                (tweet_id, text, time.time())
+            )
+            self._connection.commit()
+
+
+    def get_recent_posts(self, limit):
+        """Returns the texts of the agent's `limit` most recent posts."""
+        with self._lock:
+            return [
+                row[0] for row in
+                self._connection.execute("SELECT text FROM posts ORDER BY posted_at DESC LIMIT ?", (limit,))
+            ]
+
+
+    def compact(self, max_age_days):
+        """
+        Removes answered conversations, seen tweets, posts and search
+        continuations that are older than `max_age_days`. The space they used
+        is reclaimed once `VACUUM_MIN_REMOVED` entries were removed or
+        `VACUUM_INTERVAL` seconds passed, since VACUUM rewrites the whole
+        database file.
+
+        Returns the number of removed entries.
+        """
+        cutoff = time.time() - max_age_days * 86400
+        with self._lock:
+            removed = self._connection.execute(
+                "DELETE FROM responded_conversations WHERE responded_at < ?", (cutoff,)
+            ).rowcount
+            removed += self._connection.execute(
+                "DELETE FROM seen_tweets WHERE seen_at < ?", (cutoff,)
+            ).rowcount
+            removed += self._connection.execute(
+                "DELETE FROM posts WHERE posted_at < ?", (cutoff,)
+            ).rowcount
+            removed += self._connection.execute(
+                "DELETE FROM search_continuations WHERE updated_at < ?", (cutoff,)
+            ).rowcount
+            self._connection.commit()
+            if removed:
+                self.__load()
+                self.__removed_since_vacuum += removed
+
+            now = time.time()
+            due = now - self.__last_vacuum >= VACUUM_INTERVAL
+            if self.__removed_since_vacuum >= VACUUM_MIN_REMOVED or (due and self.__removed_since_vacuum):
+                self._connection.execute("VACUUM")
+                self.__removed_since_vacuum = 0
+                self.__last_vacuum = now
+        return removed
+
+
+    def close(self):
+        """Closes the connection to the database."""
+        with self._lock:
+            self._connection.close()
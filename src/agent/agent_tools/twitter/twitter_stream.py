@@ -0,0 +1,224 @@
+import json
+import logging
+import random
+import threading
+import time
+import tweepy
+from ...metrics import get_registry
+
+logger = logging.getLogger(__name__)
+
+# Maximum length of a filtered stream rule at the Basic access level
+RULE_MAX_LENGTH = 512
+
+# Fields that are requested for streamed tweets, the same as for searches
+TWEET_FIELDS = ["created_at", "author_id", "conversation_id", "public_metrics"]
+EXPANSIONS = ["author_id", "referenced_tweets.id"]
+
+
+class StreamingClient(tweepy.StreamingClient):
+    """A `tweepy.StreamingClient` that hands the stream's events to a listener."""
+
+
+    def __init__(self, bearer_token, listener=None, **kwargs):
+        super().__init__(bearer_token, return_type=dict, **kwargs)
+        self.listener = listener
+
+
+    def on_connect(self):
+        self.listener.on_connect()
+
+
+    def on_data(self, raw_data):
+        self.listener.on_data(raw_data)
+
+
+    def on_request_error(self, status_code):
+        self.listener.on_request_error(status_code)
+
+
+    def on_connection_error(self):
+        self.listener.on_connection_error()
+
+
+    def on_exception(self, exception):
+        self.listener.on_exception(exception)
+
+
+class TwitterStream:
+    """
+    Receives the tweets of key users from the X API v2 filtered stream as
+    they are posted.
+
+    The stream's rules are synced before connecting: rules with the stream's
+    tag that are no longer wanted are deleted and missing ones are added, so
+    that rules of other agents that use the same app are left alone. The
+    client reconnects after network and HTTP errors by itself. If the
+    connection ends for any other reason, it is reopened with jittered
+    exponential backoff. Once `fallback_attempts` reconnections in a row
+    have failed, tweets are searched for instead, at most every
+    `poll_interval` seconds, until the stream is connected again.
+
+    Args:
+        client (StreamingClient): The client that connects to the stream.
+            Any object with the same methods can be used (e.g. a stand-in
+            for benchmarks).
+        backoff_base (float): Seconds to wait before the first reconnection.
+        backoff_max (float): Maximum number of seconds between reconnections.
+        fallback_attempts (int): Number of failed reconnections in a row
+            after which tweets are searched for.
+        poll_interval (float): Minimum number of seconds between searches
+            while the stream is disconnected.
+        metrics (MetricsRegistry, optional): Registry of the stream's
+            metrics, by default the agent's registry.
+    """
+
+
+    def __init__(self, client, backoff_base=1.0, backoff_max=300.0, fallback_attempts=3, poll_interval=300.0, metrics=None):
+        self.client = client
+        self.client.listener = self
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.fallback_attempts = fallback_attempts
+        self.poll_interval = poll_interval
+        self.tag = None
+        self.user_id = None
+        self.on_tweets = None
+        self.poll = None
+        self.__attempt = 0
+        self.__last_poll = None
+        self.__stopped = threading.Event()
+
+        metrics = metrics or get_registry()
+        self.tweets_metric = metrics.counter("twitter_stream_tweets_total", "Number of tweets received from the filtered stream.")
+        self.reconnects_metric = metrics.counter("twitter_stream_reconnects_total", "Number of times the filtered stream was reconnected, by reason.")
+        self.connected_metric = metrics.gauge("twitter_stream_connected", "Whether the filtered stream is connected.")
+        self.polls_metric = metrics.counter("twitter_stream_fallback_polls_total", "Number of searches that were made while the filtered stream was disconnected.")
+
+
+    def sync_rules(self, rules, tag):
+        """Makes the rules of the stream with `tag` equal to `rules`."""
+        response = self.client.get_rules()
+        existing = {
+            rule["value"]: rule["id"]
+            for rule in response.get("data", [])
+            if rule.get("tag") == tag
+        }
+        stale = [rule_id for value, rule_id in existing.items() if value not in rules]
+        missing = [tweepy.StreamRule(value=value, tag=tag) for value in rules if value not in existing]
+        if stale:
+            self.client.delete_rules(stale)
+        if missing:
+            response = self.client.add_rules(missing)
+            for error in response.get("errors", []):
+                logger.error("[TWITTER] Stream rule was rejected: %s", error)
+        logger.info("[TWITTER] Synced %d stream rules (%d added, %d deleted).", len(rules), len(missing), len(stale))
+
+
+    def backoff(self, attempt):
+        """Returns the number of seconds to wait before a reconnection."""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+
+    def run(self, rules, tag, on_tweets, user_id=None, poll=None):
+        """
+        Syncs the rules and receives tweets until `stop` is called.
+
+        Args:
+            rules (list[str]): Values of the rules that tweets must match.
+            tag (str): Tag of the rules, only tweets that match a rule with
+                this tag are handed on.
+            on_tweets (callable): Called with the tweets, users and referenced
+                tweets of each response of the stream, in the same format as
+                search results.
+            user_id (str, optional): ID of the agent's user, whose own tweets
+                are not handed on.
+            poll (callable, optional): Called to search for tweets while the
+                stream can't be reconnected.
+        """
+        self.tag = tag
+        self.user_id = user_id
+        self.on_tweets = on_tweets
+        self.poll = poll
+        synced = False
+        while not self.__stopped.is_set():
+            try:
+                if not synced:
+                    self.sync_rules(rules, tag)
+                    synced = True
+                self.client.filter(tweet_fields=TWEET_FIELDS, expansions=EXPANSIONS)
+            except Exception as e:
+                logger.exception("[TWITTER] Stream failed. %s", e)
+            self.connected_metric.set(0)
+            if self.__stopped.is_set():
+                break
+
+            delay = self.backoff(self.__attempt)
+            self.__attempt += 1
+            self.reconnects_metric.inc(reason="closed")
+            if self.__attempt >= self.fallback_attempts:
+                self.__poll()
+            logger.warning("[TWITTER] Stream disconnected, reconnecting in %.1f seconds...", delay)
+            self.__stopped.wait(delay)
+
+
+    def __poll(self):
+        """Searches for tweets if the last search was at least `poll_interval` seconds ago."""
+        if self.poll is None:
+            return
+        if self.__last_poll is not None and time.monotonic() - self.__last_poll < self.poll_interval:
+            return
+        self.__last_poll = time.monotonic()
+        self.polls_metric.inc()
+        logger.warning("[TWITTER] Stream is disconnected, searching for tweets instead...")
+        try:
+            self.poll()
+        except Exception as e:
+            logger.exception("[TWITTER] Error searching for tweets while the stream is disconnected. %s", e)
+
+
+    def stop(self):
+        """Disconnects the stream."""
+        self.__stopped.set()
+        self.client.disconnect()
+
+
+    def on_connect(self):
+        self.__attempt = 0
+        self.connected_metric.set(1)
+        logger.info("[TWITTER] Connected to filtered stream.")
+
+
+    def on_data(self, raw_data):
+        data = json.loads(raw_data)
+        for error in data.get("errors", []):
+            logger.warning("[TWITTER] Stream error: %s", error)
+        tweet = data.get("data")
+        if tweet is None:
+            return
+        # Tweets of other agents' rules and the agent's own tweets are not
+        # responded to
+        tags = {rule.get("tag") for rule in data.get("matching_rules", [])}
+        if self.tag not in tags:
+            return
+        if self.user_id is not None and tweet.get("author_id") == self.user_id:
+            return
+        includes = data.get("includes", {})
+        self.tweets_metric.inc()
+        self.on_tweets([tweet], includes.get("users", []), includes.get("tweets", []))
+
+
+    def on_request_error(self, status_code):
+        self.connected_metric.set(0)
+        self.reconnects_metric.inc(reason=str(status_code))
+        logger.warning("[TWITTER] Stream request failed with status %s, reconnecting...", status_code)
+
+
+    def on_connection_error(self):
+        self.connected_metric.set(0)
+        self.reconnects_metric.inc(reason="connection")
+        logger.warning("[TWITTER] Stream connection failed, reconnecting...")
+
+
+    def on_exception(self, exception):
+        logger.error("[TWITTER] Stream stopped after an error. %s", exception)
@@ -0,0 +1,375 @@
+import asyncio
+import bisect
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Default histogram buckets in seconds, suitable for request latencies
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def label_key(labels):
+    """Returns a hashable key for a dictionary of labels."""
+    return tuple(sorted(labels.items()))
+
+
+def escape_label_value(value):
+    """Escapes a label value for the Prometheus text format."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(key):
+    """Formats a label key in the Prometheus text format."""
+    if not key:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label_value(value)}"' for name, value in key) + "}"
+
+
+class Counter:
+    """A metric that only goes up, e.g. the number of requests."""
+    type = "counter"
+
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self._values = {}
+        self._lock = threading.Lock()
+
+
+    def inc(self, amount=1, **labels):
+        key = label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+    def value(self, **labels):
+        return self._values.get(label_key(labels), 0)
+
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+
+    def summary(self):
+        with self._lock:
+            return {format_labels(key) or "total": value for key, value in self._values.items()}
+
+
+class Gauge(Counter):
+    """A metric that can go up and down, e.g. the number of queued messages."""
+    type = "gauge"
+
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[label_key(labels)] = value
+
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram:
+    """A metric that counts observations in buckets, e.g. latencies."""
+    type = "histogram"
+
+
+    def __init__(self, name, description, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+
+
+    def observe(self, value, **labels):
+        key = label_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key, (None, 0.0))
+            if counts is None:
+                counts = [0] * (len(self.buckets) + 1)
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+
+    def quantile(self, fraction, **labels):
+        """
+        Returns an estimate of a quantile: the upper bound of the bucket that
+        contains it.
+        """
+        with self._lock:
+            counts, _ = self._values.get(label_key(labels), (None, 0.0))
+        if not counts:
+            return None
+        return self.__quantile(counts, fraction)
+
+
+    def __quantile(self, counts, fraction):
+        rank = fraction * sum(counts)
+        cumulative = 0
+        for index, count in enumerate(counts):
+            cumulative += count
+            if cumulative >= rank and count:
+                return self.buckets[index] if index < len(self.buckets) else float("inf")
+        return None
+
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total) in self._values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    samples.append((f"{self.name}_bucket", key + (("le", repr(bound)),), cumulative))
+                cumulative += counts[-1]
+                samples.append((f"{self.name}_bucket", key + (("le", "+Inf"),), cumulative))
+                samples.append((f"{self.name}_sum", key, total))
+                samples.append((f"{self.name}_count", key, cumulative))
+        return samples
+
+
+    def summary(self):
+        with self._lock:
+            values = dict(self._values)
+        summary = {}
+        for key, (counts, total) in values.items():
+            count = sum(counts)
+            summary[format_labels(key) or "total"] = {
+                "count": count,
+                "mean": round(total / count, 4) if count else None,
+                "p50": self.__quantile(counts, 0.50),
+                "p95": self.__quantile(counts, 0.95),
+            }
+        return summary
+
+
+class LabeledMetric:
+    """
+    A view of a metric that adds the same labels to every sample, e.g. the
+    account of a tool, so that tool instances don't overwrite each other's
+    values.
+    """
+
+
+    def __init__(self, metric, labels):
+        self.metric = metric
+        self.labels = labels
+        self.name = metric.name
+
+
+    def inc(self, amount=1, **labels):
+        self.metric.inc(amount, **self.labels, **labels)
+
+
+    def dec(self, amount=1, **labels):
+        self.metric.dec(amount, **self.labels, **labels)
+
+
+    def set(self, value, **labels):
+        self.metric.set(value, **self.labels, **labels)
+
+
+    def observe(self, value, **labels):
+        self.metric.observe(value, **self.labels, **labels)
+
+
+    def value(self, **labels):
+        return self.metric.value(**self.labels, **labels)
+
+
+    def quantile(self, fraction, **labels):
+        return self.metric.quantile(fraction, **self.labels, **labels)
+
+
+class LabeledRegistry:
+    """A view of a registry whose metrics add the same labels to every sample."""
+
+
+    def __init__(self, registry, labels):
+        self.registry = registry
+        self.labels = labels
+
+
+    def counter(self, name, description=""):
+        return LabeledMetric(self.registry.counter(name, description), self.labels)
+
+
+    def gauge(self, name, description=""):
+        return LabeledMetric(self.registry.gauge(name, description), self.labels)
+
+
+    def histogram(self, name, description="", buckets=LATENCY_BUCKETS):
+        return LabeledMetric(self.registry.histogram(name, description, buckets), self.labels)
+
+
+class MetricsRegistry:
+    """
+    A collection of metrics that can be exported in the Prometheus text format
+    or summarized in the log.
+
+    Methods:
+        counter(name, description): Returns the counter with name.
+        gauge(name, description): Returns the gauge with name.
+        histogram(name, description, buckets): Returns the histogram with name.
+        labeled(**labels): Returns a view of the registry whose metrics add
+            labels to every sample.
+        render(): Returns all metrics in the Prometheus text format.
+        summary(): Returns a dictionary that summarizes all metrics.
+    """
+
+
+    def __init__(self):
+        self.__metrics = {}
+        self.__lock = threading.Lock()
+
+
+    def __get(self, metric_class, name, *args):
+        with self.__lock:
+            metric = self.__metrics.get(name)
+            if metric is None:
+                metric = metric_class(name, *args)
+                self.__metrics[name] = metric
+            elif type(metric) is not metric_class:
+                raise ValueError(f"Metric {name} is already registered as a {metric.type}")
+            return metric
+
+
+    def counter(self, name, description=""):
+        return self.__get(Counter, name, description)
+
+
+    def gauge(self, name, description=""):
+        return self.__get(Gauge, name, description)
+
+
+    def histogram(self, name, description="", buckets=LATENCY_BUCKETS):
+        return self.__get(Histogram, name, description, buckets)
+
+
+    def labeled(self, **labels):
+        """
+        Returns a view of the registry whose metrics add labels to every
+        sample. Labels that are `None` are left out, without any the registry
+        itself is returned.
+        """
+        labels = {name: value for name, value in labels.items() if value is not None}
+        return LabeledRegistry(self, labels) if labels else self
+
+
+    def render(self):
+        """Returns all metrics in the Prometheus text exposition format."""
+        with self.__lock:
+            metrics = list(self.__metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.description}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, key, value in metric.samples():
+                lines.append(f"{name}{format_labels(key)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+    def summary(self):
+        """Returns a dictionary that summarizes all metrics."""
+        with self.__lock:
+            metrics = list(self.__metrics.values())
+        summaries = {metric.name: metric.summary() for metric in metrics}
+        return {name: summary for name, summary in summaries.items() if summary}
+
+
+registry = MetricsRegistry()
+
+
+def get_registry():
+    """Returns the metrics registry that the agent and its tools report to."""
+    return registry
+
+
+def set_registry(new_registry):
+    """
+    Replaces the metrics registry. Tools look up their metrics when they are
+    initialized, so this must be called before they are.
+    """
+    global registry
+    registry = new_registry
+
+
+class MetricsServer:
+    """Serves the metrics of a registry in the Prometheus text format."""
+
+
+    def __init__(self, port, host="0.0.0.0", metrics_registry=None):
+        # Imported here because most agents don't serve metrics
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        metrics_registry = metrics_registry or get_registry()
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics_registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("content-type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("content-length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True, name="metrics-server").start()
+        logger.info(f"[METRICS] Serving metrics on port {self.server.server_address[1]}.")
+        return self
+
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class MetricsReporter:
+    """Periodically logs a summary of the metrics of a registry."""
+
+
+    def __init__(self, interval, metrics_registry=None):
+        self.interval = interval
+        self.metrics_registry = metrics_registry or get_registry()
+        self.__stopped = threading.Event()
+
+
+    def start(self):
+        threading.Thread(target=self.__run, daemon=True, name="metrics-reporter").start()
+        return self
+
+
+    def __run(self):
+        while not self.__stopped.wait(self.interval):
+            self.__report()
+
+
+    async def arun(self):
+        """Logs summaries from the running event loop until it is cancelled."""
+        while not self.__stopped.is_set():
+            await asyncio.sleep(self.interval)
+            self.__report()
+
+
+    def __report(self):
+        for name, summary in self.metrics_registry.summary().items():
+            logger.info("[METRICS] %s: %s", name, summary)
+
+
+    def stop(self):
+        self.__stopped.set()
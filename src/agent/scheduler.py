@@ -0,0 +1,255 @@
+import asyncio
+import heapq
+import inspect
+import itertools
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Job:
+    """A job that is run by the scheduler at a fixed interval."""
+
+
+    def __init__(self, function, interval, endpoints=(), rate_limits=None, name=None):
+        self.function = function
+        self.interval = interval
+        self.endpoints = tuple(endpoints)
+        self.rate_limits = rate_limits
+        self.name = name or getattr(function, "__name__", "job")
+        self.next_run = 0.0
+        self.cancelled = False
+
+
+    def ready_at(self, now):
+        """Returns the time at which the rate limits allow the job to run."""
+        if self.rate_limits is None or not self.endpoints:
+            return now
+        return max(now, self.rate_limits.ready_at(self.endpoints, now))
+
+
+class Scheduler:
+    """
+    Runs jobs at fixed intervals without exhausting API rate limits (e.g. of
+    the X API).
+
+    A single scheduler can be shared by the jobs of many tools and accounts.
+    `run` can be called from several threads, which then run due jobs
+    concurrently. `arun` runs the jobs from an event loop instead: jobs that
+    are coroutine functions run as tasks of the loop, other jobs run in an
+    executor.
+
+    The scheduler sleeps until the next job is due instead of polling. Before a
+    job is run, the rate limits of the endpoints that it uses are checked. If
+    any of them is exhausted the job is deferred until its rate limit window
+    resets, so that it does not run into 429 errors halfway through.
+
+    Methods:
+        every(interval, function, endpoints, rate_limits): Schedules a function
+            to run every `interval` seconds.
+        cancel(job): Stops running a scheduled job.
+        run(): Runs scheduled jobs until `stop` is called.
+        arun(concurrency, executor): Runs scheduled jobs from the running
+            event loop until `stop` is called or it is cancelled.
+        stop(): Stops the scheduler.
+    """
+
+
+    def __init__(self):
+        self.__jobs = []
+        self.__counter = itertools.count()
+        self.__condition = threading.Condition()
+        self.__stopped = False
+        # Events of the event loops that wait in `arun`
+        self.__wakeups = set()
+
+
+    def every(self, interval, function, endpoints=(), rate_limits=None, run_now=True, name=None):
+        """
+        Schedules a function to run every `interval` seconds.
+
+        Args:
+            interval (float): Number of seconds between runs.
+            function (callable): Function that is run.
+            endpoints (list[str]): API endpoints that the function uses.
+            rate_limits (RateLimits): Rate limits of the endpoints.
+            run_now (bool): If true the first run is due immediately, otherwise
+                it is due after `interval` seconds.
+        """
+        job = Job(function, interval, endpoints, rate_limits, name)
+        job.next_run = time.time() + (0 if run_now else interval)
+        self.__push(job)
+        return job
+
+
+    def __push(self, job):
+        with self.__condition:
+            heapq.heappush(self.__jobs, (job.next_run, next(self.__counter), job))
+            self.__condition.notify()
+            self.__wake()
+
+
+    def __wake(self):
+        """Wakes the event loops that wait for jobs, must be called with the lock held."""
+        for loop, wakeup in self.__wakeups:
+            loop.call_soon_threadsafe(wakeup.set)
+
+
+    def __next_due_job(self):
+        """Blocks until a job is due and returns it, or `None` once stopped."""
+        with self.__condition:
+            while not self.__stopped:
+                if not self.__jobs:
+                    self.__condition.wait()
+                    continue
+                next_run, _, job = self.__jobs[0]
+                delay = next_run - time.time()
+                if delay > 0 and not job.cancelled:
+                    self.__condition.wait(delay)
+                    continue
+                heapq.heappop(self.__jobs)
+                if not job.cancelled:
+                    return job
+            return None
+
+
+    def __poll(self):
+        """
+        Returns a due job, or `None` and the number of seconds until the next
+        job is due (`None` if there are no jobs). Raises `StopIteration` once
+        stopped.
+        """
+        with self.__condition:
+            if self.__stopped:
+                raise StopIteration
+            while self.__jobs:
+                next_run, _, job = self.__jobs[0]
+                delay = next_run - time.time()
+                if delay > 0 and not job.cancelled:
+                    return None, delay
+                heapq.heappop(self.__jobs)
+                if not job.cancelled:
+                    return job, None
+            return None, None
+
+
+    def __defer(self, job):
+        """Defers a job if it would exceed the rate limits of its endpoints."""
+        now = time.time()
+        ready_at = job.ready_at(now)
+        if ready_at <= now:
+            return False
+        logger.info("[SCHEDULER] Deferring %s by %.0f seconds due to rate limits.", job.name, ready_at - now)
+        job.next_run = ready_at
+        self.__push(job)
+        return True
+
+
+    def __reschedule(self, job):
+        # Keep runs on a fixed cadence, skipping runs that were missed
+        job.next_run += job.interval
+        if job.next_run <= time.time():
+            job.next_run = time.time() + job.interval
+        self.__push(job)
+
+
+    def __run_job(self, job):
+        if self.__defer(job):
+            return
+        try:
+            job.function()
+        except Exception as e:
+            logger.exception("[SCHEDULER] Error running %s. %s", job.name, e)
+        self.__reschedule(job)
+
+
+    async def __arun_job(self, job, executor):
+        if self.__defer(job):
+            return
+        try:
+            if inspect.iscoroutinefunction(job.function):
+                await job.function()
+            else:
+                await asyncio.get_running_loop().run_in_executor(executor, job.function)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.exception("[SCHEDULER] Error running %s. %s", job.name, e)
+        self.__reschedule(job)
+
+
+    def run(self):
+        """Runs scheduled jobs until `stop` is called."""
+        while True:
+            job = self.__next_due_job()
+            if job is None:
+                return
+            self.__run_job(job)
+
+
+    async def arun(self, concurrency=1, executor=None):
+        """
+        Runs scheduled jobs from the running event loop until `stop` is
+        called or the task is cancelled, which cancels the running jobs.
+
+        Args:
+            concurrency (int): Maximum number of jobs that run at the same
+                time.
+            executor (concurrent.futures.Executor): Executor of jobs that are
+                not coroutine functions. Defaults to the loop's default
+                executor.
+        """
+        loop = asyncio.get_running_loop()
+        wakeup = asyncio.Event()
+        waiter = (loop, wakeup)
+        slots = asyncio.Semaphore(concurrency)
+        running = set()
+        with self.__condition:
+            self.__wakeups.add(waiter)
+        try:
+            while True:
+                await slots.acquire()
+                wakeup.clear()
+                try:
+                    job, delay = self.__poll()
+                except StopIteration:
+                    break
+                if job is None:
+                    slots.release()
+                    try:
+                        await asyncio.wait_for(wakeup.wait(), delay)
+                    except TimeoutError:
+                        pass
+                    continue
+
+                task = asyncio.create_task(self.__arun_job(job, executor), name=job.name)
+                running.add(task)
+                task.add_done_callback(running.discard)
+                task.add_done_callback(lambda _: slots.release())
+        finally:
+            with self.__condition:
+                self.__wakeups.discard(waiter)
+            for task in running:
+                task.cancel()
+            await asyncio.gather(*running, return_exceptions=True)
+
+
+    def cancel(self, job):
+        """
+        Stops running a job that was returned by `every`. A run of the job
+        that already started is not interrupted.
+        """
+        job.cancelled = True
+        with self.__condition:
+            self.__condition.notify_all()
+            self.__wake()
+
+
+    def stop(self):
+        """Stops the scheduler."""
+        with self.__condition:
+            self.__stopped = True
+            self.__condition.notify_all()
+            self.__wake()
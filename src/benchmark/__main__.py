@@ -0,0 +1,41 @@
+import argparse
+import json
+import logging
+from .fake_model import FakeModelServer
+from .harness import BENCHMARKS
+
+parser = argparse.ArgumentParser(
+    prog="python3 -m src.benchmark",
+    description="Benchmarks the agent offline against local stand-ins for the model provider, X (Twitter) and Discord."
+)
+parser.add_argument("benchmarks", nargs="*", metavar="BENCHMARK", help=f"benchmarks to run: {', '.join(BENCHMARKS)} (default: all)")
+parser.add_argument("--ttft", type=float, default=0.2, help="seconds before the stand-in model sends its first token")
+parser.add_argument("--tokens-per-second", type=float, default=50.0, help="tokens per second that the stand-in model generates")
+parser.add_argument("--response-tokens", type=int, default=40, help="tokens per response of the stand-in model")
+parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of model requests that fail with a 503 error")
+parser.add_argument("--seed", type=int, default=0, help="seed of the stand-in model's errors")
+parser.add_argument("--json", action="store_true", help="print results as JSON lines")
+args = parser.parse_args()
+for name in args.benchmarks:
+    if name not in BENCHMARKS:
+        parser.error(f"unknown benchmark: {name}")
+
+logging.basicConfig(format="%(levelname)s: %(message)s", level=logging.ERROR, force=True)
+
+server = FakeModelServer(
+    ttft=args.ttft,
+    tokens_per_second=args.tokens_per_second,
+    response_tokens=args.response_tokens,
+    error_rate=args.error_rate,
+    seed=args.seed
+)
+
+with server:
+    for name in args.benchmarks or BENCHMARKS:
+        for report in BENCHMARKS[name](server):
+            if args.json:
+                print(json.dumps(report))
+            else:
+                print(report.pop("benchmark"))
+                for key, value in report.items():
+                    print(f"    {key:<16}{value}")
@@ -0,0 +1,134 @@
+"""
+Checks of behavior that the benchmarks rely on but don't verify, run against
+the same local stand-ins:
+
+    python3 -m src.benchmark.checks
+"""
+import logging
+import sys
+import threading
+import time
+from tweepy import StreamRule
+from ..agent.agent_tools.twitter.twitter_stream import TwitterStream
+from .fake_twitter import FakeStreamingClient, FakeTwitterClient
+
+TAG = "agent @agent"
+
+
+def wait_until(condition, timeout=5.0):
+    """Waits until condition returns true, returns whether it did in time."""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def start_stream(stream, rules=("from:user0",), **kwargs):
+    """Runs a stream in a thread, returns the tweets it hands on and the thread."""
+    received = []
+    thread = threading.Thread(
+        target=stream.run,
+        args=(list(rules), TAG, lambda tweets, users, referenced_tweets: received.extend(tweets)),
+        kwargs=kwargs,
+        daemon=True
+    )
+    thread.start()
+    return received, thread
+
+
+def check_stream_rules():
+    """Syncing deletes stale rules of the tag, adds missing ones and keeps the rest."""
+    client = FakeStreamingClient(FakeTwitterClient([]))
+    client.add_rules([
+        StreamRule(value="from:old", tag=TAG),
+        StreamRule(value="from:kept", tag=TAG),
+        StreamRule(value="from:old", tag="agent @other"),
+    ])
+    kept = {rule["value"]: rule_id for rule_id, rule in client.rules.items() if rule["tag"] == TAG}["from:kept"]
+    stream = TwitterStream(client)
+
+    stream.sync_rules(["from:kept", "from:new"], TAG)
+    rules = {(rule["value"], rule["tag"]) for rule in client.rules.values()}
+    assert rules == {("from:kept", TAG), ("from:new", TAG), ("from:old", "agent @other")}, rules
+    assert kept in client.rules, "an unchanged rule was recreated"
+
+    ids = set(client.rules)
+    stream.sync_rules(["from:kept", "from:new"], TAG)
+    assert set(client.rules) == ids, "syncing the same rules changed them"
+
+
+def check_stream_filter():
+    """Only tweets of other users that match a rule with the stream's tag are handed on."""
+    client = FakeStreamingClient(FakeTwitterClient([]))
+    stream = TwitterStream(client)
+    received, thread = start_stream(stream, user_id="1")
+    assert client.connected.wait(5), "the stream didn't connect"
+
+    def tweet(tweet_id, author_id="1000", tags=(TAG,)):
+        return {
+            "data": {"id": tweet_id, "text": "gm", "author_id": author_id, "conversation_id": tweet_id},
+            "matching_rules": [{"id": "1", "tag": tag} for tag in tags],
+        }
+
+    client.send(tweet("10", author_id="1"))
+    client.send(tweet("11", tags=()))
+    client.send(tweet("12", tags=("agent @other",)))
+    client.send({"errors": [{"title": "operational-disconnect"}]})
+    client.send(tweet("13", tags=("agent @other", TAG)))
+    client.send(tweet("14"))
+    assert wait_until(lambda: any(tweet["id"] == "14" for tweet in received)), "the last tweet wasn't handed on"
+    stream.stop()
+    thread.join(5)
+    assert [tweet["id"] for tweet in received] == ["13", "14"], [tweet["id"] for tweet in received]
+
+
+def check_stream_reconnect():
+    """
+    Reconnections back off exponentially, and tweets are searched for (at
+    most every poll interval) once several reconnections in a row failed.
+    """
+    client = FakeStreamingClient(FakeTwitterClient([]))
+    stream = TwitterStream(client, backoff_base=0.01, backoff_max=0.04, fallback_attempts=3, poll_interval=60.0)
+    for attempt in range(6):
+        limit = min(0.04, 0.01 * 2 ** attempt)
+        delays = [stream.backoff(attempt) for _ in range(200)]
+        assert all(0 <= delay <= limit for delay in delays), f"backoff of attempt {attempt} exceeds {limit}"
+        assert max(delays) > limit / 2, f"backoff of attempt {attempt} doesn't grow to {limit}"
+
+    # The first five attempts fail, the third one starts searching
+    client.failures = 5
+    polls = []
+    _, thread = start_stream(stream, poll=lambda: polls.append(client.attempts))
+    assert client.connected.wait(5), "the stream didn't reconnect"
+    assert client.attempts == 6, client.attempts
+    assert polls == [3], f"searched after attempts {polls}, expected once after attempt 3"
+
+    # A dropped connection is reopened right away without searching
+    client.drop_connection()
+    assert wait_until(lambda: client.connections == 2), "the dropped stream wasn't reconnected"
+    assert polls == [3], f"searched after attempts {polls} although the stream reconnected"
+    stream.stop()
+    thread.join(5)
+    assert not thread.is_alive(), "the stream didn't stop"
+
+
+CHECKS = {
+    "stream_rules": check_stream_rules,
+    "stream_filter": check_stream_filter,
+    "stream_reconnect": check_stream_reconnect,
+}
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(levelname)s: %(message)s", level=logging.ERROR, force=True)
+    failed = 0
+    for name, check in CHECKS.items():
+        try:
+            check()
+            print(f"ok      {name}")
+        except AssertionError as e:
+            failed += 1
+            print(f"FAILED  {name}: {e}")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,124 @@
+import asyncio
+import itertools
+import time
+from src.agent.agent_tools.discord.discord import Discord
+
+message_ids = itertools.count(1)
+
+
+class FakeUser:
+    """A stand-in for `discord.User`."""
+
+
+    def __init__(self, user_id, name, bot=False):
+        self.id = user_id
+        self.name = name
+        self.display_name = name
+        self.bot = bot
+        self.mention = f"<@{user_id}>"
+
+
+    def __eq__(self, other):
+        return isinstance(other, FakeUser) and other.id == self.id
+
+
+    def __hash__(self):
+        return hash(self.id)
+
+
+class FakeSentMessage:
+    """A message that the agent has sent, records when it is edited."""
+
+
+    def __init__(self, channel, content, author):
+        self.id = next(message_ids)
+        self.channel = channel
+        self.content = content
+        self.author = author
+        self.edits = 0
+
+
+    async def edit(self, content=None, **kwargs):
+        self.content = content
+        self.edits += 1
+        self.channel.record("edit", self)
+        return self
+
+
+class FakeChannel:
+    """
+    A stand-in for `discord.TextChannel` that records what the agent sends.
+
+    Attributes:
+        events (list[tuple]): (time, kind, message) of every send and edit.
+    """
+
+
+    def __init__(self, channel_id, bot_user, guild=None):
+        self.id = channel_id
+        self.bot_user = bot_user
+        self.guild = guild
+        self.events = []
+
+
+    def record(self, kind, message):
+        self.events.append((time.perf_counter(), kind, message))
+
+
+    async def send(self, content=None, **kwargs):
+        message = FakeSentMessage(self, content, self.bot_user)
+        self.record("send", message)
+        return message
+
+
+class FakeGuild:
+    """A stand-in for `discord.Guild`."""
+
+
+    def __init__(self, guild_id):
+        self.id = guild_id
+
+
+class FakeMessage:
+    """A stand-in for an incoming `discord.Message`."""
+
+
+    def __init__(self, content, author, channel, mentions=(), reference=None):
+        self.id = next(message_ids)
+        self.content = content
+        self.author = author
+        self.channel = channel
+        self.guild = channel.guild
+        self.mentions = list(mentions)
+        self.reference = reference
+        self.created_at_perf = time.perf_counter()
+
+
+class BenchmarkDiscord(Discord):
+    """
+    The Discord tool without a gateway connection.
+
+    Messages are delivered by calling `on_message` directly and responses are
+    recorded by the channels of the messages.
+    """
+
+
+    def __init__(self, model, config=None, bot_user=None):
+        super().__init__(token=None, model=model, config=config)
+        self.bot_user = bot_user or FakeUser(1, "agent", bot=True)
+
+
+    @property
+    def user(self):
+        return self.bot_user
+
+
+    async def arun(self):
+        """Runs the tool as the agent does until it is cancelled, without connecting."""
+        try:
+            await asyncio.Event().wait()
+        finally:
+            for worker in self.workers:
+                worker.cancel()
+            await asyncio.gather(*self.workers, return_exceptions=True)
+            self.workers = []
@@ -0,0 +1,193 @@
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Header of an item of a batch prompt, see `model_batch.ITEM_HEADER`
+ITEM_HEADER = re.compile(r"^\[item (\w+)\]$", re.MULTILINE)
+
+
+class BenchmarkHTTPServer(ThreadingHTTPServer):
+    """A threading HTTP server that accepts many concurrent connections."""
+    daemon_threads = True
+    request_queue_size = 256
+
+
+class FakeModelServer:
+    """
+    A local stand-in for an OpenAI compatible model provider.
+
+    Serves streaming `/v1/chat/completions` requests with a configurable time
+    to first token, generation speed and error rate, so that the agent can be
+    benchmarked without network access.
+
+    Attributes:
+        ttft (float): Number of seconds before the first token is sent.
+        tokens_per_second (float): Number of tokens that are sent per second
+            after the first one.
+        response_tokens (int): Number of tokens of each response.
+        error_rate (float): Fraction of requests that fail with a 503 error.
+        slow_rate (float): Fraction of requests whose first token is sent
+            after `slow_ttft` seconds instead of `ttft`, to simulate tail
+            latency.
+        requests (int): Number of requests that have been received.
+        request_bytes (int): Number of bytes of the bodies of all requests.
+        errors (int): Number of requests that failed on purpose.
+
+    Requests with a temperature above 0 are answered with random tokens, so
+    that repeated queries get different responses. Requests for a JSON
+    object (`response_format`) are answered with a
+    response of `response_tokens` tokens for each item of a batch prompt, in
+    the format that `Model.query_batch` asks for.
+    """
+
+
+    def __init__(self, ttft=0.2, tokens_per_second=50.0, response_tokens=40, error_rate=0.0, slow_rate=0.0, slow_ttft=2.0, host="127.0.0.1", port=0, seed=None):
+        self.ttft = ttft
+        self.tokens_per_second = tokens_per_second
+        self.response_tokens = response_tokens
+        self.error_rate = error_rate
+        self.slow_rate = slow_rate
+        self.slow_ttft = slow_ttft
+        self.requests = 0
+        self.request_bytes = 0
+        self.errors = 0
+        self.__random = random.Random(seed)
+        self.__lock = threading.Lock()
+        self.__server = BenchmarkHTTPServer((host, port), self.__handler())
+        self.__thread = None
+
+
+    @property
+    def base_url(self):
+        """Base URL that is passed to the OpenAI client."""
+        host, port = self.__server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+
+    def start(self):
+        """Starts serving requests on a background thread."""
+        self.__thread = threading.Thread(target=self.__server.serve_forever, daemon=True)
+        self.__thread.start()
+        return self
+
+
+    def stop(self):
+        """Stops the server."""
+        self.__server.shutdown()
+        self.__server.server_close()
+
+
+    def __enter__(self):
+        return self.start()
+
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+    def record_request(self, length=0):
+        """
+        Counts a request and returns whether it should fail and the time to
+        its first token.
+        """
+        with self.__lock:
+            self.requests += 1
+            self.request_bytes += length
+            fail = self.__random.random() < self.error_rate
+            if fail:
+                self.errors += 1
+            ttft = self.slow_ttft if self.__random.random() < self.slow_rate else self.ttft
+            return fail, ttft
+
+
+    def random_token(self):
+        """Returns a random token number."""
+        with self.__lock:
+            return self.__random.randrange(10000)
+
+
+    def __handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+
+            def log_message(self, *args):
+                pass
+
+
+            def do_POST(self):
+                length = int(self.headers.get("content-length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+
+                fail, ttft = server.record_request(length)
+                if fail:
+                    body = b'{"error": {"message": "Service unavailable"}}'
+                    self.send_response(503)
+                    self.send_header("content-type", "application/json")
+                    self.send_header("content-length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                    return
+
+                # Clients close streams that they don't need anymore (e.g.
+                # the slower response of a hedged request)
+                try:
+                    self.send_response(200)
+                    self.send_header("content-type", "text/event-stream")
+                    self.send_header("transfer-encoding", "chunked")
+                    self.end_headers()
+
+                    time.sleep(ttft)
+                    interval = 1.0 / server.tokens_per_second if server.tokens_per_second else 0.0
+                    for i, token in enumerate(self.__tokens(request)):
+                        if i:
+                            time.sleep(interval)
+                        self.__send_event(request.get("model", "fake"), token)
+                    self.__send_event(request.get("model", "fake"), None, finish_reason="stop")
+                    self.__send_chunk(b"data: [DONE]\n\n")
+                    self.wfile.write(b"0\r\n\r\n")
+                    self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    self.close_connection = True
+
+
+            def __tokens(self, request):
+                """Returns the tokens of the response to a request."""
+                if request.get("temperature"):
+                    tokens = [f"tok{server.random_token()} " for _ in range(server.response_tokens)]
+                else:
+                    tokens = [f"tok{i} " for i in range(server.response_tokens)]
+                if "response_format" not in request:
+                    return tokens
+                # One response per batch item, streamed in pieces of the size
+                # of a token
+                prompt = request["messages"][-1]["content"]
+                ids = ITEM_HEADER.findall(prompt) or ["1"]
+                body = json.dumps({"responses": [{"id": item_id, "response": "".join(tokens).strip()} for item_id in ids]})
+                size = len(tokens[0]) if tokens else len(body)
+                return [body[start:start + size] for start in range(0, len(body), size)]
+
+
+            def __send_event(self, model, content, finish_reason=None):
+                delta = {} if content is None else {"content": content}
+                event = {
+                    "id": "chatcmpl-benchmark",
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+                }
+                self.__send_chunk(f"data: {json.dumps(event)}\n\n".encode())
+
+
+            def __send_chunk(self, data):
+                self.wfile.write(b"%x\r\n" % len(data) + data + b"\r\n")
+                self.wfile.flush()
+
+        return Handler
@@ -0,0 +1,264 @@
+import datetime
+import itertools
+import json
+import queue
+import re
+import threading
+import time
+
+FROM_PATTERN = re.compile(r"from:(\w+)")
+
+
+class FakeTwitterClient:
+    """
+    A local stand-in for the X API v2 client.
+
+    Implements the `search_recent_tweets`, `create_tweet` and `get_me` methods
+    of `tweepy.Client` (with `return_type=dict`), backed by synthetic threads
+    of key users, with a configurable latency per request.
+
+    Attributes:
+        latency (float): Number of seconds that each request takes.
+        posts (list[dict]): Tweets that have been created.
+        requests (dict): Number of requests per method.
+    """
+
+
+    def __init__(self, key_users, latency=0.05, username="agent", user_id="1"):
+        self.key_users = list(key_users)
+        self.latency = latency
+        self.username = username
+        self.user_id = user_id
+        self.posts = []
+        self.requests = {"search_recent_tweets": 0, "create_tweet": 0, "get_me": 0}
+        # Times at which tweets were added, by id
+        self.published = {}
+        self.streams = []
+        self.__users = {
+            username: str(1000 + i) for i, username in enumerate(self.key_users)
+        }
+        self.__tweets = []
+        self.__ids = itertools.count(10**15)
+        self.__lock = threading.Lock()
+
+
+    def add_threads(self, threads_per_user=1, tweets_per_thread=3, users=None):
+        """
+        Posts new threads by every key user.
+
+        Each thread is a tweet followed by replies of the same author to their
+        previous tweet. Only `users` post threads if it is given. New tweets
+        are also sent to the filtered streams that match them. Returns the
+        number of tweets that have been added.
+        """
+        now = datetime.datetime.now(datetime.timezone.utc)
+        added = 0
+        new = []
+        with self.__lock:
+            for username, author_id in self.__users.items():
+                if users is not None and username not in users:
+                    continue
+                for _ in range(threads_per_user):
+                    conversation_id = None
+                    previous_id = None
+                    for position in range(tweets_per_thread):
+                        tweet_id = str(next(self.__ids))
+                        conversation_id = conversation_id or tweet_id
+                        tweet = {
+                            "id": tweet_id,
+                            "text": f"Thoughts from {username}, part {position + 1}: the market is moving.",
+                            "author_id": author_id,
+                            "conversation_id": conversation_id,
+                            "created_at": (now + datetime.timedelta(milliseconds=added)).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z",
+                            "public_metrics": {"retweet_count": 0, "reply_count": 0, "like_count": 0, "quote_count": 0},
+                        }
+                        if previous_id:
+                            tweet["referenced_tweets"] = [{"type": "replied_to", "id": previous_id}]
+                        self.__tweets.append(tweet)
+                        self.published[tweet_id] = time.perf_counter()
+                        previous_id = tweet_id
+                        added += 1
+                        new.append((tweet, {"id": author_id, "username": username}))
+        for stream in self.streams:
+            for tweet, user in new:
+                stream.publish(tweet, user)
+        return added
+
+
+    def __request(self, method):
+        with self.__lock:
+            self.requests[method] += 1
+        time.sleep(self.latency)
+
+
+    def get_me(self, **kwargs):
+        self.__request("get_me")
+        return {"data": {"id": self.user_id, "name": self.username, "username": self.username}}
+
+
+    def search_recent_tweets(self, query, since_id=None, start_time=None, next_token=None, max_results=10, **kwargs):
+        self.__request("search_recent_tweets")
+        usernames = set(FROM_PATTERN.findall(query))
+        author_ids = {self.__users[name] for name in usernames if name in self.__users}
+
+        with self.__lock:
+            matches = [
+                tweet for tweet in reversed(self.__tweets)
+                if tweet["author_id"] in author_ids
+                and (since_id is None or int(tweet["id"]) > int(since_id))
+            ]
+
+        offset = int(next_token) if next_token else 0
+        page = matches[offset:offset + max_results]
+        if not page:
+            return {"meta": {"result_count": 0}}
+
+        authors = {tweet["author_id"] for tweet in page}
+        meta = {
+            "result_count": len(page),
+            "newest_id": matches[0]["id"],
+            "oldest_id": page[-1]["id"],
+        }
+        if offset + max_results < len(matches):
+            meta["next_token"] = str(offset + max_results)
+        return {
+            "data": [dict(tweet) for tweet in page],
+            "includes": {
+                "users": [
+                    {"id": author_id, "username": name}
+                    for name, author_id in self.__users.items() if author_id in authors
+                ]
+            },
+            "meta": meta,
+        }
+
+
+    def create_tweet(self, text=None, in_reply_to_tweet_id=None, quote_tweet_id=None, **kwargs):
+        self.__request("create_tweet")
+        tweet_id = str(next(self.__ids))
+        with self.__lock:
+            self.posts.append({
+                "id": tweet_id,
+                "text": text,
+                "in_reply_to_tweet_id": in_reply_to_tweet_id,
+                "quote_tweet_id": quote_tweet_id,
+                "posted_at": time.perf_counter(),
+            })
+        return {"data": {"id": tweet_id, "text": text}}
+
+
+class FakeStreamingClient:
+    """
+    A local stand-in for the X API v2 filtered stream.
+
+    Implements the methods of `tweepy.StreamingClient` (with
+    `return_type=dict`) that `TwitterStream` uses. Tweets that are added to
+    the `FakeTwitterClient` and match a rule are delivered to the listener as
+    raw stream data while the stream is connected, tweets that are added
+    while it is disconnected are lost, like on the real stream.
+
+    Attributes:
+        rules (dict): Rules of the stream by id.
+        attempts (int): Number of times the stream was opened.
+        connections (int): Number of times the stream was connected.
+        failures (int): Number of upcoming attempts that fail to connect.
+    """
+
+
+    def __init__(self, twitter):
+        self.listener = None
+        self.rules = {}
+        self.attempts = 0
+        self.connections = 0
+        self.failures = 0
+        self.connected = threading.Event()
+        self.__ids = itertools.count(1)
+        self.__data = None
+        self.__lock = threading.Lock()
+        twitter.streams.append(self)
+
+
+    def get_rules(self, **kwargs):
+        with self.__lock:
+            return {"data": [dict(rule) for rule in self.rules.values()], "meta": {"result_count": len(self.rules)}}
+
+
+    def add_rules(self, add, **kwargs):
+        with self.__lock:
+            added = []
+            for rule in add:
+                rule_id = str(next(self.__ids))
+                self.rules[rule_id] = {"id": rule_id, "value": rule.value, "tag": rule.tag}
+                added.append(self.rules[rule_id])
+        return {"data": added, "meta": {"summary": {"created": len(added)}}}
+
+
+    def delete_rules(self, ids, **kwargs):
+        with self.__lock:
+            for rule_id in ids:
+                self.rules.pop(rule_id, None)
+        return {"meta": {"summary": {"deleted": len(ids)}}}
+
+
+    def publish(self, tweet, user):
+        """Delivers a tweet to the listener if it matches a rule."""
+        with self.__lock:
+            data = self.__data
+            matching_rules = [
+                {"id": rule["id"], "tag": rule["tag"]}
+                for rule in self.rules.values()
+                if user["username"] in FROM_PATTERN.findall(rule["value"])
+            ]
+        if data is None or not matching_rules:
+            return
+        data.put(json.dumps({
+            "data": dict(tweet),
+            "includes": {"users": [user]},
+            "matching_rules": matching_rules,
+        }).encode())
+
+
+    def send(self, data):
+        """Delivers raw stream data to the listener while the stream is connected."""
+        with self.__lock:
+            lines = self.__data
+        if lines is not None:
+            lines.put(json.dumps(data).encode())
+
+
+    def filter(self, **kwargs):
+        with self.__lock:
+            self.attempts += 1
+            failed = self.failures > 0
+            self.failures -= failed
+        if failed:
+            # Like tweepy once it gives up reconnecting
+            self.listener.on_connection_error()
+            return
+
+        data = queue.Queue()
+        with self.__lock:
+            self.__data = data
+            self.connections += 1
+        self.listener.on_connect()
+        self.connected.set()
+        try:
+            while True:
+                line = data.get()
+                if line is None:
+                    return
+                self.listener.on_data(line)
+        finally:
+            self.connected.clear()
+
+
+    def drop_connection(self):
+        """Closes the connection of the stream, as the X API does at times."""
+        with self.__lock:
+            data, self.__data = self.__data, None
+        if data is not None:
+            data.put(None)
+
+
+    def disconnect(self):
+        self.drop_connection()
@@ -0,0 +1,662 @@
+import asyncio
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from src.agent.agent import Agent
+from src.agent.agent_config import AgentConfig
+from src.agent.agent_tools.discord.discord_config import DiscordConfig
+from src.agent.agent_tools.model.model import Model
+from src.agent.agent_tools.model.model_config import ModelConfig
+from src.agent.agent_tools.twitter.twitter import Twitter
+from src.agent.agent_tools.twitter.twitter_config import TwitterConfig
+from src.agent.metrics import get_registry
+from src.agent.scheduler import Scheduler
+from .fake_discord import BenchmarkDiscord, FakeChannel, FakeGuild, FakeMessage, FakeUser
+from .fake_model import FakeModelServer
+from .fake_twitter import FakeStreamingClient, FakeTwitterClient
+
+
+def percentile(values, fraction):
+    """Returns the nearest-rank percentile of values."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+class Measurement:
+    """
+    Measures the latencies of operations and the resources that a benchmark
+    uses while it runs.
+    """
+
+
+    def __init__(self, name):
+        self.name = name
+        self.latencies = []
+        self.ttfts = []
+        self.errors = 0
+        self.operations = 0
+        self.extra = {}
+        self.__lock = threading.Lock()
+
+
+    def __enter__(self):
+        self.__wall = time.perf_counter()
+        self.__cpu = time.process_time()
+        return self
+
+
+    def __exit__(self, *args):
+        self.wall = time.perf_counter() - self.__wall
+        self.cpu = time.process_time() - self.__cpu
+        # ru_maxrss is reported in kilobytes on Linux
+        self.max_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+    def record(self, latency, ttft=None):
+        with self.__lock:
+            self.operations += 1
+            self.latencies.append(latency)
+            if ttft is not None:
+                self.ttfts.append(ttft)
+
+
+    def record_error(self):
+        with self.__lock:
+            self.errors += 1
+
+
+    def report(self):
+        """Returns the results of the benchmark as a dictionary."""
+        def ms(value):
+            return None if value is None else round(value * 1000, 1)
+
+        report = {
+            "benchmark": self.name,
+            "operations": self.operations,
+            "errors": self.errors,
+            "wall_s": round(self.wall, 3),
+            "ops_per_s": round(self.operations / self.wall, 2) if self.wall else None,
+            "p50_ms": ms(percentile(self.latencies, 0.50)),
+            "p95_ms": ms(percentile(self.latencies, 0.95)),
+            "p99_ms": ms(percentile(self.latencies, 0.99)),
+            "cpu_s": round(self.cpu, 3),
+            "cpu_util": round(self.cpu / self.wall, 3) if self.wall else None,
+            "max_rss_mb": round(self.max_rss_mb, 1),
+        }
+        if self.ttfts:
+            report["ttft_p50_ms"] = ms(percentile(self.ttfts, 0.50))
+            report["ttft_p95_ms"] = ms(percentile(self.ttfts, 0.95))
+            report["ttft_p99_ms"] = ms(percentile(self.ttfts, 0.99))
+        report.update(self.extra)
+        return report
+
+
+def build_model(server):
+    """Returns a model that queries the stand-in model server, uncached."""
+    config = ModelConfig()
+    config.BASE_URL = server.base_url
+    config.MODEL = "benchmark"
+    config.RETRY_BACKOFF_BASE = 0.05
+    return Model(api_key="benchmark", cache=None, config=config)
+
+
+def bench_model(server, queries=200, concurrency=16):
+    """Sends queries to the model from a thread pool and from an event loop."""
+    model = build_model(server)
+    reports = []
+
+    # Synchronous queries, as made by the Twitter tool
+    with Measurement("model.query") as measurement:
+        def run(i):
+            start = time.perf_counter()
+            try:
+                model.query(f"Benchmark query {i}")
+                measurement.record(time.perf_counter() - start)
+            except Exception:
+                measurement.record_error()
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(run, range(queries)))
+    reports.append(measurement.report())
+
+    # Asynchronous queries, as made by the Discord tool
+    async def run_async():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run(i):
+            async with semaphore:
+                start = time.perf_counter()
+                ttft = None
+                try:
+                    async for _ in model.astream(f"Benchmark query {i}"):
+                        if ttft is None:
+                            ttft = time.perf_counter() - start
+                    measurement.record(time.perf_counter() - start, ttft)
+                except Exception:
+                    measurement.record_error()
+
+        await asyncio.gather(*[run(i) for i in range(queries)])
+        await model.aclose()
+
+    with Measurement("model.astream") as measurement:
+        asyncio.run(run_async())
+    reports.append(measurement.report())
+    return reports
+
+
+def bench_routing(server, queries=200, concurrency=8, slow_rate=0.03):
+    """
+    Routes queries across stand-in endpoints with a slow tail, one of which
+    is down, with and without hedged requests.
+    """
+    servers = [
+        FakeModelServer(error_rate=1.0, seed=0),
+        FakeModelServer(server.ttft, server.tokens_per_second, server.response_tokens, slow_rate=slow_rate, slow_ttft=max(1.0, 10 * server.ttft), seed=1),
+        FakeModelServer(server.ttft, server.tokens_per_second, server.response_tokens, slow_rate=slow_rate, slow_ttft=max(1.0, 10 * server.ttft), seed=2),
+    ]
+    for endpoint_server in servers:
+        endpoint_server.start()
+
+    def counter_total(name):
+        return sum(get_registry().summary().get(name, {}).values())
+
+    reports = []
+    try:
+        for hedge in (False, True):
+            config = ModelConfig()
+            config.ENDPOINTS = [{"base_url": endpoint_server.base_url, "model": "benchmark"} for endpoint_server in servers]
+            config.HEDGE_REQUESTS = hedge
+            config.RETRY_BACKOFF_BASE = 0.05
+            model = Model(api_key="benchmark", cache=None, config=config)
+
+            def run(i):
+                start = time.perf_counter()
+                try:
+                    model.query(f"Benchmark query {i}")
+                    measurement.record(time.perf_counter() - start)
+                except Exception:
+                    measurement.record_error()
+
+            # Warm up, so that the hedge delay is derived from measurements
+            measurement = Measurement("warmup")
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                list(executor.map(run, range(50)))
+
+            failovers = counter_total("model_failovers_total")
+            hedged = get_registry().summary().get("model_hedged_requests_total", {}).get('{outcome="sent"}', 0)
+            with Measurement("model.routing" + (".hedged" if hedge else "")) as measurement:
+                with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                    list(executor.map(run, range(queries)))
+            measurement.extra.update({
+                "failovers": counter_total("model_failovers_total") - failovers,
+                "hedged": get_registry().summary().get("model_hedged_requests_total", {}).get('{outcome="sent"}', 0) - hedged,
+            })
+            reports.append(measurement.report())
+            model.close()
+    finally:
+        for endpoint_server in servers:
+            endpoint_server.stop()
+    return reports
+
+
+def bench_twitter(server, key_users=50, threads_per_user=2, responses_per_run=20, latency=0.05, model=None, response_batch_size=1):
+    """Runs `Twitter.respond_to_key_users` against the stand-in X API."""
+    own_model = model is None
+    model = model or build_model(server)
+    usernames = [f"user{i}" for i in range(key_users)]
+    client = FakeTwitterClient(usernames, latency=latency)
+    tweets = client.add_threads(threads_per_user=threads_per_user)
+
+    config = TwitterConfig()
+    config.KEY_USERS = usernames
+    config.RESPONSES_PER_RUN = responses_per_run
+    config.RESPONSE_BATCH_SIZE = response_batch_size
+    config.POST_INTERVAL = 0.0
+    config.STATE_PATH = ":memory:"
+    twitter = Twitter(None, None, None, None, None, model=model, config=config, client=client)
+
+    requests, request_bytes = server.requests, server.request_bytes
+    name = "twitter.respond_to_key_users" + (".batched" if response_batch_size > 1 else "")
+    with Measurement(name) as measurement:
+        start = time.perf_counter()
+        twitter.respond_to_key_users()
+        for post in client.posts:
+            measurement.record(post["posted_at"] - start)
+    if own_model:
+        model.close()
+
+    measurement.extra.update({
+        "tweets": tweets,
+        "posts": len(client.posts),
+        "search_requests": client.requests["search_recent_tweets"],
+        "model_requests": server.requests - requests,
+        "model_request_kb": round((server.request_bytes - request_bytes) / 1024, 1),
+    })
+    return [measurement.report()]
+
+
+def bench_twitter_batch(server, key_users=50, responses_per_run=40, response_batch_size=8):
+    """
+    Responds to key users with one model query per conversation and with
+    several conversations per query.
+    """
+    reports = []
+    for batch_size in (1, response_batch_size):
+        reports.extend(bench_twitter(server, key_users=key_users, responses_per_run=responses_per_run, response_batch_size=batch_size))
+    return reports
+
+
+def bench_twitter_post(server, posts=5, pool_size=5, latency=0.05):
+    """
+    Makes posts with each post generated when it is due and with posts taken
+    from a filled post pool.
+    """
+    # Responses of the stand-in model that fit into a post
+    post_server = FakeModelServer(server.ttft, server.tokens_per_second, response_tokens=min(server.response_tokens, 30), seed=0).start()
+    reports = []
+    for size in (0, pool_size):
+        model = build_model(post_server)
+        client = FakeTwitterClient(["user0"], latency=latency)
+        config = TwitterConfig()
+        config.KEY_USERS = ["user0"]
+        config.POST_MODE = True
+        config.POST_POOL_SIZE = size
+        config.POST_POOL_SIMILARITY = 0.9
+        config.POST_INTERVAL = 0.0
+        config.STATE_PATH = ":memory:"
+        twitter = Twitter(None, None, None, None, None, model=model, config=config, client=client)
+
+        filled = None
+        if twitter.post_pool is not None:
+            # Fill the pool while the model is idle, as between scheduled posts
+            start = time.perf_counter()
+            twitter.post_pool.fill()
+            filled = round(time.perf_counter() - start, 3)
+
+        with Measurement("twitter.post" + (".pooled" if size else "")) as measurement:
+            for _ in range(posts):
+                start = time.perf_counter()
+                if twitter.make_post():
+                    measurement.record(time.perf_counter() - start)
+                else:
+                    measurement.record_error()
+        twitter.stop()
+        model.close()
+
+        sources = get_registry().summary().get("twitter_post_source_total", {})
+        measurement.extra.update({
+            "pool_size": size,
+            "pool_fill_s": filled,
+            "posts_from_pool": sum(count for labels, count in sources.items() if "pool" in labels),
+        })
+        reports.append(measurement.report())
+    post_server.stop()
+    return reports
+
+
+def bench_twitter_stream(server, key_users=20, threads=20, interval=0.5, batch_window=0.5, latency=0.05, model=None):
+    """
+    Posts threads of key users one by one to the stand-in filtered stream and
+    measures the time until the agent responds to each of them. The stream
+    is dropped once halfway through to measure reconnections.
+    """
+    own_model = model is None
+    model = model or build_model(server)
+    usernames = [f"user{i}" for i in range(key_users)]
+    client = FakeTwitterClient(usernames, latency=latency)
+    stream_client = FakeStreamingClient(client)
+
+    config = TwitterConfig()
+    config.KEY_USERS = usernames
+    config.RESPONSES_PER_RUN = threads
+    config.POST_INTERVAL = 0.0
+    config.STATE_PATH = ":memory:"
+    config.FILTERED_STREAM = True
+    config.STREAM_BATCH_WINDOW = batch_window
+    config.STREAM_BACKOFF_BASE = 0.1
+    scheduler = Scheduler()
+    twitter = Twitter(None, None, None, None, None, model=model, config=config, client=client, scheduler=scheduler, stream_client=stream_client)
+
+    with Measurement("twitter.stream") as measurement:
+        # The stream job responds to the streamed tweets
+        twitter.run()
+        threading.Thread(target=scheduler.run, daemon=True).start()
+        stream_client.connected.wait(5)
+        for i in range(threads):
+            if i == threads // 2:
+                stream_client.drop_connection()
+                time.sleep(0.05)
+                stream_client.connected.wait(5)
+            client.add_threads(users=[usernames[i % key_users]])
+            time.sleep(interval)
+
+        deadline = time.monotonic() + 30
+        while len(client.posts) < threads and time.monotonic() < deadline:
+            time.sleep(0.05)
+        twitter.stop()
+        scheduler.stop()
+
+        for post in client.posts:
+            measurement.record(post["posted_at"] - client.published[post["in_reply_to_tweet_id"]])
+        measurement.errors = threads - len(client.posts)
+    if own_model:
+        model.close()
+
+    measurement.extra.update({
+        "threads": threads,
+        "posts": len(client.posts),
+        "connections": stream_client.connections,
+        "search_requests": client.requests["search_recent_tweets"],
+    })
+    return [measurement.report()]
+
+
+# Messages that are sent over and over again with small changes, see
+# `bench_discord_duplicates`
+COMMON_MESSAGES = [
+    "gm",
+    "GM fam!!",
+    "wen token launch?",
+    "What is the best way to stake my tokens on the platform?",
+    "Huge airdrop live now, claim yours at https://example.com/claim",
+]
+
+
+# Words of the distinct messages of `bench_discord_duplicates`
+MESSAGE_WORDS = (
+    "agent model token stake bridge wallet proposal vote chain fee reward "
+    "governance airdrop roadmap launch community validator liquidity pool "
+    "swap yield audit contract gas network upgrade node release price"
+).split()
+
+
+def bench_discord(server, messages=200, channels=20, users=None, stream_mode=True, model=None, duplicate_action=None, duplicate_rate=0.0):
+    """
+    Delivers a burst of messages of `users` users (one per channel by default)
+    to `Discord.on_message`. A `duplicate_rate` fraction of the messages are
+    variants of a few common messages.
+    """
+    own_model = model is None
+    model = model or build_model(server)
+    config = DiscordConfig()
+    config.STREAM_MODE = stream_mode
+    config.DUPLICATE_ACTION = duplicate_action
+    discord = BenchmarkDiscord(model, config=config)
+    guild = FakeGuild(1)
+    users = [FakeUser(100 + i, f"user{i}") for i in range(users or channels)]
+
+    # Every message gets its own channel object (channels share ids), so that
+    # the responses to each message can be told apart
+    def content(i):
+        if (i * duplicate_rate) % 1 + duplicate_rate >= 1:
+            common = COMMON_MESSAGES[i % len(COMMON_MESSAGES)]
+            return common + "!" * (i % 3)
+        if not duplicate_rate:
+            return f"Benchmark message {i}, what do you think?"
+        # Distinct messages differ in more than a number
+        words = random.Random(i).sample(MESSAGE_WORDS, 8)
+        return f"Benchmark message {i}: " + " ".join(words) + "?"
+
+    incoming = [
+        FakeMessage(
+            content(i),
+            users[i % len(users)],
+            FakeChannel(10 + i % channels, discord.user, guild)
+        )
+        for i in range(messages)
+    ]
+
+    async def run():
+        await asyncio.gather(*[discord.on_message(message) for message in incoming])
+        await discord.queue.join()
+        if own_model:
+            await model.aclose()
+
+    coalesced = discord.coalesced_metric.value()
+    dropped = sum(discord.dropped_metric.value(reason=reason) for reason in ("queue_full", "stale"))
+    requests = server.requests
+    name = "discord.on_message" + (f".{duplicate_action}" if duplicate_action else "")
+    with Measurement(name) as measurement:
+        asyncio.run(run())
+    coalesced = discord.coalesced_metric.value() - coalesced
+    dropped = sum(discord.dropped_metric.value(reason=reason) for reason in ("queue_full", "stale")) - dropped
+
+    # Message to reply latency is measured up to the last send or edit of the
+    # response, time to first visible byte up to the first send. Coalesced
+    # messages are answered in the channel of the last message of their batch
+    unanswered = 0
+    for message in incoming:
+        events = [timestamp for timestamp, _, _ in message.channel.events]
+        if events:
+            measurement.record(max(events) - message.created_at_perf, min(events) - message.created_at_perf)
+        else:
+            unanswered += 1
+    for _ in range(max(0, unanswered - coalesced - dropped)):
+        measurement.record_error()
+    measurement.extra.update({
+        "edits": sum(1 for message in incoming for _, kind, _ in message.channel.events if kind == "edit"),
+        "coalesced": coalesced,
+        "dropped": dropped,
+    })
+    if duplicate_rate:
+        measurement.extra.update({
+            "duplicates": sum(discord.duplicates_metric.value(action=action) for action in ("reuse", "skip")) if discord.duplicates is not None else 0,
+            "model_requests": server.requests - requests,
+        })
+    return [measurement.report()]
+
+
+def bench_discord_duplicates(server, messages=100, channels=5, duplicate_rate=0.5):
+    """
+    Delivers a burst of messages of different users in a few channels, of
+    which many are near-duplicates, once responding to all of them and once
+    reusing earlier responses.
+    """
+    reports = []
+    for action in (None, "reuse"):
+        reports.extend(bench_discord(server, messages=messages, channels=channels, users=messages, duplicate_action=action, duplicate_rate=duplicate_rate))
+    return reports
+
+
+class BenchmarkAgent(Agent):
+    """
+    The agent without loading its configuration, environment variables and
+    tools. Stand-in tools are added to `tools` before `arun` is called, and
+    they share the agent's scheduler and executor.
+    """
+
+
+    def __init__(self, model, config=None):
+        self.config = config or AgentConfig()
+        self.config.METRICS_LOG_INTERVAL = None
+        self.model = model
+        self.scheduler = Scheduler()
+        self.executor = ThreadPoolExecutor(max_workers=self.config.EXECUTOR_THREADS, thread_name_prefix="agent-io")
+        self.tools = {}
+
+
+def bench_agent(server, messages=200, channels=20, key_users=50, responses_per_run=20, latency=0.05):
+    """
+    Runs `Agent.arun` with the Twitter and Discord tools and one shared
+    model. Twitter responds to key users while a burst of messages is
+    delivered to Discord, and the agent is stopped once both are done.
+    """
+    model = build_model(server)
+    agent = BenchmarkAgent(model)
+
+    usernames = [f"user{i}" for i in range(key_users)]
+    client = FakeTwitterClient(usernames, latency=latency)
+    client.add_threads(threads_per_user=2)
+    config = TwitterConfig()
+    config.KEY_USERS = usernames
+    config.RESPONSES_PER_RUN = responses_per_run
+    config.POST_INTERVAL = 0.0
+    config.STATE_PATH = ":memory:"
+    agent.tools["twitter"] = Twitter(None, None, None, None, None, model=model, config=config, client=client, scheduler=agent.scheduler, executor=agent.executor)
+    discord = BenchmarkDiscord(model)
+    agent.tools["discord"] = discord
+
+    guild = FakeGuild(1)
+    users = [FakeUser(100 + i, f"user{i}") for i in range(channels)]
+    incoming = [
+        FakeMessage(
+            f"Benchmark message {i}, what do you think?",
+            users[i % channels],
+            FakeChannel(10 + i % channels, discord.user, guild)
+        )
+        for i in range(messages)
+    ]
+
+    async def run():
+        agent_task = asyncio.create_task(agent.arun())
+        await asyncio.gather(*[discord.on_message(message) for message in incoming])
+        await discord.queue.join()
+        deadline = time.monotonic() + 60
+        while len(client.posts) < responses_per_run and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        # Cancelling the agent stops it like SIGTERM, which closes the model
+        agent_task.cancel()
+        await asyncio.gather(agent_task, return_exceptions=True)
+
+    coalesced = discord.coalesced_metric.value()
+    dropped = sum(discord.dropped_metric.value(reason=reason) for reason in ("queue_full", "stale"))
+    requests = server.requests
+    with Measurement("agent") as measurement:
+        start = time.perf_counter()
+        asyncio.run(run())
+    requests = server.requests - requests
+    coalesced = discord.coalesced_metric.value() - coalesced
+    dropped = sum(discord.dropped_metric.value(reason=reason) for reason in ("queue_full", "stale")) - dropped
+
+    # Every posted response and every answered message is an operation
+    for post in client.posts:
+        measurement.record(post["posted_at"] - start)
+    unanswered = 0
+    for message in incoming:
+        events = [timestamp for timestamp, _, _ in message.channel.events]
+        if events:
+            measurement.record(max(events) - message.created_at_perf)
+        else:
+            unanswered += 1
+    for _ in range(max(0, responses_per_run - len(client.posts)) + max(0, unanswered - coalesced - dropped)):
+        measurement.record_error()
+
+    measurement.extra.update({
+        "posts": len(client.posts),
+        "replies": messages - unanswered,
+        "coalesced": coalesced,
+        "dropped": dropped,
+        "model_requests": requests,
+    })
+    return [measurement.report()]
+
+
+# Started in a fresh interpreter by `bench_startup`, prints the timings of one
+# startup as JSON
+STARTUP_SCRIPT = """
+import json
+import time
+start = time.perf_counter()
+from src.agent.agent import Agent
+imported = time.perf_counter()
+
+# Twitter refuses to start without key users
+from src.agent.agent_tools.twitter.twitter_config import TwitterConfig
+from src.agent.metrics import get_registry
+from src.agent.scheduler import Scheduler
+twitter_config_init = TwitterConfig.__init__
+def init_twitter_config(self):
+    twitter_config_init(self)
+    self.KEY_USERS = ["benchmark"]
+TwitterConfig.__init__ = init_twitter_config
+
+initialize = time.perf_counter()
+agent = Agent()
+initialized = time.perf_counter()
+print(json.dumps({
+    "import": imported - start,
+    "init": initialized - initialize,
+    "tools": sorted(agent.tools),
+}))
+"""
+
+
+def bench_startup(server, runs=5):
+    """
+    Starts the agent in fresh interpreters and measures how long it takes to
+    import and initialize it with all tools enabled.
+
+    Tools are given placeholder credentials and the agent is not run, so no
+    requests are made.
+    """
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    env = dict(os.environ)
+    env.update({
+        "PYTHONPATH": root,
+        "MODEL_API_KEY": "benchmark",
+        "DISCORD_TOKEN": "benchmark",
+        "TWITTER_BEARER_TOKEN": "benchmark",
+        "TWITTER_CONSUMER_KEY": "benchmark",
+        "TWITTER_CONSUMER_SECRET": "benchmark",
+        "TWITTER_ACCESS_TOKEN": "benchmark",
+        "TWITTER_ACCESS_TOKEN_SECRET": "benchmark",
+    })
+
+    imports = []
+    inits = []
+    tools = []
+    with Measurement("agent.startup") as measurement:
+        # The agent's state files are written to a temporary directory
+        with tempfile.TemporaryDirectory() as directory:
+            for _ in range(runs):
+                start = time.perf_counter()
+                result = subprocess.run(
+                    [sys.executable, "-c", STARTUP_SCRIPT],
+                    cwd=directory,
+                    env=env,
+                    capture_output=True,
+                    text=True
+                )
+                latency = time.perf_counter() - start
+                if result.returncode:
+                    measurement.record_error()
+                    continue
+                timings = json.loads(result.stdout.strip().splitlines()[-1])
+                measurement.record(latency)
+                imports.append(timings["import"])
+                inits.append(timings["init"])
+                tools = timings["tools"]
+
+    def ms(value):
+        return None if value is None else round(value * 1000, 1)
+
+    measurement.extra.update({
+        "import_p50_ms": ms(percentile(imports, 0.50)),
+        "init_p50_ms": ms(percentile(inits, 0.50)),
+        "tools": ",".join(tools),
+    })
+    return [measurement.report()]
+
+
+BENCHMARKS = {
+    "model": bench_model,
+    "routing": bench_routing,
+    "twitter": bench_twitter,
+    "twitter_batch": bench_twitter_batch,
+    "twitter_post": bench_twitter_post,
+    "twitter_stream": bench_twitter_stream,
+    "discord": bench_discord,
+    "discord_duplicates": bench_discord_duplicates,
+    "agent": bench_agent,
+    "startup": bench_startup,
+}